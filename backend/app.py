@@ -1,28 +1,100 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Request
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request, WebSocket, WebSocketDisconnect
+from typing import List, Optional
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from ultralytics import YOLO
+from fastapi.responses import StreamingResponse, PlainTextResponse, FileResponse, JSONResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException as StarletteHTTPException
+import asyncio
+import json
+import mimetypes
 import uuid
 import os
 import shutil
-from pymongo import MongoClient
-from datetime import datetime
+import tempfile
+import threading
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 load_dotenv()
 
 # --- Local Imports ---
-from image_ocr import process_image_file, detections_collection as image_detections_collection
-from video_ocr import process_video_file, detections_collection as video_detections_collection
+from startup import startup_timer
+from detection_store import (
+    detections_collection, close_mongo_client, detection_writer, ensure_indexes, backfill_rollups, read_stats, read_hourly_stats,
+    recent_processing_times,
+)
+from artifacts import artifact_writer, artifact_key, render_artifact
+from result_store import result_store, is_result_id, RetentionSweeper, RESULTS_DIR, TEMP_DIR
+from metrics import timed, STAGE_SECONDS, register_gauge, render_metrics, percentiles
+from inference_pool import (
+    InferenceExecutor, ExecutorSaturated, ExecutorUnavailable, INFERENCE_RETRY_AFTER,
+    INFERENCE_EXECUTOR, INFERENCE_WORKERS, VIDEO_ENGINE,
+    worker_initializer, worker_threads, init_thread_worker,
+    process_image_job, process_image_batch_job, process_video_job,
+)
+from image_ocr import IMAGE_BATCH_SIZE
+from bulk_images import iter_upload_images, take
+from uploads import (
+    RequestUpload, UploadTooLarge, InvalidUpload, save_upload, read_limited,
+    MAX_IMAGE_UPLOAD_BYTES, MAX_VIDEO_UPLOAD_BYTES,
+)
+from ffmpeg_reader import FFmpegVideoReader, ffmpeg_available, is_pipe_decodable, SNIFF_BYTES
+from model_registry import ModelRegistry, MODEL_WARMUP
+from ocr_cache import ocr_cache
+from roboflow_ocr import roboflow_client_stats
+from jobs import JobManager, TERMINAL_STATUSES, VIDEO_JOB_WORKERS
+from streams import StreamManager, STREAM_FINISHED_STATUSES, STREAM_MAX_STREAMS
+from plate_search import PlateIndex, PLATE_INDEX_ENABLED, SEARCH_MAX_LIMIT
+from video_segments import shutdown_segment_pool
 
 # --- Configuration ---
-PLATE_DETECTOR_PATH = "./models/license_plate_detector.pt"
-CHARACTER_DETECTOR_PATH = "./models/character_detector.pt"
-TEMP_DIR = "temp"
-RESULTS_DIR = "results"
+# Decode video uploads through ffmpeg while they arrive (when the container allows it)
+VIDEO_UPLOAD_STREAMING = os.environ.get("VIDEO_UPLOAD_STREAMING", "1") == "1"
+# Piped uploads at once; each holds an inference worker and a threadpool thread while it arrives
+VIDEO_PIPE_MAX_UPLOADS = int(os.environ.get("VIDEO_PIPE_MAX_UPLOADS", str(max(1, INFERENCE_WORKERS // 2))))
+# On shutdown, how long cancelled jobs, streams and running requests get to finish
+SHUTDOWN_GRACE_SECONDS = float(os.environ.get("SHUTDOWN_GRACE_SECONDS", "30"))
 os.makedirs(TEMP_DIR, exist_ok=True)
 os.makedirs(RESULTS_DIR, exist_ok=True)
 
-app = FastAPI(title="ANPR System")
+
+@asynccontextmanager
+async def lifespan(app):
+    """
+    Starts the background subsystems and returns right away: models load, MongoDB indexes
+    are prepared and the plate index is built on their own threads, so the server answers
+    /healthz within moments of starting and /readyz once the models are warm.
+    """
+    model_registry.load_in_background(
+        warmup=MODEL_WARMUP,
+        on_loaded=lambda: startup_timer.mark("loaded"),
+        on_ready=lambda: startup_timer.mark("ready"),
+    )
+    threading.Thread(target=prepare_detection_store, name="detection-store-setup", daemon=True).start()
+    results_sweeper.start()
+    if PLATE_INDEX_ENABLED:
+        plate_index.collection = detections_collection()
+        plate_index.start()
+    startup_timer.mark("healthy")
+    yield
+    video_jobs.shutdown(wait=False)
+    live_streams.shutdown(wait=False)
+    inference_executor.shutdown(wait=False)
+    # Everything that writes detections stops before the writer is drained
+    deadline = time.monotonic() + SHUTDOWN_GRACE_SECONDS
+    for workers in (video_jobs, live_streams, inference_executor):
+        await run_in_threadpool(workers.join, max(0.0, deadline - time.monotonic()))
+    plate_index.stop()
+    results_sweeper.stop()
+    shutdown_segment_pool()
+    artifact_writer.shutdown(wait=True)
+    # Queued detections are written before the process exits
+    detection_writer.close()
+    close_mongo_client()
+
+app = FastAPI(title="ANPR System", lifespan=lifespan)
 
 # --- CORS Middleware ---
 origins = [
@@ -40,16 +112,140 @@ app.add_middleware(
 )
 
 # --- Mount Static Directory to Serve Result Images ---
-app.mount("/results", StaticFiles(directory=RESULTS_DIR), name="results")
+class ResultFiles(StaticFiles):
+    """
+    Serves /results/<result_id>/<name> from the result store's blobs (or from a results/<uuid>/
+    folder written before the store), rendering annotated and cropped plate images on their
+    first request and waiting for images that are still being written by the artifact I/O pool.
+    """
+
+    async def get_response(self, path, scope):
+        result_id, _, name = path.replace(os.sep, "/").partition("/")
+        if not is_result_id(result_id) or not name or "/" in name:
+            raise StarletteHTTPException(status_code=404)
+        legacy_folder = os.path.join(RESULTS_DIR, result_id)
+        if os.path.isdir(legacy_folder):
+            try:
+                return await super().get_response(path, scope)
+            except StarletteHTTPException as e:
+                if e.status_code != 404:
+                    raise
+            await run_in_threadpool(render_artifact, result_id, name, legacy_folder)
+            return await super().get_response(path, scope)
+        blob_path = await run_in_threadpool(result_store.path, result_id, name)
+        if blob_path is None:
+            if not await run_in_threadpool(artifact_writer.wait_for, artifact_key(result_id, name)):
+                await run_in_threadpool(render_artifact, result_id, name)
+            blob_path = await run_in_threadpool(result_store.path, result_id, name)
+        if blob_path is None:
+            raise StarletteHTTPException(status_code=404)
+        # Blobs never change, so they can be cached; the name keeps the original media type
+        response = FileResponse(blob_path, media_type=mimetypes.guess_type(name)[0] or "application/octet-stream")
+        response.headers["Cache-Control"] = "public, max-age=86400"
+        return response
+
+app.mount("/results", ResultFiles(directory=RESULTS_DIR), name="results")
+
+# --- Models ---
+# The registry loads the plate detector, character detector and vehicle tracker once (in the
+# background, from the lifespan) and warms them up; workers get clones instead of reloading weights.
+# Inference workers, video job workers and live streams can all run models at once, so they
+# share one core budget: each gets an even share of the cores as intra-op threads.
+MODEL_THREADS = worker_threads(INFERENCE_WORKERS + VIDEO_JOB_WORKERS + STREAM_MAX_STREAMS)
+model_registry = ModelRegistry(threads=MODEL_THREADS)
+
+IMAGE_MODELS = ("plate_detector", "character_detector")
+VIDEO_MODELS = ("plate_detector", "character_detector", "vehicle_tracker")
+
+# --- Inference Executor ---
+# Each worker gets its own model instances; the endpoints only submit work to it.
+initializer, initargs = worker_initializer(INFERENCE_EXECUTOR, model_registry, MODEL_THREADS)
+inference_executor = InferenceExecutor(initializer=initializer, initargs=initargs)
+
+# --- Background Video Jobs ---
+video_jobs = JobManager(
+    RESULTS_DIR,
+    initializer=init_thread_worker,
+    initargs=(model_registry, MODEL_THREADS),
+)
+# Live streams: each runs on its own worker thread with its own models
+live_streams = StreamManager(
+    initializer=init_thread_worker,
+    initargs=(model_registry, MODEL_THREADS),
+)
+
+# --- Metrics Gauges (evaluated on every /metrics scrape) ---
+register_gauge("anpr_inference_queue_depth", "Tasks waiting for an inference worker.",
+               lambda: inference_executor.stats()["queue_depth"])
+register_gauge("anpr_inference_in_flight", "Tasks submitted to the inference executor and not finished.",
+               lambda: inference_executor.stats()["in_flight"])
+register_gauge("anpr_inference_rejected", "Requests rejected because the inference executor was saturated.",
+               lambda: inference_executor.stats()["rejected"])
+register_gauge("anpr_video_jobs", "Background video jobs, by status.",
+               lambda: {(("status", status),): video_jobs.stats()[status] for status in ("queued", "running")})
+register_gauge("anpr_video_fps", "Frames per second across running background video jobs.",
+               lambda: video_jobs.stats()["fps"])
+register_gauge("anpr_streams_running", "Live streams being ingested.",
+               lambda: live_streams.stats()["running"])
+register_gauge("anpr_stream_fps", "Frames per second analyzed, per live stream.",
+               lambda: {(("stream", s["stream_id"]),): s["stats"]["fps"] for s in live_streams.list()
+                        if s["status"] not in STREAM_FINISHED_STATUSES})
+register_gauge("anpr_stream_drop_rate", "Percentage of captured frames dropped by the ring buffer, per live stream.",
+               lambda: {(("stream", s["stream_id"]),): s["stats"]["drop_rate"] for s in live_streams.list()
+                        if s["status"] not in STREAM_FINISHED_STATUSES})
+register_gauge("anpr_detection_writer_pending", "Detections queued for the bulk Mongo writer.",
+               lambda: detection_writer.stats()["pending"])
+register_gauge("anpr_plate_index_sightings", "Detections in the fuzzy plate search index.",
+               lambda: plate_index.stats()["sightings"])
+register_gauge("anpr_ocr_cache_entries", "Entries in the OCR result cache.",
+               lambda: ocr_cache.stats()["entries"])
+
+register_gauge("anpr_startup_seconds", "Seconds from process start to each startup phase.",
+               lambda: {(("phase", phase),): seconds for phase, seconds in startup_timer.seconds().items()})
+
+# --- Detection Store ---
+def prepare_detection_store():
+    """Creates the indexes and backfills the rollups (runs on a startup thread; MongoDB may be slow to answer)."""
+    try:
+        ensure_indexes()
+        backfill_rollups()
+    except Exception as e:
+        print(f"[WARN] Could not prepare the detections collection: {e}")
+
+# Results retention: expired/over-cap results, unreferenced blobs and orphaned temp/ files
+results_sweeper = RetentionSweeper(result_store, temp_in_use=video_jobs.video_paths)
+
+# Fuzzy plate search: built in the background, then kept up to date by tailing the detections
+plate_index = PlateIndex()
+
+def require_models(*names):
+    """503 unless the models are loaded; while they are still loading, with a Retry-After."""
+    if model_registry.is_ready(*names):
+        return
+    if model_registry.status() == "loading":
+        raise HTTPException(status_code=503, detail="Models are still loading.", headers={"Retry-After": "5"})
+    raise HTTPException(status_code=503, detail="A required model is not loaded.")
+
+def executor_error(e):
+    """The HTTP error for a full (429) or closed (503) inference executor."""
+    if isinstance(e, ExecutorSaturated):
+        return HTTPException(
+            status_code=429,
+            detail="Inference queue is full. Please retry later.",
+            headers={"Retry-After": str(INFERENCE_RETRY_AFTER)},
+        )
+    return HTTPException(
+        status_code=503,
+        detail="Inference executor is not available.",
+        headers={"Retry-After": str(INFERENCE_RETRY_AFTER)},
+    )
 
-# --- Load Models ---
-try:
-    plate_detector = YOLO(PLATE_DETECTOR_PATH)
-    character_detector = YOLO(CHARACTER_DETECTOR_PATH)
-    print("✅ All models loaded successfully.")
-except Exception as e:
-    plate_detector, character_detector = None, None
-    print(f"❌ ERROR: Error loading models: {e}")
+async def run_inference(fn, *args, **kwargs):
+    """Runs `fn` on the inference executor, mapping a full or closed pool to 429/503."""
+    try:
+        return await inference_executor.run(fn, *args, **kwargs)
+    except (ExecutorSaturated, ExecutorUnavailable) as e:
+        raise executor_error(e)
 
 OCR_MODE_FILE = "ocr_mode.txt"
 def get_ocr_mode():
@@ -66,6 +262,20 @@ if not os.path.exists(OCR_MODE_FILE):
     set_ocr_mode("local")
 
 # --- API Endpoints ---
+@app.get("/healthz")
+def healthz():
+    """Liveness: the process is up and serving requests (models may still be loading)."""
+    return {"status": "ok", "uptime_seconds": startup_timer.uptime(), "startup_seconds": startup_timer.seconds()}
+
+@app.get("/readyz")
+def readyz():
+    """Readiness: every model is loaded and warmed up. 503 while loading or if a model failed."""
+    status = model_registry.status()
+    body = {"status": status, "startup_seconds": startup_timer.seconds(), "models": model_registry.stats()}
+    if status != "ready":
+        return JSONResponse(body, status_code=503, headers={"Retry-After": "5"} if status == "loading" else None)
+    return body
+
 @app.get("/")
 def read_root():
     """Root endpoint to confirm the API is active."""
@@ -74,51 +284,457 @@ def read_root():
 @app.post("/api/v1/process-image")
 async def process_image_endpoint(file: UploadFile = File(...)):
     """API endpoint to process a single image for ANPR."""
-    if not plate_detector or not character_detector:
-        raise HTTPException(status_code=503, detail="A required model is not loaded.")
-    contents = await file.read()
+    require_models(*IMAGE_MODELS)
+    try:
+        with timed(STAGE_SECONDS, stage="upload_read"):
+            contents = await run_in_threadpool(read_limited, file.file, MAX_IMAGE_UPLOAD_BYTES)
+    except UploadTooLarge as e:
+        raise _upload_error(e)
     ocr_mode = get_ocr_mode()
-    return process_image_file(plate_detector, character_detector, contents, file.filename, ocr_mode=ocr_mode)
-
-@app.post("/api/v1/process-video")
-async def process_video_endpoint(file: UploadFile = File(...)):
-    """API endpoint to process a video file for ANPR."""
-    if not plate_detector or not character_detector:
-        raise HTTPException(status_code=503, detail="A required model is not loaded.")
-    
-    temp_video_path = os.path.join(TEMP_DIR, f"{uuid.uuid4()}_{file.filename}")
+    result = await run_inference(process_image_job, contents, file.filename, ocr_mode=ocr_mode)
+    if "error" in result:
+        raise HTTPException(status_code=400, detail=result["error"])
+    return result
+
+def _spool_uploads(files):
+    """Copies uploads into temporary files owned by the request (FastAPI closes its own early)."""
+    spooled = []
+    for file in files:
+        copy = tempfile.TemporaryFile(dir=TEMP_DIR)
+        shutil.copyfileobj(file.file, copy)
+        copy.seek(0)
+        spooled.append((file.filename, copy))
+    return spooled
+
+async def _run_image_batch(items, ocr_mode):
+    """Runs one bulk batch, waiting for capacity instead of failing a response already under way."""
+    while True:
+        try:
+            return await inference_executor.run(process_image_batch_job, items, ocr_mode=ocr_mode)
+        except ExecutorSaturated:
+            await asyncio.sleep(INFERENCE_RETRY_AFTER)
+
+@app.post("/api/v1/process-images")
+async def process_images_endpoint(files: List[UploadFile] = File(...)):
+    """
+    Processes many images - any mix of image files and zip/tar archives of images - in batches
+    of IMAGE_BATCH_SIZE, streaming one NDJSON line per image as each batch finishes. The next
+    batch is read from the upload while the current one is on the inference executor.
+    """
+    require_models(*IMAGE_MODELS)
+    if inference_executor.is_saturated():
+        raise HTTPException(
+            status_code=429,
+            detail="Inference queue is full. Please retry later.",
+            headers={"Retry-After": str(INFERENCE_RETRY_AFTER)},
+        )
+    with timed(STAGE_SECONDS, stage="upload_read"):
+        uploads = await run_in_threadpool(_spool_uploads, files)
+    ocr_mode = get_ocr_mode()
+    images = iter_upload_images(uploads)
+
+    tasks = []
+
+    async def next_batch():
+        entries = await run_in_threadpool(take, images, IMAGE_BATCH_SIZE)
+        items = [(contents, name) for name, contents, _ in entries if contents is not None]
+        task = asyncio.ensure_future(_run_image_batch(items, ocr_mode)) if items else None
+        if task is not None:
+            tasks.append(task)
+        return entries, task
+
+    async def stream():
+        index = 0
+        try:
+            entries, task = await next_batch()
+            while entries:
+                next_entries, next_task = await next_batch()
+                try:
+                    results = await task if task else []
+                except ExecutorUnavailable:
+                    results = [{"error": "Inference executor is not available."}] * len(entries)
+                except Exception as e:
+                    print(f"❌ ERROR: Bulk image batch failed: {e}")
+                    results = [{"error": f"Processing failed: {e}"}] * len(entries)
+                results = iter(results)
+                for name, contents, error in entries:
+                    line = {"index": index, "filename": name}
+                    line.update(next(results) if contents is not None else {"error": error})
+                    yield json.dumps(line) + "\n"
+                    index += 1
+                entries, task = next_entries, next_task
+        finally:
+            # The single owner of the spooled uploads; also runs if the client disconnects
+            for task in tasks:
+                task.cancel()
+            for _, upload in uploads:
+                upload.close()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+def video_options(sampling_mode=None, frame_stride=None, plate_detection_mode=None, video_engine=None):
+    """Validates the optional per-request video settings and returns them as process_video_job kwargs."""
+    options = {}
+    if video_engine is not None:
+        if video_engine not in ("pipeline", "segmented"):
+            raise HTTPException(status_code=400, detail="Invalid video engine")
+        options["video_engine"] = video_engine
+    if plate_detection_mode is not None:
+        if plate_detection_mode not in ("full", "roi"):
+            raise HTTPException(status_code=400, detail="Invalid plate detection mode")
+        options["plate_detection_mode"] = plate_detection_mode
+    if sampling_mode is not None:
+        if sampling_mode not in ("full", "adaptive"):
+            raise HTTPException(status_code=400, detail="Invalid sampling mode")
+        options["sampling_mode"] = sampling_mode
+    if frame_stride is not None:
+        if frame_stride < 1:
+            raise HTTPException(status_code=400, detail="frame_stride must be at least 1")
+        options["frame_stride"] = frame_stride
+    return options
+
+# The video endpoints read the request body themselves; this documents the expected form field
+VIDEO_UPLOAD_OPENAPI = {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+    "type": "object", "properties": {"file": {"type": "string", "format": "binary"}}, "required": ["file"],
+}}}}}
+
+async def _read_upload_head(chunks, size=SNIFF_BYTES):
+    """The first chunks of an upload, until at least `size` bytes (or the whole upload) are in."""
+    head, received = [], 0
+    async for chunk in chunks:
+        head.append(chunk)
+        received += len(chunk)
+        if received >= size:
+            break
+    return head
+
+async def _chain(head, chunks):
+    for chunk in head:
+        yield chunk
+    async for chunk in chunks:
+        yield chunk
+
+def _upload_error(e):
+    if isinstance(e, UploadTooLarge):
+        return HTTPException(status_code=413, detail=str(e))
+    return HTTPException(status_code=400, detail=str(e))
+
+def _can_pipe_video(head, options):
+    """Whether this upload can be decoded while it arrives instead of being saved first."""
+    return (
+        VIDEO_UPLOAD_STREAMING and INFERENCE_EXECUTOR == "thread" and ffmpeg_available()
+        and options.get("video_engine", VIDEO_ENGINE) == "pipeline"
+        and is_pipe_decodable(b"".join(head)[:SNIFF_BYTES]) is True
+    )
+
+_piped_uploads = threading.BoundedSemaphore(max(1, VIDEO_PIPE_MAX_UPLOADS))
+
+def _start_piped_video(ocr_mode, options):
+    """
+    Starts a video pipeline reading from ffmpeg, or returns None (and the upload goes through
+    temp/ instead) unless an inference worker is idle right now and fewer than
+    VIDEO_PIPE_MAX_UPLOADS piped uploads are arriving. A piped job waiting in the queue would
+    hold the client's upload, and a threadpool thread blocked in reader.feed, until it ran.
+    """
+    if not inference_executor.has_idle_worker() or not _piped_uploads.acquire(blocking=False):
+        return None
+    reader = FFmpegVideoReader()
+    cancel_event = threading.Event()
     try:
-        with open(temp_video_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        ocr_mode = get_ocr_mode()
-        return process_video_file(plate_detector, character_detector, temp_video_path, ocr_mode=ocr_mode)
+        future = inference_executor.submit_if_idle(process_video_job, None, ocr_mode=ocr_mode, capture=reader,
+                                                   cancel_event=cancel_event, **options)
+    except ExecutorUnavailable as e:
+        reader.release()
+        _piped_uploads.release()
+        raise executor_error(e)
+    if future is None:
+        reader.release()
+        _piped_uploads.release()
+        return None
+    # If processing stops early, ffmpeg is stopped so feeding it cannot block forever
+    future.add_done_callback(lambda f: reader.release())
+    return reader, future, cancel_event
+
+async def _process_video_piped(chunks, piped):
+    """
+    Feeds the upload through ffmpeg to a video pipeline started by _start_piped_video, so
+    frame analysis overlaps the upload. Nothing is written to temp/.
+    """
+    reader, future, cancel_event = piped
+    try:
+        with timed(STAGE_SECONDS, stage="upload_read"):
+            async for chunk in chunks:
+                if not await run_in_threadpool(reader.feed, chunk):
+                    break
+        reader.finish_input()
+    except BaseException:
+        # Oversized or aborted upload: stop processing what has arrived so far
+        cancel_event.set()
+        reader.release()
+        raise
     finally:
-        if os.path.exists(temp_video_path):
+        _piped_uploads.release()
+    result = await asyncio.wrap_future(future)
+    if "error" in result and reader.error():
+        print(f"❌ ERROR: ffmpeg could not decode the upload: {reader.error()}")
+    return result
+
+@app.post("/api/v1/process-video", openapi_extra=VIDEO_UPLOAD_OPENAPI)
+async def process_video_endpoint(request: Request, sampling_mode: Optional[str] = None,
+                                 frame_stride: Optional[int] = None,
+                                 plate_detection_mode: Optional[str] = None,
+                                 video_engine: Optional[str] = None):
+    """
+    API endpoint to process a video file for ANPR. The upload (the multipart `file` field, or
+    a raw video body) is decoded through ffmpeg while it arrives when its container allows;
+    otherwise it is written to temp/ as it arrives and processed once complete.
+    """
+    options = video_options(sampling_mode, frame_stride, plate_detection_mode, video_engine)
+    require_models(*VIDEO_MODELS)
+    # Reject before reading the upload if there is no capacity for it
+    if inference_executor.is_saturated():
+        raise HTTPException(
+            status_code=429,
+            detail="Inference queue is full. Please retry later.",
+            headers={"Retry-After": str(INFERENCE_RETRY_AFTER)},
+        )
+
+    upload = RequestUpload(request, max_bytes=MAX_VIDEO_UPLOAD_BYTES)
+    chunks = upload.chunks()
+    ocr_mode = get_ocr_mode()
+    temp_video_path = None
+    try:
+        head = await _read_upload_head(chunks)
+        piped = _start_piped_video(ocr_mode, options) if _can_pipe_video(head, options) else None
+        if piped is not None:
+            return await _process_video_piped(_chain(head, chunks), piped)
+
+        # This endpoint is the only owner of the temporary file
+        temp_video_path = os.path.join(TEMP_DIR, f"{uuid.uuid4()}_{os.path.basename(upload.filename or 'video')}")
+        with timed(STAGE_SECONDS, stage="upload_read"):
+            await save_upload(_chain(head, chunks), temp_video_path)
+        return await run_inference(process_video_job, temp_video_path, ocr_mode=ocr_mode, **options)
+    except (UploadTooLarge, InvalidUpload) as e:
+        raise _upload_error(e)
+    finally:
+        if temp_video_path and os.path.exists(temp_video_path):
             os.remove(temp_video_path)
 
+@app.post("/api/v1/jobs", status_code=202, openapi_extra=VIDEO_UPLOAD_OPENAPI)
+async def submit_video_job(request: Request, sampling_mode: Optional[str] = None,
+                           frame_stride: Optional[int] = None,
+                           plate_detection_mode: Optional[str] = None,
+                           video_engine: Optional[str] = None):
+    """Queues a video for background processing and returns its job id immediately."""
+    options = video_options(sampling_mode, frame_stride, plate_detection_mode, video_engine)
+    require_models(*VIDEO_MODELS)
+
+    job_id = str(uuid.uuid4())
+    upload = RequestUpload(request, max_bytes=MAX_VIDEO_UPLOAD_BYTES)
+    chunks = upload.chunks()
+    temp_video_path = None
+    try:
+        head = await _read_upload_head(chunks)
+        temp_video_path = os.path.join(TEMP_DIR, f"{job_id}_{os.path.basename(upload.filename or 'video')}")
+        with timed(STAGE_SECONDS, stage="upload_read"):
+            await save_upload(_chain(head, chunks), temp_video_path)
+        # From here on the job owns (and removes) the file
+        job = video_jobs.submit(temp_video_path, upload.filename, ocr_mode=get_ocr_mode(),
+                                job_id=job_id, options=options)
+        temp_video_path = None
+    except (UploadTooLarge, InvalidUpload) as e:
+        raise _upload_error(e)
+    except ExecutorSaturated:
+        raise HTTPException(
+            status_code=429,
+            detail="Video job queue is full. Please retry later.",
+            headers={"Retry-After": str(INFERENCE_RETRY_AFTER)},
+        )
+    finally:
+        if temp_video_path and os.path.exists(temp_video_path):
+            os.remove(temp_video_path)
+    return {"job_id": job.job_id, "status": job.status, "status_url": f"/api/v1/jobs/{job.job_id}"}
+
+@app.get("/api/v1/jobs/{job_id}")
+def get_video_job(job_id: str):
+    """Returns a job's status, progress (frames, fps, ETA) and, once completed, its result."""
+    job = video_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+@app.get("/api/v1/jobs/{job_id}/events")
+async def stream_video_job(job_id: str):
+    """Server-Sent Events stream of a job's progress, ending when the job finishes."""
+    if video_jobs.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+
+    async def event_stream():
+        last_event = None
+        while True:
+            job = video_jobs.get(job_id)
+            event = json.dumps(job)
+            if event != last_event:
+                yield f"data: {event}\n\n"
+                last_event = event
+            if job["status"] in TERMINAL_STATUSES:
+                break
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+@app.delete("/api/v1/jobs/{job_id}")
+def cancel_video_job(job_id: str):
+    """Cancels a queued or running job."""
+    if not video_jobs.cancel(job_id):
+        raise HTTPException(status_code=404, detail="Job not found or already finished.")
+    return {"job_id": job_id, "status": "cancelling"}
+
+@app.post("/api/v1/streams", status_code=201)
+def start_stream(source: str, name: Optional[str] = None, realtime: Optional[bool] = None, loop: bool = False):
+    """
+    Registers a live stream (RTSP/HTTP URL, capture device number, or a video file on the
+    server played back in real time) and starts ingesting it.
+    """
+    if not source.strip():
+        raise HTTPException(status_code=400, detail="A stream source is required.")
+    require_models(*VIDEO_MODELS)
+    try:
+        stream = live_streams.start(source.strip(), name=name, realtime=realtime, loop=loop, ocr_mode=get_ocr_mode())
+    except ExecutorSaturated:
+        raise HTTPException(status_code=429, detail="Every stream slot is in use.")
+    return {
+        "stream_id": stream.stream_id,
+        "status": stream.status,
+        "status_url": f"/api/v1/streams/{stream.stream_id}",
+        "events_url": f"/api/v1/streams/{stream.stream_id}/events",
+    }
+
+@app.get("/api/v1/streams")
+def list_streams():
+    """Registered streams with their status, fps, drop rate and latency."""
+    return {"streams": live_streams.list(), **live_streams.stats()}
+
+@app.get("/api/v1/streams/{stream_id}")
+def get_stream(stream_id: str):
+    """A stream's status and stats, plus its most recent vehicle events."""
+    stream = live_streams.get(stream_id)
+    if stream is None:
+        raise HTTPException(status_code=404, detail="Stream not found.")
+    return stream.to_dict(events=True)
+
+@app.delete("/api/v1/streams/{stream_id}")
+def stop_stream(stream_id: str):
+    """Stops a stream; vehicles still in view are finalized and emitted first."""
+    if not live_streams.stop(stream_id):
+        raise HTTPException(status_code=404, detail="Stream not found or already stopped.")
+    return {"stream_id": stream_id, "status": "stopping"}
+
+STREAM_STATS_INTERVAL = 2.0
+
+@app.websocket("/api/v1/streams/{stream_id}/events")
+async def stream_events(websocket: WebSocket, stream_id: str):
+    """
+    Sends each finalized vehicle of a stream as {"type": "vehicle", ...}, a {"type": "stats"}
+    message every STREAM_STATS_INTERVAL seconds, and {"type": "end"} when the stream stops.
+    """
+    stream = live_streams.get(stream_id)
+    await websocket.accept()
+    if stream is None:
+        await websocket.close(code=4404, reason="Stream not found.")
+        return
+    loop = asyncio.get_running_loop()
+    events = stream.subscribe(loop)
+    try:
+        while stream.status not in STREAM_FINISHED_STATUSES or not events.empty():
+            try:
+                event = await asyncio.wait_for(events.get(), timeout=STREAM_STATS_INTERVAL)
+            except asyncio.TimeoutError:
+                await websocket.send_json({"type": "stats", "status": stream.status, "stats": stream.stats()})
+                continue
+            if event is None:
+                break
+            await websocket.send_json(event)
+        await websocket.send_json({"type": "end", **stream.to_dict()})
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        stream.unsubscribe(loop, events)
+
 @app.get("/api/v1/stats")
 def get_stats():
     """Endpoint to get statistics about detections."""
-    # Use either detections_collection (from image or video processor, they are the same DB)
-    collection = image_detections_collection
-    total = collection.count_documents({})
-    avg_conf = collection.aggregate([{"$group": {"_id": None, "avg": {"$avg": "$confidence"}}}])
-    avg_conf = next(avg_conf, {}).get("avg", 0)
-    ocr_failures = collection.count_documents({"status": "Failed"})
-    avg_proc = 127  # Optionally, log and calculate this
+    # Answered from the rollup counters kept by the detection writer, not a collection scan
+    totals = read_stats()
+    total = totals["total"]
+    avg_conf = totals["confidence_sum"] / total if total else 0
+    ocr_failures = totals["failures"]
+    processed = totals["processing_count"]
+    avg_proc = totals["processing_ms_sum"] / processed if processed else 0
+    # Percentiles over a bounded window of recent requests, kept in the totals rollup
+    quantiles = percentiles(recent_processing_times())
     fail_rate = (ocr_failures / total * 100) if total else 0
     return {
         "totalInferences": total,
         "avgConfidence": round(avg_conf, 2),
         "ocrFailureRate": round(fail_rate, 2),
-        "avgProcessingTime": avg_proc
+        "avgProcessingTime": round(avg_proc, 1),
+        "p50ProcessingTime": quantiles[50],
+        "p95ProcessingTime": quantiles[95],
+        "p99ProcessingTime": quantiles[99]
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Prometheus scrape endpoint: per-stage latency histograms, model-call counts and gauges."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/v1/stats/hourly")
+def get_hourly_stats(hours: int = 24):
+    """Endpoint to get per-hour detection counts, failures and average confidence."""
+    if not 1 <= hours <= 24 * 31:
+        raise HTTPException(status_code=400, detail="hours must be between 1 and 744.")
+    since = (datetime.utcnow() - timedelta(hours=hours - 1)).replace(minute=0, second=0, microsecond=0)
+    return [
+        {
+            "hour": bucket["hour"],
+            "total": bucket["total"],
+            "failures": bucket["failures"],
+            "avgConfidence": round(bucket["confidence_sum"] / bucket["total"], 2) if bucket["total"] else 0,
+        }
+        for bucket in read_hourly_stats(since)
+    ]
+
+@app.get("/api/v1/models")
+def get_models():
+    """Endpoint to get each model's load time, device and warmup latency."""
+    return model_registry.stats()
+
+@app.get("/api/v1/inference-pool")
+def get_inference_pool_stats():
+    """Endpoint to get the inference executor's, video job pool's, Roboflow client's and detection writer's gauges."""
+    return {
+        **inference_executor.stats(),
+        "video_jobs": video_jobs.stats(),
+        "roboflow": roboflow_client_stats(),
+        "detection_writer": detection_writer.stats(),
     }
 
+@app.get("/api/v1/ocr-cache")
+def get_ocr_cache_stats():
+    """Endpoint to get the OCR cache's size and per-namespace hit/miss counters."""
+    return ocr_cache.stats()
+
+@app.delete("/api/v1/ocr-cache")
+def clear_ocr_cache():
+    ocr_cache.clear()
+    return ocr_cache.stats()
+
 @app.get("/api/v1/recent-detections")
 def get_recent_detections():
     """Endpoint to get the most recent detections."""
-    collection = image_detections_collection
+    collection = detections_collection()
     # Get last 5 detections, most recent first
     detections = list(collection.find().sort("timestamp", -1).limit(5))
     # Convert MongoDB ObjectId and datetime to string
@@ -127,6 +743,61 @@ def get_recent_detections():
         d.pop("_id", None)
     return detections
 
+@app.get("/api/v1/search")
+def search_plates(q: str, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                  days: Optional[int] = None, max_distance: Optional[int] = None, limit: int = 50):
+    """
+    Endpoint to find the sightings of plates like `q`, tolerating OCR confusions (0/O, 8/B,
+    1/I, ...) and up to `max_distance` edits. Filtered to [since, until] or the last `days`.
+    """
+    if not PLATE_INDEX_ENABLED:
+        raise HTTPException(status_code=404, detail="Plate search is disabled.")
+    if not plate_index.is_ready():
+        raise HTTPException(status_code=503, detail="The plate index is still being built.",
+                            headers={"Retry-After": "5"})
+    if len(q.strip()) < 2:
+        raise HTTPException(status_code=400, detail="q must have at least 2 characters.")
+    if not 1 <= limit <= SEARCH_MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {SEARCH_MAX_LIMIT}.")
+    if max_distance is not None and not 0 <= max_distance <= 3:
+        raise HTTPException(status_code=400, detail="max_distance must be between 0 and 3.")
+    if days is not None:
+        if days < 1:
+            raise HTTPException(status_code=400, detail="days must be at least 1.")
+        since = datetime.utcnow() - timedelta(days=days)
+    start = time.perf_counter()
+    found = plate_index.search(q, since=since, until=until, max_distance=max_distance, limit=limit)
+    # Only the returned page is read from MongoDB, by _id
+    ranked = found.pop("ids")
+    docs = {d["_id"]: d for d in detections_collection().find({"_id": {"$in": [oid for oid, _, _ in ranked]}})}
+    results = []
+    for oid, distance, text_distance in ranked:
+        doc = docs.get(oid)
+        if doc is None:
+            continue
+        doc["id"] = str(doc.pop("_id"))
+        doc["timestamp"] = doc["timestamp"].strftime("%Y-%m-%d %H:%M:%S")
+        results.append({**doc, "distance": distance, "text_distance": text_distance})
+    for plate in found["plates"]:
+        plate["first_seen"] = plate["first_seen"].strftime("%Y-%m-%d %H:%M:%S")
+        plate["last_seen"] = plate["last_seen"].strftime("%Y-%m-%d %H:%M:%S")
+    return {"query": q, **found, "results": results, "took_ms": round((time.perf_counter() - start) * 1000, 1)}
+
+@app.get("/api/v1/search/index")
+def get_plate_index_stats():
+    """Endpoint to get the plate search index's size and build state."""
+    return plate_index.stats()
+
+@app.get("/api/v1/results/storage")
+def get_results_storage():
+    """Endpoint to get the result store's size, deduplication savings and last retention sweep."""
+    return {**result_store.stats(), "last_sweep": results_sweeper.last_run}
+
+@app.post("/api/v1/results/sweep")
+async def sweep_results():
+    """Runs a retention sweep now instead of waiting for the next one."""
+    return await run_in_threadpool(results_sweeper.run_once)
+
 @app.get("/api/v1/ocr-mode")
 def get_ocr_mode_endpoint():
     return {"ocr_mode": get_ocr_mode()}
@@ -139,3 +810,5 @@ async def set_ocr_mode_endpoint(request: Request):
         raise HTTPException(status_code=400, detail="Invalid OCR mode")
     set_ocr_mode(mode)
     return {"ocr_mode": mode}
+
+startup_timer.mark("imported")
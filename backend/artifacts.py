@@ -0,0 +1,209 @@
+"""
+artifacts.py
+
+Result images (artifacts), served as /results/<result_id>/<name> from the result store
+(result_store.py), controlled by ARTIFACT_LEVEL:
+
+    none       nothing is written; responses carry no image URLs
+    annotated  the upload is stored as-is (no re-encoding) with a small detections.json;
+               plate_detection.jpg and cropped_plate_<i>.jpg are rendered from these on
+               their first GET and then served from disk
+    full       as annotated, and every image is also rendered right away on a background
+               I/O pool, so the folder is complete for debugging
+
+Nothing is JPEG-encoded on the request path. Video best shots cannot be re-rendered later
+(the video is deleted), so they are encoded on the I/O pool; a GET that arrives before the
+write finishes waits for it.
+"""
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import cv2
+import numpy as np
+
+from metrics import timed, STAGE_SECONDS
+from result_store import result_store
+
+# --- Artifact Configuration (from environment variables) ---
+ARTIFACT_LEVELS = ("none", "annotated", "full")
+ARTIFACT_LEVEL = os.environ.get("ARTIFACT_LEVEL", "full")
+ARTIFACT_IO_WORKERS = int(os.environ.get("ARTIFACT_IO_WORKERS", "2"))
+DETECTIONS_FILE = "detections.json"
+ANNOTATED_FILE = "plate_detection.jpg"
+ORIGINAL_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+CROPPED_PLATE_RE = re.compile(r"cropped_plate_(\d+)\.jpg")
+
+# Colours of the Roboflow character outlines drawn on cropped plates (BGR)
+CHARACTER_PALETTE = [
+    (255, 0, 0),    # Red
+    (0, 255, 0),    # Green
+    (0, 0, 255),    # Blue
+    (255, 255, 0),  # Cyan
+    (255, 0, 255),  # Magenta
+    (0, 255, 255),  # Yellow
+    (255, 128, 0),  # Orange
+    (128, 0, 255),  # Purple
+    (0, 128, 255),  # Light Blue
+    (128, 255, 0),  # Lime
+]
+
+
+def character_color_legend(characters):
+    """{character class: colour} for Roboflow character predictions, as drawn on the crop."""
+    return {char["class"]: CHARACTER_PALETTE[i % len(CHARACTER_PALETTE)] for i, char in enumerate(characters)}
+
+
+def artifact_key(result_id, name):
+    return f"{result_id}/{name}"
+
+
+class ArtifactWriter:
+    """Encodes and writes images on a small thread pool, tracking which artifacts are still pending."""
+
+    def __init__(self, workers=ARTIFACT_IO_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="artifact-io")
+        self._pending = {}  # "<result_id>/<name>" -> future of the job writing it
+        self._lock = threading.Lock()
+
+    def submit_many(self, keys, job):
+        """Runs `job()` in the background; `keys` are the artifact_key()s of the files it writes."""
+        keys = list(keys)
+        with self._lock:
+            future = self._executor.submit(job)
+            for key in keys:
+                self._pending[key] = future
+        future.add_done_callback(lambda f: self._forget(keys, f))
+        return future
+
+    def wait_for(self, key, timeout=10):
+        """Waits (up to `timeout`) for a pending write of artifact `key`; returns False if none is pending."""
+        with self._lock:
+            future = self._pending.get(key)
+        if future is None:
+            return False
+        wait([future], timeout=timeout)
+        return True
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def _forget(self, keys, future):
+        with self._lock:
+            for key in keys:
+                if self._pending.get(key) is future:
+                    del self._pending[key]
+        if future.exception() is not None:
+            print(f"❌ ERROR: Failed to write artifacts {keys}: {future.exception()}")
+
+
+artifact_writer = ArtifactWriter()
+
+
+def save_image_artifacts(result_id, image_contents, image_filename, image, plates, level=ARTIFACT_LEVEL):
+    """
+    Stores what is needed to render this image's artifacts: the upload bytes as-is and the
+    plate boxes (plus Roboflow characters) in detections.json. `image` is the decoded upload,
+    which the "full" level renders from in the background; it must not be modified afterwards.
+    `plates` is a list of {"index", "box": (x1, y1, x2, y2), "characters"}. Returns the
+    annotated image's file name, or None when artifacts are disabled.
+    """
+    if level == "none":
+        return None
+    ext = os.path.splitext(image_filename or "")[1].lower()
+    original_name = "original" + (ext if ext in ORIGINAL_EXTENSIONS else ".jpg")
+    detections = {"original": original_name, "level": level, "plates": plates}
+    with timed(STAGE_SECONDS, stage="image_write"):
+        # A re-uploaded image is stored once: the store deduplicates by content
+        result_store.put(result_id, original_name, image_contents)
+        result_store.put(result_id, DETECTIONS_FILE, json.dumps(detections).encode())
+
+    if level == "full":
+        names = [ANNOTATED_FILE] + [f"cropped_plate_{plate['index']}.jpg" for plate in plates]
+        artifact_writer.submit_many(
+            [artifact_key(result_id, name) for name in names],
+            lambda: [result_store.put_image(result_id, name, _render(name, detections, image)) for name in names],
+        )
+    return ANNOTATED_FILE
+
+def save_video_shot(result_id, name, image, level=ARTIFACT_LEVEL):
+    """Queues a video vehicle's best shot for writing (unless artifacts are disabled)."""
+    if level == "none":
+        return False
+    artifact_writer.submit_many([artifact_key(result_id, name)], lambda: result_store.put_image(result_id, name, image))
+    return True
+
+
+def _draw_characters(crop, characters):
+    """Subtle, semi-transparent, thin coloured outlines for each Roboflow character."""
+    overlay = crop.copy()
+    alpha = 0.4  # Opacity for the overlay
+    for i, char in enumerate(characters):
+        color = CHARACTER_PALETTE[i % len(CHARACTER_PALETTE)]
+        x1c = int(char["x"] - char["width"] / 2)
+        y1c = int(char["y"] - char["height"] / 2)
+        x2c = int(char["x"] + char["width"] / 2)
+        y2c = int(char["y"] + char["height"] / 2)
+        cv2.rectangle(overlay, (x1c, y1c), (x2c, y2c), color, 1)
+    return cv2.addWeighted(overlay, alpha, crop, 1 - alpha, 0)
+
+def _render(name, detections, original):
+    """Draws one artifact from the decoded original; None if `name` is not one of its artifacts."""
+    if name == ANNOTATED_FILE:
+        image = original.copy()
+        for plate in detections["plates"]:
+            x1, y1, x2, y2 = map(int, plate["box"])
+            cv2.rectangle(image, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        return image
+    crop_match = CROPPED_PLATE_RE.fullmatch(name)
+    if crop_match is None:
+        return None
+    plate = next((p for p in detections["plates"] if p["index"] == int(crop_match.group(1))), None)
+    if plate is None:
+        return None
+    x1, y1, x2, y2 = map(int, plate["box"])
+    crop = np.ascontiguousarray(original[y1:y2, x1:x2])
+    if plate.get("characters"):
+        crop = _draw_characters(crop, plate["characters"])
+    return crop
+
+def render_artifact(result_id, name, legacy_folder=None):
+    """
+    Renders plate_detection.jpg or cropped_plate_<i>.jpg from the stored upload and
+    detections.json, and stores it for later requests. `legacy_folder` is a results/<uuid>/
+    folder written before the result store, rendered into in place. Returns False if `name`
+    is not renderable for this result.
+    """
+    if name != ANNOTATED_FILE and CROPPED_PLATE_RE.fullmatch(name) is None:
+        return False
+    if legacy_folder is not None:
+        read = lambda file_name: _read_file(os.path.join(legacy_folder, file_name))
+    else:
+        read = lambda file_name: result_store.read(result_id, file_name)
+    detections = read(DETECTIONS_FILE)
+    if detections is None:
+        return False
+    detections = json.loads(detections)
+    original = read(detections["original"])
+    if original is None:
+        return False
+    original = cv2.imdecode(np.frombuffer(original, np.uint8), cv2.IMREAD_COLOR)
+    image = _render(name, detections, original) if original is not None else None
+    if image is None:
+        return False
+    if legacy_folder is not None:
+        path = os.path.join(legacy_folder, name)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp.jpg"
+        cv2.imwrite(tmp_path, image)
+        os.replace(tmp_path, path)
+    else:
+        result_store.put_image(result_id, name, image)
+    return True
+
+def _read_file(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return f.read()
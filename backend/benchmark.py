@@ -0,0 +1,501 @@
+"""
+benchmark.py
+
+Offline benchmark harness for the image and video pipelines. It needs no network access,
+no MongoDB and no uploaded media.
+
+Inputs are synthetic: noisy images with white licence plates, and a short video of boxes
+("vehicles") that carry plates across the frame. The models are either stub detectors
+with controllable latency, which find the synthetic plates and vehicles with simple colour
+thresholds, or the real .pt models from the model registry (--models real, on CPU).
+Detections go to mongomock, or to an in-memory stand-in if mongomock is not installed.
+Results are written under a temporary working directory.
+
+Every scenario reports:
+- wall time and throughput (images/sec, crops/sec or video fps);
+- per-stage time from the metrics histograms;
+- model-call counts;
+- peak RSS;
+- allocated-block deltas. With --trace-alloc it also reports the tracemalloc peak.
+
+The JSON output is meant to be kept per release and diffed:
+
+    python benchmark.py --output bench-new.json
+    python benchmark.py --models real --images 20 --video-frames 150 --output bench-real.json
+    python benchmark.py --compare bench-old.json bench-new.json
+
+--cold-start N starts the API server (uvicorn app:app) N times instead, and reports the
+seconds until its first /healthz and /readyz answers, plus the server's own startup phases.
+"""
+import argparse
+import contextlib
+import gc
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+
+import cv2
+import numpy as np
+
+PLATE_TEXT = "BA1PA2345"
+VEHICLE_COLOR = (200, 80, 20)  # BGR; what the stub tracker looks for
+
+DEFAULT_SCENARIOS = (
+    "ocr_single", "ocr_batch", "image", "image_cached", "image_bulk", "video_full", "video_adaptive", "video_roi",
+)
+
+
+# --- Stub models -------------------------------------------------------------------------
+# They return objects shaped like ultralytics Results: result.boxes.{xyxy,conf,cls,id}
+# with .cpu().numpy(), and result.names.
+
+class _Array:
+    def __init__(self, values):
+        self._values = np.asarray(values, dtype=np.float32)
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self._values
+
+class _Boxes:
+    def __init__(self, xyxy, conf, cls, ids=None):
+        self.xyxy = _Array(np.asarray(xyxy, dtype=np.float32).reshape(-1, 4))
+        self.conf = _Array(conf)
+        self.cls = _Array(cls)
+        self.id = _Array(ids) if ids is not None else None
+
+    def __len__(self):
+        return len(self.conf.numpy())
+
+class _Result:
+    def __init__(self, boxes, names):
+        self.boxes = boxes
+        self.names = names
+
+
+def _find_boxes(image, mask, min_area):
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    boxes = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if w * h >= min_area:
+            boxes.append((x, y, x + w, y + h))
+    return boxes
+
+class StubPlateDetector:
+    """Finds the white plate rectangles; sleeps `latency` per call plus `per_image` per image."""
+
+    names = {0: "license_plate"}
+
+    def __init__(self, latency=0.02, per_image=0.0):
+        self.latency = latency
+        self.per_image = per_image
+
+    def __call__(self, source, **kwargs):
+        images = source if isinstance(source, list) else [source]
+        time.sleep(self.latency + self.per_image * len(images))
+        results = []
+        for image in images:
+            mask = cv2.inRange(image, (235, 235, 235), (255, 255, 255))
+            boxes = _find_boxes(image, mask, min_area=150)
+            results.append(_Result(_Boxes(boxes, [0.9] * len(boxes), [0] * len(boxes)), self.names))
+        return results
+
+class StubCharacterDetector:
+    """Reads every crop as PLATE_TEXT, spread across the crop; latency as for the plate stub."""
+
+    names = dict(enumerate(sorted(set(PLATE_TEXT))))
+
+    def __init__(self, latency=0.01, per_image=0.002):
+        self.latency = latency
+        self.per_image = per_image
+        self._class_ids = [sorted(set(PLATE_TEXT)).index(c) for c in PLATE_TEXT]
+
+    def __call__(self, source, **kwargs):
+        images = source if isinstance(source, list) else [source]
+        time.sleep(self.latency + self.per_image * len(images))
+        results = []
+        for image in images:
+            h, w = image.shape[:2]
+            step = w / (len(PLATE_TEXT) + 2)
+            boxes = [(step * (i + 1), h * 0.3, step * (i + 1.8), h * 0.7) for i in range(len(PLATE_TEXT))]
+            results.append(_Result(_Boxes(boxes, [0.85] * len(boxes), self._class_ids), self.names))
+        return results
+
+class StubTracker:
+    """Finds the coloured vehicle boxes and keeps ids by nearest centroid between frames."""
+
+    names = {2: "car"}
+
+    def __init__(self, latency=0.015):
+        self.latency = latency
+        self._tracks = {}  # id -> centroid
+        self._next_id = 1
+
+    def track(self, frame, **kwargs):
+        time.sleep(self.latency)
+        lower = np.array(VEHICLE_COLOR) - 30
+        upper = np.array(VEHICLE_COLOR) + 30
+        boxes = _find_boxes(frame, cv2.inRange(frame, lower, upper), min_area=2000)
+        if not boxes:
+            return [_Result(_Boxes([], [], []), self.names)]
+        ids, tracks = [], {}
+        for x1, y1, x2, y2 in boxes:
+            centroid = np.array([(x1 + x2) / 2, (y1 + y2) / 2])
+            candidates = [(np.linalg.norm(centroid - c), tid) for tid, c in self._tracks.items() if tid not in tracks]
+            distance, track_id = min(candidates, default=(None, None))
+            if track_id is None or distance > 80:
+                track_id, self._next_id = self._next_id, self._next_id + 1
+            tracks[track_id] = centroid
+            ids.append(track_id)
+        self._tracks = tracks
+        return [_Result(_Boxes(boxes, [0.9] * len(boxes), [2] * len(boxes), ids), self.names)]
+
+
+# --- Synthetic inputs --------------------------------------------------------------------
+
+def _draw_plate(image, x, y, w=120, h=36):
+    cv2.rectangle(image, (x, y), (x + w, y + h), (255, 255, 255), -1)
+    cv2.putText(image, PLATE_TEXT[:7], (x + 6, y + h - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 2)
+
+def synthetic_images(count, width=640, height=480, seed=0):
+    """JPEG-encoded images with 1-3 plates each."""
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        image = rng.integers(0, 160, (height, width, 3), dtype=np.uint8)
+        for i in range(int(rng.integers(1, 4))):
+            _draw_plate(image, int(rng.integers(10, width - 140)), 20 + i * (height // 3))
+        images.append(cv2.imencode(".jpg", image)[1].tobytes())
+    return images
+
+def synthetic_video(path, frames, width=640, height=360, fps=25, seed=0):
+    """A video where vehicles carrying plates cross the frame one after another."""
+    rng = np.random.default_rng(seed)
+    background = rng.integers(0, 120, (height, width, 3), dtype=np.uint8)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    crossing = max(30, frames // 3)
+    for frame_nmr in range(frames):
+        frame = background.copy()
+        for lane, offset in enumerate((0, crossing // 2)):
+            progress = ((frame_nmr + offset) % crossing) / crossing
+            x = int(-200 + progress * (width + 200))
+            y = 60 + lane * 150
+            if x + 200 > 0 and x < width:
+                cv2.rectangle(frame, (x, y), (x + 200, y + 110), VEHICLE_COLOR, -1)
+                if 0 <= x + 40 and x + 160 < width:
+                    _draw_plate(frame, x + 40, y + 60)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+# --- Detections stand-in -----------------------------------------------------------------
+
+class MemoryCollection:
+    """Just enough of a pymongo collection for the detection writer."""
+
+    def __init__(self):
+        self.docs = {}
+
+    def insert_many(self, docs, ordered=True):
+        for doc in docs:
+            self.docs[id(doc)] = doc
+
+    def update_one(self, query, update, upsert=False):
+        doc = self.docs.setdefault(query["_id"], {"_id": query["_id"], **update.get("$setOnInsert", {})})
+        for key, amount in update.get("$inc", {}).items():
+            doc[key] = doc.get(key, 0) + amount
+
+    def find_one(self, query, projection=None):
+        return self.docs.get(query["_id"])
+
+def use_offline_detection_store():
+    """Points the detection writer at mongomock (or MemoryCollection)."""
+    import detection_store
+    try:
+        import mongomock
+        client = mongomock.MongoClient()
+        collection, stats = client["anpr_db"]["detections"], client["anpr_db"]["detection_stats"]
+    except ImportError:
+        collection, stats = MemoryCollection(), MemoryCollection()
+    detection_store.detection_writer.collection = collection
+    detection_store.detection_writer.stats_collection = stats
+    return collection
+
+
+# --- Measurement ---------------------------------------------------------------------------
+
+def _peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def _reset_peak_rss():
+    """Resets the kernel's peak-RSS watermark (Linux), so each scenario reports its own peak."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+def measure(name, fn, units, unit_name, trace_alloc=False):
+    """Runs fn() once and returns its timing, stage, model-call and memory report."""
+    from metrics import registry
+    from detection_store import detection_writer
+
+    registry.reset()
+    gc.collect()
+    _reset_peak_rss()
+    blocks_before = sys.getallocatedblocks()
+    if trace_alloc:
+        tracemalloc.start()
+    start = time.perf_counter()
+    extra = fn() or {}
+    detection_writer.flush()
+    elapsed = time.perf_counter() - start
+    report = {
+        "scenario": name,
+        "seconds": round(elapsed, 4),
+        unit_name: units,
+        f"{unit_name}_per_second": round(units / elapsed, 2) if elapsed > 0 else 0,
+        "peak_rss_mb": _peak_rss_mb(),
+        "allocated_blocks_delta": sys.getallocatedblocks() - blocks_before,
+    }
+    if trace_alloc:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        report["tracemalloc_peak_mb"] = round(peak / (1024 * 1024), 2)
+    snapshot = registry.snapshot()
+    report["stages"] = {
+        f"{metric}{labels}": {"count": s["count"], "total_ms": round(s["sum"] * 1000, 2),
+                              "mean_ms": round(s["sum"] * 1000 / s["count"], 3) if s["count"] else 0}
+        for metric in ("anpr_stage_seconds", "anpr_ocr_crop_seconds", "anpr_request_seconds")
+        for labels, s in snapshot.get(metric, {}).items()
+    }
+    report["model_calls"] = snapshot.get("anpr_model_calls_total", {})
+    report.update(extra)
+    return report
+
+
+# --- Scenarios ---------------------------------------------------------------------------
+
+def load_models(kind, args):
+    """Returns (plate_detector, character_detector, new_tracker())."""
+    if kind == "real":
+        from model_registry import ModelRegistry
+        registry = ModelRegistry().load_all()
+        registry.warmup()
+        return registry.clone("plate_detector"), registry.clone("character_detector"), registry.new_tracker
+    return (
+        StubPlateDetector(args.plate_latency),
+        StubCharacterDetector(args.ocr_latency, args.ocr_per_crop_latency),
+        lambda: StubTracker(args.tracker_latency),
+    )
+
+def run_benchmarks(args):
+    from image_ocr import process_image_file, process_image_batch, IMAGE_BATCH_SIZE, get_yolo_ocr_text, get_yolo_ocr_text_batch
+    from video_ocr import process_video_file
+    from ocr_cache import ocr_cache
+
+    workdir = tempfile.mkdtemp(prefix="anpr-bench-")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        use_offline_detection_store()
+        plate_detector, character_detector, new_tracker = load_models(args.models, args)
+        images = synthetic_images(args.images, seed=args.seed)
+        decoded = [cv2.imdecode(np.frombuffer(b, np.uint8), cv2.IMREAD_COLOR) for b in images]
+        crops = [crop for image in decoded for crop in _plate_crops(plate_detector, image)]
+        video = synthetic_video(os.path.join(workdir, "source.mp4"), args.video_frames, seed=args.seed)
+
+        def image_run():
+            for i, contents in enumerate(images):
+                process_image_file(plate_detector, character_detector, contents, f"{i}.jpg", ocr_mode="local")
+
+        def image_bulk_run():
+            items = [(contents, f"{i}.jpg") for i, contents in enumerate(images)]
+            for start in range(0, len(items), IMAGE_BATCH_SIZE):
+                process_image_batch(plate_detector, character_detector, items[start:start + IMAGE_BATCH_SIZE],
+                                    ocr_mode="local")
+
+        def video_run(**options):
+            def run():
+                result = process_video_file(plate_detector, character_detector, video, ocr_mode="local",
+                                            vehicle_tracker=new_tracker(), **options)
+                return {"vehicles": len(result["tracked_vehicles"]), "frame_stats": result["frame_stats"]}
+            return run
+
+        scenarios = {
+            "ocr_single": (lambda: [get_yolo_ocr_text(c, character_detector) for c in crops] and None,
+                           len(crops), "crops"),
+            "ocr_batch": (lambda: get_yolo_ocr_text_batch(crops, character_detector) and None,
+                          len(crops), "crops"),
+            "image": (image_run, len(images), "images"),
+            "image_cached": (image_run, len(images), "images"),
+            "image_bulk": (image_bulk_run, len(images), "images"),
+            "video_full": (video_run(sampling_mode="full", plate_detection_mode="full"), args.video_frames, "frames"),
+            "video_adaptive": (video_run(sampling_mode="adaptive", plate_detection_mode="full"), args.video_frames, "frames"),
+            "video_roi": (video_run(sampling_mode="full", plate_detection_mode="roi"), args.video_frames, "frames"),
+        }
+        reports = []
+        for name in args.scenarios:
+            fn, units, unit_name = scenarios[name]
+            if name != "image_cached":
+                # Every scenario starts cold except the one that measures the warm OCR cache
+                ocr_cache.clear()
+            print(f"[INFO] Running scenario '{name}'...", file=sys.stderr)
+            reports.append(measure(name, fn, units, unit_name, args.trace_alloc))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+        },
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "scenarios": reports,
+    }
+
+def _plate_crops(plate_detector, image):
+    boxes = plate_detector(image, verbose=False)[0].boxes.xyxy.cpu().numpy()
+    return [image[int(y1):int(y2), int(x1):int(x2)] for x1, y1, x2, y2 in boxes]
+
+
+# --- Cold start ------------------------------------------------------------------------------
+
+def _get_json(url):
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        try:
+            return e.code, json.load(e)
+        except ValueError:
+            return e.code, None
+    except (OSError, ValueError):
+        return None, None
+
+def measure_cold_start(runs, port, timeout):
+    """Starts the API server `runs` times and times its first /healthz and /readyz answers."""
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    base = f"http://127.0.0.1:{port}"
+    results = []
+    for run in range(runs):
+        print(f"[INFO] Cold start {run + 1}/{runs}...", file=sys.stderr)
+        start = time.perf_counter()
+        server = subprocess.Popen([sys.executable, "-m", "uvicorn", "app:app", "--port", str(port)],
+                                  cwd=backend_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        result = {"healthy_seconds": None, "ready_seconds": None, "model_status": None, "server_phases": None}
+        try:
+            while time.perf_counter() - start < timeout and server.poll() is None:
+                path = "/healthz" if result["healthy_seconds"] is None else "/readyz"
+                status, body = _get_json(base + path)
+                elapsed = round(time.perf_counter() - start, 3)
+                if path == "/healthz" and status == 200:
+                    result["healthy_seconds"] = elapsed
+                elif path == "/readyz" and body is not None:
+                    result["model_status"] = body.get("status")
+                    result["server_phases"] = body.get("startup_seconds")
+                    if status == 200:
+                        result["ready_seconds"] = elapsed
+                    if body.get("status") != "loading":
+                        break
+                time.sleep(0.02)
+        finally:
+            server.terminate()
+            try:
+                server.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        results.append(result)
+    summary = {}
+    for key in ("healthy_seconds", "ready_seconds"):
+        values = sorted(r[key] for r in results if r[key] is not None)
+        summary[key] = values[len(values) // 2] if values else None
+    return {"runs": results, "median": summary}
+
+
+def compare(old_path, new_path):
+    """Per-scenario change in throughput, wall time and peak RSS between two reports."""
+    with open(old_path) as f:
+        old = {s["scenario"]: s for s in json.load(f)["scenarios"]}
+    with open(new_path) as f:
+        new = {s["scenario"]: s for s in json.load(f)["scenarios"]}
+    rows = {}
+    for name in new:
+        if name not in old:
+            continue
+        rate = next(k for k in new[name] if k.endswith("_per_second"))
+        rows[name] = {
+            rate: {"old": old[name].get(rate), "new": new[name][rate],
+                   "change": _relative(old[name].get(rate), new[name][rate])},
+            "seconds": {"old": old[name]["seconds"], "new": new[name]["seconds"],
+                        "change": _relative(old[name]["seconds"], new[name]["seconds"])},
+            "peak_rss_mb": {"old": old[name]["peak_rss_mb"], "new": new[name]["peak_rss_mb"]},
+        }
+    return rows
+
+def _relative(old, new):
+    return f"{(new - old) / old * 100:+.1f}%" if old else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark for the ANPR image and video pipelines.")
+    parser.add_argument("--models", choices=["stub", "real"], default="stub")
+    parser.add_argument("--scenarios", nargs="+", choices=DEFAULT_SCENARIOS, default=list(DEFAULT_SCENARIOS))
+    parser.add_argument("--images", type=int, default=50)
+    parser.add_argument("--video-frames", type=int, default=300)
+    parser.add_argument("--plate-latency", type=float, default=0.02, help="Stub plate detector seconds per call")
+    parser.add_argument("--ocr-latency", type=float, default=0.01, help="Stub character detector seconds per call")
+    parser.add_argument("--ocr-per-crop-latency", type=float, default=0.002)
+    parser.add_argument("--tracker-latency", type=float, default=0.015, help="Stub tracker seconds per frame")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--trace-alloc", action="store_true", help="Also report the tracemalloc peak (slower)")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Diff two JSON reports")
+    parser.add_argument("--cold-start", type=int, metavar="RUNS",
+                        help="Time the API server's start-up (needs the real app dependencies)")
+    parser.add_argument("--port", type=int, default=8765, help="Port for --cold-start")
+    parser.add_argument("--timeout", type=float, default=300, help="Seconds to wait per --cold-start run")
+    args = parser.parse_args()
+
+    if args.compare:
+        print(json.dumps(compare(*args.compare), indent=2))
+        sys.exit(0)
+    # The pipelines log to stdout; keep it for the report alone so `> report.json` is valid JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        if args.cold_start:
+            report = json.dumps({"created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                                 "cold_start": measure_cold_start(args.cold_start, args.port, args.timeout)}, indent=2)
+        else:
+            report = json.dumps(run_benchmarks(args), indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+        print(f"[INFO] Benchmark report written to {args.output}", file=sys.stderr)
+    else:
+        print(report)
@@ -0,0 +1,93 @@
+"""
+bulk_images.py
+
+Expands a bulk image upload - any mix of image files and zip/tar archives of images - into
+(filename, contents) items, one at a time, so a large archive is never held in memory
+as a whole. Archive members that are not images (by extension) are skipped; images that
+are over the size limit or beyond the per-request count limit are reported as errors.
+"""
+import os
+import tarfile
+import zipfile
+
+# --- Bulk Upload Configuration (from environment variables) ---
+BULK_MAX_IMAGES = int(os.environ.get("BULK_MAX_IMAGES", "1000"))
+BULK_MAX_IMAGE_BYTES = int(os.environ.get("BULK_MAX_IMAGE_BYTES", str(25 * 1024 * 1024)))
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+ZIP_EXTENSIONS = (".zip",)
+TAR_EXTENSIONS = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+
+
+def _is_image_name(name):
+    base = os.path.basename(name)
+    return not base.startswith(".") and "__MACOSX" not in name and base.lower().endswith(IMAGE_EXTENSIONS)
+
+def _read_limited(fileobj, limit=BULK_MAX_IMAGE_BYTES):
+    """Reads at most `limit` bytes; None if there was more (the declared size is not trusted)."""
+    data = fileobj.read(limit + 1)
+    return None if len(data) > limit else data
+
+def _zip_members(fileobj):
+    with zipfile.ZipFile(fileobj) as archive:
+        for info in archive.infolist():
+            if info.is_dir() or not _is_image_name(info.filename):
+                continue
+            if info.file_size > BULK_MAX_IMAGE_BYTES:
+                yield info.filename, None, "Image exceeds the size limit."
+                continue
+            with archive.open(info) as member:
+                data = _read_limited(member)
+            yield info.filename, data, None if data is not None else "Image exceeds the size limit."
+
+def _tar_members(fileobj):
+    # Stream mode reads members in order without seeking back through the archive
+    with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+        for info in archive:
+            if not info.isfile() or not _is_image_name(info.name):
+                continue
+            if info.size > BULK_MAX_IMAGE_BYTES:
+                yield info.name, None, "Image exceeds the size limit."
+                continue
+            yield info.name, archive.extractfile(info).read(), None
+
+def _upload_members(filename, fileobj):
+    name = (filename or "").lower()
+    try:
+        if name.endswith(ZIP_EXTENSIONS):
+            yield from _zip_members(fileobj)
+        elif name.endswith(TAR_EXTENSIONS):
+            yield from _tar_members(fileobj)
+        else:
+            data = _read_limited(fileobj)
+            yield filename, data, None if data is not None else "Image exceeds the size limit."
+    except (zipfile.BadZipFile, tarfile.TarError) as e:
+        print(f"❌ ERROR: Could not read archive '{filename}': {e}")
+        yield filename, None, f"Could not read archive: {e}"
+
+def iter_upload_images(uploads, max_images=BULK_MAX_IMAGES):
+    """
+    Yields (filename, contents, error) for every image in `uploads`, a list of
+    (filename, file object). `contents` is None when `error` says why the image was skipped.
+    Archive members are named "<archive>/<member path>". Stops after `max_images` images.
+    """
+    count = 0
+    for filename, fileobj in uploads:
+        is_archive = (filename or "").lower().endswith(ZIP_EXTENSIONS + TAR_EXTENSIONS)
+        for name, contents, error in _upload_members(filename, fileobj):
+            if is_archive and name != filename:
+                name = f"{filename}/{name}"
+            if contents is not None:
+                if count >= max_images:
+                    yield name, None, f"Too many images; at most {max_images} are processed per request."
+                    return
+                count += 1
+            yield name, contents, error
+
+def take(iterator, n):
+    """The next `n` items of `iterator` (fewer at its end)."""
+    items = []
+    for item in iterator:
+        items.append(item)
+        if len(items) >= n:
+            break
+    return items
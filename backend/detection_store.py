@@ -0,0 +1,404 @@
+"""
+detection_store.py
+
+MongoDB storage for detections: one shared connection, a buffered bulk writer, and
+pre-aggregated stats.
+
+The MongoClient (and its connection pool) is created on first use by get_mongo_client(),
+not at import, and is shared by every module and thread of the process.
+
+Processing code hands detection documents to `detection_writer.write()`, which only queues
+them; a background thread batches them into `insert_many` calls, flushed once
+DETECTION_BATCH_SIZE documents are waiting or DETECTION_FLUSH_INTERVAL seconds have passed.
+The queue holds at most DETECTION_QUEUE_SIZE documents; beyond that `write()` blocks
+(backpressure) instead of letting memory grow while MongoDB is slow. A batch that fails
+(e.g. while MongoDB is unreachable) is retried with exponential backoff for up to
+DETECTION_RETRY_SECONDS before it is dropped. The writer is drained on shutdown and at
+interpreter exit; detections written after that are inserted right away, in the caller.
+
+With every batch the writer also $inc's rollup documents in the `detection_stats`
+collection: one "totals" document and one per UTC hour, each with total, failures and
+confidence_sum over the detections, and processing_ms_sum / processing_count over the
+requests. Each processed image or video reports its processing time once, through
+`detection_writer.record_request()`, whether it had no plates or many; the totals document
+also keeps the last STATS_PERCENTILE_WINDOW of them for the percentiles. `read_stats()` then
+answers from a single document instead of scanning the detections.
+
+Detections written before rollups existed are counted once by `backfill_rollups()`. The two
+never count the same document: a cutoff ObjectId, fixed in the "backfill" document by the
+first process that needs it, splits them. Every _id the writer generates is past the cutoff,
+and the backfill only counts detections before it, so it can run next to live writers (in
+any process) without losing or double-counting a detection.
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError, DuplicateKeyError, InvalidOperation
+
+from metrics import timed, STAGE_SECONDS
+
+# --- MongoDB Connection (from environment variables) ---
+mongo_uri = os.environ.get("MONGODB_URI", "mongodb://mongodb:27017/")
+MONGODB_MAX_POOL_SIZE = int(os.environ.get("MONGODB_MAX_POOL_SIZE", "100"))
+MONGODB_TIMEOUT_MS = int(os.environ.get("MONGODB_TIMEOUT_MS", "30000"))
+DATABASE_NAME = "anpr_db"
+_mongo_client = None
+_mongo_client_lock = threading.Lock()
+
+def get_mongo_client():
+    """The process-wide MongoClient, created on first use (it connects in the background)."""
+    global _mongo_client
+    with _mongo_client_lock:
+        if _mongo_client is None:
+            _mongo_client = MongoClient(mongo_uri, maxPoolSize=MONGODB_MAX_POOL_SIZE,
+                                        serverSelectionTimeoutMS=MONGODB_TIMEOUT_MS)
+        return _mongo_client
+
+def close_mongo_client():
+    global _mongo_client
+    with _mongo_client_lock:
+        if _mongo_client is not None:
+            _mongo_client.close()
+            _mongo_client = None
+
+def detections_collection():
+    return get_mongo_client()[DATABASE_NAME]["detections"]
+
+def stats_collection():
+    return get_mongo_client()[DATABASE_NAME]["detection_stats"]
+
+# --- Writer Configuration (from environment variables) ---
+DETECTION_BATCH_SIZE = int(os.environ.get("DETECTION_BATCH_SIZE", "100"))
+DETECTION_FLUSH_INTERVAL = float(os.environ.get("DETECTION_FLUSH_INTERVAL", "1.0"))
+DETECTION_QUEUE_SIZE = int(os.environ.get("DETECTION_QUEUE_SIZE", "10000"))
+# How long a failed batch is retried before its detections are dropped
+DETECTION_RETRY_SECONDS = float(os.environ.get("DETECTION_RETRY_SECONDS", "300"))
+RETRY_BACKOFF = 0.5
+RETRY_BACKOFF_MAX = 30.0
+DUPLICATE_KEY_ERROR = 11000
+STATS_PERCENTILE_WINDOW = int(os.environ.get("STATS_PERCENTILE_WINDOW", "1000"))
+TOTALS_ID = "totals"
+BACKFILL_ID = "backfill"
+ROLLUP_FIELDS = ("total", "failures", "confidence_sum", "processing_ms_sum", "processing_count")
+RECENT_TIMES_FIELD = "recent_processing_ms"
+
+# One processed image or video; only rolled up, never stored as a document of its own
+RequestTiming = namedtuple("RequestTiming", ["processing_ms", "timestamp"])
+
+
+def ensure_indexes(collection=None):
+    """Indexes behind the dashboard queries; create_index is a no-op if they already exist."""
+    collection = detections_collection() if collection is None else collection
+    collection.create_index([("timestamp", DESCENDING)])
+    collection.create_index([("status", ASCENDING)])
+    collection.create_index([("plate", ASCENDING)])
+    collection.create_index([("result_id", ASCENDING)])
+
+
+def _rollup_keys(timestamp):
+    hour = (timestamp or datetime.utcnow()).replace(minute=0, second=0, microsecond=0)
+    return TOTALS_ID, f"hour:{hour.isoformat()}"
+
+def _rollup_increments(docs, timings=()):
+    """Sums a batch of detection documents and request timings into {rollup _id: $inc fields}."""
+    rollups = {}
+
+    def increments(key):
+        return rollups.setdefault(key, {"total": 0, "failures": 0, "confidence_sum": 0.0,
+                                        "processing_ms_sum": 0.0, "processing_count": 0})
+
+    for doc in docs:
+        for key in _rollup_keys(doc.get("timestamp")):
+            inc = increments(key)
+            inc["total"] += 1
+            inc["failures"] += 1 if doc.get("status") == "Failed" else 0
+            inc["confidence_sum"] += float(doc.get("confidence") or 0)
+    for timing in timings:
+        for key in _rollup_keys(timing.timestamp):
+            inc = increments(key)
+            inc["processing_ms_sum"] += float(timing.processing_ms)
+            inc["processing_count"] += 1
+    return rollups
+
+def update_rollups(docs, stats=None, timings=()):
+    """Adds a batch to the rollups: one upsert for the totals and one per hour the batch spans."""
+    stats = stats_collection() if stats is None else stats
+    for key, inc in _rollup_increments(docs, timings).items():
+        update = {"$inc": inc}
+        if key.startswith("hour:"):
+            update["$setOnInsert"] = {"hour": datetime.fromisoformat(key[len("hour:"):])}
+        elif timings:
+            update["$push"] = {RECENT_TIMES_FIELD: {
+                "$each": [float(t.processing_ms) for t in timings], "$slice": -STATS_PERCENTILE_WINDOW,
+            }}
+        stats.update_one({"_id": key}, update, upsert=True)
+
+def rollup_cutoff(stats=None):
+    """
+    The ObjectId splitting the detections the writer rolls up (from the cutoff on) from the ones
+    backfill_rollups() counts (before it). The first caller fixes it at the start of the next
+    second and every caller waits until then, so each _id generated afterwards is past it.
+    """
+    stats = stats_collection() if stats is None else stats
+    state = stats.find_one({"_id": BACKFILL_ID})
+    if state is None:
+        next_second = datetime.utcfromtimestamp(int(time.time()) + 1)
+        # Totals without a cutoff were backfilled before the cutoff existed; don't count them again
+        already_backfilled = stats.find_one({"_id": TOTALS_ID}) is not None
+        try:
+            stats.update_one({"_id": BACKFILL_ID}, {"$setOnInsert": {
+                "cutoff": ObjectId.from_datetime(next_second), "done": already_backfilled,
+            }}, upsert=True)
+        except DuplicateKeyError:
+            pass  # another process created it first
+        state = stats.find_one({"_id": BACKFILL_ID})
+    cutoff = state["cutoff"]
+    wait = cutoff.generation_time.timestamp() - time.time()
+    if wait > 0:
+        time.sleep(wait)
+    return cutoff
+
+def backfill_rollups(collection=None, stats=None):
+    """
+    Adds the detections written before the rollup cutoff to the totals and hourly rollups,
+    once, for databases created before rollups existed. Later detections are counted by the writer.
+    """
+    collection = detections_collection() if collection is None else collection
+    stats = stats_collection() if stats is None else stats
+    cutoff = rollup_cutoff(stats)
+    # Only one process runs it; one that dies half-way leaves it marked as running (logged below)
+    claim = stats.update_one({"_id": BACKFILL_ID, "done": False, "running": {"$ne": True}},
+                             {"$set": {"running": True}})
+    if not claim.modified_count:
+        return
+    start = time.perf_counter()
+    # Same keys as the writer's hourly rollups (UTC, hour.isoformat())
+    by_hour = {"$dateToString": {"format": "%Y-%m-%dT%H:00:00", "date": "$timestamp"}}
+    hours = {}
+    for group in collection.aggregate([
+        {"$match": {"_id": {"$lt": cutoff}}},
+        {"$group": {
+            "_id": by_hour,
+            "total": {"$sum": 1},
+            "failures": {"$sum": {"$cond": [{"$eq": ["$status", "Failed"]}, 1, 0]}},
+            "confidence_sum": {"$sum": "$confidence"},
+        }},
+    ]):
+        hours[group.pop("_id")] = {**dict.fromkeys(ROLLUP_FIELDS, 0), **group}
+    # Older image detections carry their request's processing_ms, once per plate: one per result
+    for group in collection.aggregate([
+        {"$match": {"_id": {"$lt": cutoff}, "processing_ms": {"$exists": True}}},
+        {"$group": {"_id": "$result_id", "timestamp": {"$first": "$timestamp"},
+                    "processing_ms": {"$first": "$processing_ms"}}},
+        {"$group": {"_id": by_hour, "processing_ms_sum": {"$sum": "$processing_ms"},
+                    "processing_count": {"$sum": 1}}},
+    ]):
+        hours.setdefault(group.pop("_id"), dict.fromkeys(ROLLUP_FIELDS, 0)).update(group)
+    totals = dict.fromkeys(ROLLUP_FIELDS, 0)
+    for hour_key, hour in hours.items():
+        inc = {k: hour[k] for k in ROLLUP_FIELDS}
+        for k in ROLLUP_FIELDS:
+            totals[k] += inc[k]
+        if hour_key:  # detections without a timestamp only count towards the totals
+            stats.update_one({"_id": f"hour:{hour_key}"}, {
+                "$inc": inc, "$setOnInsert": {"hour": datetime.fromisoformat(hour_key)},
+            }, upsert=True)
+    if hours:
+        stats.update_one({"_id": TOTALS_ID}, {"$inc": totals}, upsert=True)
+    stats.update_one({"_id": BACKFILL_ID}, {"$set": {"done": True}, "$unset": {"running": ""}})
+    print(f"✅ Backfilled the detection rollups with {totals['total']} detections over "
+          f"{len(hours)} hours in {time.perf_counter() - start:.1f} s.")
+
+def read_stats(stats=None):
+    """The totals rollup document (all zeros if nothing was written yet)."""
+    stats = stats_collection() if stats is None else stats
+    totals = stats.find_one({"_id": TOTALS_ID}) or {}
+    return {key: totals.get(key, 0) for key in ROLLUP_FIELDS}
+
+def recent_processing_times(stats=None):
+    """processing_ms of the last STATS_PERCENTILE_WINDOW requests (oldest first)."""
+    stats = stats_collection() if stats is None else stats
+    totals = stats.find_one({"_id": TOTALS_ID}, {RECENT_TIMES_FIELD: 1}) or {}
+    return totals.get(RECENT_TIMES_FIELD, [])
+
+def read_hourly_stats(since, stats=None):
+    """Per-hour rollups from `since` on, oldest first."""
+    stats = stats_collection() if stats is None else stats
+    return list(stats.find({"hour": {"$gte": since}}, {"_id": 0}).sort("hour", ASCENDING))
+
+
+class DetectionWriter:
+    """
+    Buffers detection documents and writes them with insert_many on a background thread.
+    `collection` / `stats` default to the shared client's collections, resolved on first write.
+    """
+
+    def __init__(self, collection=None, stats=None,
+                 batch_size=DETECTION_BATCH_SIZE, flush_interval=DETECTION_FLUSH_INTERVAL,
+                 max_pending=DETECTION_QUEUE_SIZE, retry_seconds=DETECTION_RETRY_SECONDS):
+        self.collection = collection
+        self.stats_collection = stats
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.retry_seconds = retry_seconds
+        self._queue = queue.Queue(maxsize=max(1, max_pending))
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self._cutoff = None
+        self._counters = {"written": 0, "batches": 0, "failed": 0, "retries": 0, "rollup_failures": 0}
+
+    def write(self, doc):
+        """Queues one detection document; blocks while the queue is full."""
+        self.write_many([doc])
+
+    def write_many(self, docs):
+        if not self._ensure_started():
+            # Closed (shutting down): a late detection is written directly, once, not dropped
+            self._write_batch(list(docs), retry_seconds=0)
+            return
+        for doc in docs:
+            self._queue.put(doc)
+
+    def record_request(self, processing_ms, timestamp=None):
+        """Queues the processing time of one image or video request for the stats rollups."""
+        self.write(RequestTiming(processing_ms, timestamp or datetime.utcnow()))
+
+    def flush(self):
+        """Blocks until every document queued so far has been written (or failed)."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        """Drains the queue and stops the writer thread."""
+        with self._lock:
+            if self._closed or self._thread is None:
+                self._closed = True
+                return
+            self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        # Queued by a write that raced close(), behind the stop marker
+        late = []
+        while True:
+            try:
+                late.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+            self._queue.task_done()
+        if late:
+            self._write_batch(late, retry_seconds=0)
+
+    def stats(self):
+        with self._lock:
+            return {**self._counters, "pending": self._queue.qsize(), "batch_size": self.batch_size}
+
+    def _ensure_started(self):
+        """Starts the writer thread if needed; False once the writer is closed."""
+        with self._lock:
+            if self._closed:
+                return False
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="detection-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+            return True
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    doc = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if doc is None:
+                    self._queue.task_done()
+                    stopping = True
+                    break
+                batch.append(doc)
+            if batch:
+                self._write_batch(batch)
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _insert(self, docs, retrying):
+        """
+        One insert_many attempt. Returns the documents that are now stored; raises on errors
+        worth retrying. Documents rejected one by one (BulkWriteError) are not retried.
+        """
+        if self.collection is None:
+            self.collection = detections_collection()
+        if self._cutoff is None:
+            # Before the first insert: every _id generated from here on is past the cutoff
+            self._cutoff = rollup_cutoff(self.stats_collection)
+        try:
+            with timed(STAGE_SECONDS, stage="mongo_write"):
+                self.collection.insert_many(docs, ordered=False)
+            return docs
+        except BulkWriteError as e:
+            errors = {error["index"]: error for error in e.details.get("writeErrors", [])}
+        # insert_many sets each document's _id before sending, so when retrying, a duplicate
+        # _id is a document that the failed attempt did store
+        rejected = sorted(i for i, error in errors.items()
+                          if not (retrying and error.get("code") == DUPLICATE_KEY_ERROR))
+        if rejected:
+            print(f"❌ ERROR: MongoDB rejected {len(rejected)} of {len(docs)} detections: "
+                  f"{errors[rejected[0]].get('errmsg')}")
+            with self._lock:
+                self._counters["failed"] += len(rejected)
+        rejected = set(rejected)
+        return [doc for i, doc in enumerate(docs) if i not in rejected]
+
+    def _insert_with_retries(self, docs, retry_seconds):
+        """Inserts `docs`, retrying with backoff. Returns the documents that were stored."""
+        deadline = time.monotonic() + retry_seconds
+        delay = RETRY_BACKOFF
+        retrying = False
+        while True:
+            try:
+                return self._insert(docs, retrying)
+            except Exception as e:
+                # InvalidOperation: the client was closed at shutdown, retrying cannot help
+                if isinstance(e, InvalidOperation) or time.monotonic() + delay > deadline:
+                    print(f"❌ ERROR: Failed to write {len(docs)} detections: {e}")
+                    with self._lock:
+                        self._counters["failed"] += len(docs)
+                    return []
+                print(f"[WARN] Writing {len(docs)} detections failed ({e}); retrying in {delay:.1f} s.")
+                with self._lock:
+                    self._counters["retries"] += 1
+                time.sleep(delay)
+                delay = min(delay * 2, RETRY_BACKOFF_MAX)
+                retrying = True
+
+    def _write_batch(self, batch, retry_seconds=None):
+        timings = [item for item in batch if isinstance(item, RequestTiming)]
+        docs = [item for item in batch if not isinstance(item, RequestTiming)]
+        stored = []
+        if docs:
+            stored = self._insert_with_retries(docs, self.retry_seconds if retry_seconds is None else retry_seconds)
+        if not stored and not timings:
+            return
+        if stored:
+            with self._lock:
+                self._counters["written"] += len(stored)
+                self._counters["batches"] += 1
+        try:
+            update_rollups(stored, self.stats_collection, timings)
+        except Exception as e:
+            print(f"❌ ERROR: Failed to update detection rollups: {e}")
+            with self._lock:
+                self._counters["rollup_failures"] += 1
+
+
+detection_writer = DetectionWriter()
@@ -0,0 +1,166 @@
+"""
+ffmpeg_reader.py
+
+Decodes a video while it is still being uploaded. The upload is written, chunk by chunk,
+to the stdin of an ffmpeg subprocess that emits raw frames on stdout as YUV4MPEG2 (a tiny
+text header, then "FRAME" + one I420 picture per frame). FFmpegVideoReader exposes the part
+of the cv2.VideoCapture interface the video pipeline uses (isOpened, read, grab, get,
+release), so frame analysis overlaps the upload.
+
+Only containers that can be decoded front to back can be piped. MP4/MOV files whose index
+("moov" box) comes after the media data cannot; `is_pipe_decodable` tells them apart from
+the first bytes, and those uploads are saved to a file instead.
+"""
+import os
+import shutil
+import struct
+import subprocess
+import threading
+from collections import deque
+
+import cv2
+import numpy as np
+
+# --- FFmpeg Configuration (from environment variables) ---
+FFMPEG_BINARY = os.environ.get("FFMPEG_BINARY", "ffmpeg")
+# Bytes of the upload inspected before deciding between piping and saving to a file
+SNIFF_BYTES = 64 * 1024
+MP4_BRANDS_BOX = b"ftyp"
+
+
+def ffmpeg_available():
+    return shutil.which(FFMPEG_BINARY) is not None
+
+def is_pipe_decodable(head):
+    """
+    True if a video starting with `head` can be decoded from a pipe. For MP4/MOV this means
+    the "moov" box comes before "mdat"; other containers (MKV/WebM, MPEG-TS, AVI, ...) are
+    read front to back. None if `head` is too short to tell.
+    """
+    if head[4:8] != MP4_BRANDS_BOX:
+        return True
+    offset = 0
+    while offset + 8 <= len(head):
+        size, box = struct.unpack(">I4s", head[offset:offset + 8])
+        if box == b"moov":
+            return True
+        if box == b"mdat":
+            return False
+        if size == 1:
+            if offset + 16 > len(head):
+                return None
+            size = struct.unpack(">Q", head[offset + 8:offset + 16])[0]
+        if size < 8:
+            return False
+        offset += size
+    return None
+
+
+class FFmpegVideoReader:
+    """A cv2.VideoCapture look-alike over an ffmpeg process fed through `feed()`."""
+
+    def __init__(self, binary=FFMPEG_BINARY):
+        self._process = subprocess.Popen(
+            [binary, "-hide_banner", "-loglevel", "error", "-i", "pipe:0",
+             "-f", "yuv4mpegpipe", "-pix_fmt", "yuv420p", "pipe:1"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        )
+        self._stderr = deque(maxlen=20)
+        threading.Thread(target=self._drain_stderr, name="ffmpeg-stderr", daemon=True).start()
+        self._header_lock = threading.Lock()
+        self._header = None
+        self.width = self.height = 0
+        self.fps = 0.0
+
+    # --- Upload side ---
+
+    def feed(self, chunk):
+        """Writes upload bytes to ffmpeg; blocks while the decoder is behind. False once ffmpeg has gone."""
+        try:
+            self._process.stdin.write(chunk)
+            return True
+        except (BrokenPipeError, ValueError, OSError):
+            return False
+
+    def finish_input(self):
+        """Signals the end of the upload."""
+        try:
+            self._process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+
+    # --- cv2.VideoCapture interface ---
+
+    def isOpened(self):
+        return self._read_header()
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.width
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.height
+        # The frame count is not known until the upload has been decoded
+        return 0
+
+    def grab(self):
+        return self._read_frame() is not None
+
+    def read(self):
+        data = self._read_frame()
+        if data is None:
+            return False, None
+        yuv = np.frombuffer(data, np.uint8).reshape(self.height * 3 // 2, self.width)
+        return True, cv2.cvtColor(yuv, cv2.COLOR_YUV2BGR_I420)
+
+    def release(self):
+        """Stops ffmpeg; safe to call more than once and from any thread."""
+        # Killing first unblocks a feed() stuck on a full pipe before stdin is closed
+        if self._process.poll() is None:
+            self._process.kill()
+        self._process.wait()
+        self.finish_input()
+
+    def error(self):
+        """ffmpeg's last error lines, if it reported any."""
+        return " ".join(self._stderr) or None
+
+    # --- Internals ---
+
+    def _drain_stderr(self):
+        for line in self._process.stderr:
+            self._stderr.append(line.decode(errors="replace").strip())
+
+    def _read_header(self):
+        with self._header_lock:
+            if self._header is None:
+                try:
+                    line = self._process.stdout.readline()
+                except (ValueError, OSError):
+                    line = b""
+                self._header = line
+                if line.startswith(b"YUV4MPEG2 "):
+                    for param in line.split()[1:]:
+                        key, value = param[:1], param[1:].decode()
+                        if key == b"W":
+                            self.width = int(value)
+                        elif key == b"H":
+                            self.height = int(value)
+                        elif key == b"F" and ":" in value:
+                            num, den = value.split(":")
+                            self.fps = int(num) / int(den) if int(den) else 0.0
+            return self.width > 0 and self.height > 0
+
+    def _read_frame(self):
+        if not self._read_header():
+            return None
+        try:
+            marker = self._process.stdout.readline()
+            if not marker.startswith(b"FRAME"):
+                return None
+            size = self.width * self.height * 3 // 2
+            data = self._process.stdout.read(size)
+        except (ValueError, OSError):
+            return None
+        return data if len(data) == size else None
@@ -1,185 +1,320 @@
 import cv2
 import numpy as np
-from ultralytics import YOLO
 import os
 import uuid
-from pymongo import MongoClient
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from roboflow_ocr import roboflow_ocr_text
+from roboflow_ocr import roboflow_ocr_text_batch, ROBOFLOW_PROJECT, ROBOFLOW_VERSION
+from ocr_cache import ocr_cache, OCR_CACHE_ENABLED
+from detection_store import detection_writer
+from artifacts import save_image_artifacts, character_color_legend
+from metrics import timed, STAGE_SECONDS, OCR_CROP_SECONDS, REQUEST_SECONDS, MODEL_CALLS
 
-# --- MongoDB Connection ---
-mongo_uri = os.environ.get("MONGODB_URI", "mongodb://mongodb:27017/")
-mongo_client = MongoClient(mongo_uri)
-db = mongo_client["anpr_db"]
-detections_collection = db["detections"]
+# --- Local OCR Batching Configuration ---
+# Plate crops are letterboxed to a common (wide) canvas so they can be stacked
+# into a single batch for the character detector. Both sides must be multiples of 32.
+OCR_INPUT_WIDTH = int(os.environ.get("OCR_INPUT_WIDTH", "640"))
+OCR_INPUT_HEIGHT = int(os.environ.get("OCR_INPUT_HEIGHT", "256"))
+OCR_BATCH_SIZE = int(os.environ.get("OCR_BATCH_SIZE", "16"))
+# Read crops locally when Roboflow fails or its circuit breaker is open
+ROBOFLOW_FALLBACK_LOCAL = os.environ.get("ROBOFLOW_FALLBACK_LOCAL", "1") == "1"
+
+def letterbox_crop(image_np, width=OCR_INPUT_WIDTH, height=OCR_INPUT_HEIGHT):
+    """
+    Resizes a crop to fit inside a (width, height) canvas, keeping its aspect ratio,
+    and pads the rest with grey. Returns the canvas, the scale factor and the (x, y) padding.
+    """
+    h, w = image_np.shape[:2]
+    scale = min(width / w, height / h)
+    new_w, new_h = max(1, int(round(w * scale))), max(1, int(round(h * scale)))
+    resized = cv2.resize(image_np, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    pad_x, pad_y = (width - new_w) // 2, (height - new_h) // 2
+    canvas = np.full((height, width, 3), 114, dtype=np.uint8)
+    canvas[pad_y:pad_y + new_h, pad_x:pad_x + new_w] = resized
+    return canvas, scale, (pad_x, pad_y)
+
+def _characters_to_text(result, scale=1.0, pad=(0, 0), crop_shape=None):
+    """
+    Converts one character detector result into an OCR dict, mapping the character
+    boxes from letterboxed coordinates back to the original crop.
+    """
+    class_names = result.names
+    boxes = result.boxes.xyxy.cpu().numpy()
+    classes = result.boxes.cls.cpu().numpy()
+    confs = result.boxes.conf.cpu().numpy()
+    if len(boxes) == 0:
+        return {"text": "", "confidences": []}
+
+    boxes = (boxes - np.array([pad[0], pad[1], pad[0], pad[1]])) / scale
+    if crop_shape is not None:
+        h, w = crop_shape[:2]
+        boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, w)
+        boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, h)
+
+    detections = [
+        {'box': tuple(box), 'label': class_names[int(cls_id)], 'confidence': float(conf)}
+        for box, cls_id, conf in zip(boxes, classes, confs)
+    ]
+    # Sort characters from left to right based on their bounding box
+    detections.sort(key=lambda d: d['box'][0])
+    return {
+        "text": "".join([d['label'] for d in detections]),
+        "confidences": [d['confidence'] for d in detections],
+    }
+
+def get_yolo_ocr_text_batch(crops, character_detector, batch_size=None):
+    """
+    Performs OCR on a list of cropped plate images with as few character detector calls
+    as possible. Crops are letterboxed to a common size and run in batches of `batch_size`.
+    Returns one OCR dict per crop, in the same order as `crops`.
+    """
+    if not character_detector:
+        return [{"error": "Character detector model is not available."} for _ in crops]
+    batch_size = batch_size or OCR_BATCH_SIZE
+
+    ocr_results = [None] * len(crops)
+    prepared = []  # (index, canvas, scale, pad, shape)
+    for i, crop in enumerate(crops):
+        if crop is None or crop.size == 0:
+            ocr_results[i] = {"text": ""}
+            continue
+        canvas, scale, pad = letterbox_crop(crop)
+        prepared.append((i, canvas, scale, pad, crop.shape))
+
+    for start in range(0, len(prepared), batch_size):
+        chunk = prepared[start:start + batch_size]
+        try:
+            chunk_start = time.perf_counter()
+            MODEL_CALLS.inc(model="character_detector")
+            char_results = character_detector(
+                [item[1] for item in chunk],
+                imgsz=(OCR_INPUT_HEIGHT, OCR_INPUT_WIDTH),
+                verbose=False,
+            )
+            per_crop = (time.perf_counter() - chunk_start) / len(chunk)
+            for _ in chunk:
+                OCR_CROP_SECONDS.observe(per_crop, mode="local")
+            for (i, _, scale, pad, shape), result in zip(chunk, char_results):
+                ocr_results[i] = _characters_to_text(result, scale, pad, shape)
+        except Exception as e:
+            error_msg = f"An error occurred during local OCR: {e}"
+            print(f"❌ ERROR: {error_msg}")
+            for item in chunk:
+                ocr_results[item[0]] = {"error": error_msg}
+
+    return ocr_results
 
-# Import local OCR
 def get_yolo_ocr_text(image_np, character_detector):
     """
     Performs OCR on a cropped plate image using a second YOLO model.
     """
-    if not character_detector:
-        return {"error": "Character detector model is not available."}
-        
-    try:
-        char_results = character_detector(image_np)
-        
-        detections = []
-        for result in char_results:
-            class_names = result.names
-            boxes = result.boxes.xyxy.cpu().numpy()
-            classes = result.boxes.cls.cpu().numpy()
-            
-            for box, cls_id in zip(boxes, classes):
-                x1, y1, x2, y2 = box
-                char_label = class_names[int(cls_id)]
-                detections.append({'box': (x1, y1, x2, y2), 'label': char_label})
-
-        if not detections:
-            return {"text": ""}
-
-        # Sort characters from left to right based on their bounding box
-        detections.sort(key=lambda d: d['box'][0])
-        ocr_text = "".join([d['label'] for d in detections])
-        
-        return {"text": ocr_text}
-        
-    except Exception as e:
-        error_msg = f"An error occurred during local OCR: {e}"
-        print(f"❌ ERROR: {error_msg}")
-        return {"error": error_msg}
+    return get_yolo_ocr_text_batch([image_np], character_detector)[0]
+
+def ocr_cache_namespace(ocr_mode, character_detector=None):
+    """Cache namespace for an OCR mode and model version; a new model never sees old entries."""
+    if ocr_mode == "roboflow":
+        return f"roboflow:{ROBOFLOW_PROJECT}/{ROBOFLOW_VERSION}"
+    weights = getattr(character_detector, "ckpt_path", None) or "unknown"
+    version = int(os.path.getmtime(weights)) if os.path.exists(weights) else 0
+    return f"local:{os.path.basename(weights)}@{version}:{OCR_INPUT_WIDTH}x{OCR_INPUT_HEIGHT}"
+
+def roboflow_ocr_batch(crops, character_detector=None):
+    """
+    Roboflow OCR for many crops at once (concurrent requests through the pooled client).
+    Crops that Roboflow could not read - after retries, or while its circuit breaker is open -
+    are read by the local character detector instead and marked with "fallback": "local".
+    """
+    ocr_results = roboflow_ocr_text_batch(crops)
+    failed = [i for i, r in enumerate(ocr_results) if "error" in r]
+    if failed and ROBOFLOW_FALLBACK_LOCAL and character_detector is not None:
+        print(f"[WARN] Roboflow OCR failed for {len(failed)} crop(s); falling back to local YOLO OCR.")
+        fallback = get_yolo_ocr_text_batch([crops[i] for i in failed], character_detector)
+        for i, ocr_result in zip(failed, fallback):
+            ocr_results[i] = {**ocr_result, "fallback": "local"}
+    return ocr_results
+
+def run_ocr_batch(crops, ocr_mode, character_detector):
+    """
+    OCRs a list of plate crops with the selected OCR mode, answering from the OCR cache
+    where possible. Only cache misses reach the character detector or Roboflow.
+    """
+    if not OCR_CACHE_ENABLED:
+        if ocr_mode == "roboflow":
+            return roboflow_ocr_batch(crops, character_detector)
+        return get_yolo_ocr_text_batch(crops, character_detector)
+
+    namespace = ocr_cache_namespace(ocr_mode, character_detector)
+    ocr_results = [None] * len(crops)
+    misses = {}  # exact key -> (cache keys, indices of every identical crop in this batch)
+    for i, crop in enumerate(crops):
+        keys = ocr_cache.keys(crop)
+        if keys[0] in misses:
+            misses[keys[0]][1].append(i)
+            continue
+        ocr_results[i] = ocr_cache.get(namespace, keys, crop)
+        if ocr_results[i] is None:
+            misses[keys[0]] = (keys, [i])
+
+    if misses:
+        miss_crops = [crops[indices[0]] for _, indices in misses.values()]
+        if ocr_mode == "roboflow":
+            fresh = roboflow_ocr_batch(miss_crops, character_detector)
+        else:
+            fresh = get_yolo_ocr_text_batch(miss_crops, character_detector)
+        for (keys, indices), miss_crop, ocr_result in zip(misses.values(), miss_crops, fresh):
+            if "fallback" not in ocr_result:
+                # A local fallback reading must not be served later as a Roboflow result
+                ocr_cache.put(namespace, keys, ocr_result, miss_crop)
+            for i in indices:
+                ocr_results[i] = ocr_result
+    return ocr_results
 
 # Toggle for OCR method
 USE_ROBOFLOW_OCR = os.environ.get("USE_ROBOFLOW_OCR", "0") == "1"
 
-def process_image_file(plate_detector, character_detector, image_contents, image_filename, ocr_mode=None):
-    print(f"[DEBUG] OCR mode in backend: {ocr_mode}")
-    RESULTS_DIR = "results"
-    os.makedirs(RESULTS_DIR, exist_ok=True)
+# --- Bulk Image Configuration (from environment variables) ---
+# Images per plate detector call when several images are processed together
+IMAGE_BATCH_SIZE = int(os.environ.get("IMAGE_BATCH_SIZE", "8"))
+# Threads decoding uploads in parallel (cv2.imdecode releases the GIL)
+IMAGE_DECODE_WORKERS = int(os.environ.get("IMAGE_DECODE_WORKERS", str(min(4, os.cpu_count() or 1))))
 
-    # Generate a unique result folder for this request
-    result_id = str(uuid.uuid4())
-    result_folder = os.path.join(RESULTS_DIR, result_id)
-    os.makedirs(result_folder, exist_ok=True)
+_decode_pool = None
+_decode_pool_lock = threading.Lock()
 
-    np_arr = np.frombuffer(image_contents, np.uint8)
-    img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+def _get_decode_pool():
+    global _decode_pool
+    with _decode_pool_lock:
+        if _decode_pool is None:
+            _decode_pool = ThreadPoolExecutor(max_workers=max(1, IMAGE_DECODE_WORKERS), thread_name_prefix="imdecode")
+        return _decode_pool
 
-    # Save the original image
-    original_path = os.path.join(result_folder, "original.jpg")
-    cv2.imwrite(original_path, img)
+def _decode_image(image_contents):
+    with timed(STAGE_SECONDS, stage="imdecode"):
+        return cv2.imdecode(np.frombuffer(image_contents, np.uint8), cv2.IMREAD_COLOR)
 
-    # Stage 1: Detect License Plates
-    plate_results = plate_detector(img)
+def decode_images(contents_list):
+    """Decodes uploads to BGR images (None where undecodable), in parallel when there are several."""
+    if len(contents_list) == 1:
+        return [_decode_image(contents_list[0])]
+    return list(_get_decode_pool().map(_decode_image, contents_list))
 
-    viz_img = img.copy()
-    final_results = []
-    
-    # Check if any results were found
-    if len(plate_results) > 0 and len(plate_results[0].boxes) > 0:
-        boxes = plate_results[0].boxes.xyxy.cpu().numpy()
-        confs = plate_results[0].boxes.conf.cpu().numpy() # <-- FIX: Get confidences
+def _plates_from_result(img, plate_result):
+    """(index, box, confidence, crop) for every non-empty plate box in one detector result."""
+    plates = []
+    if plate_result is None or len(plate_result.boxes) == 0:
+        return plates
+    boxes = plate_result.boxes.xyxy.cpu().numpy()
+    confs = plate_result.boxes.conf.cpu().numpy() # <-- FIX: Get confidences
+    for idx, (box, conf) in enumerate(zip(boxes, confs)):
+        x1, y1, x2, y2 = map(int, box)
+        cropped_plate = img[y1:y2, x1:x2]
+        if cropped_plate.size == 0:
+            continue
+        plates.append((idx, (x1, y1, x2, y2), conf, cropped_plate))
+    return plates
 
-        for idx, (box, conf) in enumerate(zip(boxes, confs)):
-            x1, y1, x2, y2 = map(int, box)
-            # Draw only the bounding box for the license plate on the main image
-            cv2.rectangle(viz_img, (x1, y1), (x2, y2), (0, 255, 0), 2)
+def process_image_batch(plate_detector, character_detector, items, ocr_mode=None):
+    """
+    Processes several images together: uploads are decoded in parallel, the plate detector
+    runs once per IMAGE_BATCH_SIZE images, OCR runs once over every plate crop of the batch,
+    and all detections are queued for MongoDB in one call. `items` is a list of
+    (image_contents, image_filename); returns one process_image_file-style dict per item,
+    in order ({"error": ...} for an image that cannot be decoded).
+    """
+    print(f"[DEBUG] OCR mode in backend: {ocr_mode}")
+    batch_start = time.perf_counter()
 
-            cropped_plate = img[y1:y2, x1:x2]
-            if cropped_plate.size == 0:
-                continue
+    images = decode_images([contents for contents, _ in items])
+    decoded = [i for i, img in enumerate(images) if img is not None]
 
-            if ocr_mode == "roboflow":
-                print("[DEBUG] Using Roboflow OCR branch.")
-                print("[INFO] Using Roboflow OCR for plate text recognition.")
-                ocr_result = roboflow_ocr_text(cropped_plate)
-                print(f"[DEBUG] Roboflow OCR result: {ocr_result}")
-                # Draw only subtle, semi-transparent, thin colored outlines for each character
-                color_palette = [
-                    (255, 0, 0),    # Red
-                    (0, 255, 0),    # Green
-                    (0, 0, 255),    # Blue
-                    (255, 255, 0),  # Cyan
-                    (255, 0, 255),  # Magenta
-                    (0, 255, 255),  # Yellow
-                    (255, 128, 0),  # Orange
-                    (128, 0, 255),  # Purple
-                    (0, 128, 255),  # Light Blue
-                    (128, 255, 0),  # Lime
-                ]
-                char_color_legend = {}
-                overlay = cropped_plate.copy()
-                alpha = 0.4  # Opacity for the overlay
-                thickness = 1  # Thin outline
-                if "characters" in ocr_result:
-                    for i, char in enumerate(ocr_result["characters"]):
-                        color = color_palette[i % len(color_palette)]
-                        char_label = char["class"]
-                        char_color_legend[char_label] = color
-                        x1c = int(char["x"] - char["width"] / 2)
-                        y1c = int(char["y"] - char["height"] / 2)
-                        x2c = int(char["x"] + char["width"] / 2)
-                        y2c = int(char["y"] + char["height"] / 2)
-                        cv2.rectangle(overlay, (x1c, y1c), (x2c, y2c), color, thickness)
-                # Blend the overlay with the original cropped plate
-                cv2.addWeighted(overlay, alpha, cropped_plate, 1 - alpha, 0, cropped_plate)
+    # Stage 1: Detect License Plates (one detector call per IMAGE_BATCH_SIZE images)
+    plate_results = {}
+    for start in range(0, len(decoded), max(1, IMAGE_BATCH_SIZE)):
+        chunk = decoded[start:start + max(1, IMAGE_BATCH_SIZE)]
+        MODEL_CALLS.inc(model="plate_detector")
+        with timed(STAGE_SECONDS, stage="plate_detection"):
+            if len(chunk) == 1:
+                chunk_results = plate_detector(images[chunk[0]])
             else:
-                print("[DEBUG] Using local OCR branch.")
-                print("[INFO] Using local YOLO OCR for plate text recognition.")
-                ocr_result = get_yolo_ocr_text(cropped_plate, character_detector)
-                print(f"[DEBUG] Local OCR result: {ocr_result}")
-            # Save each cropped plate image for debugging (after drawing color-coded character boxes)
-            cropped_plate_path = os.path.join(result_folder, f"cropped_plate_{idx}.jpg")
-            cv2.imwrite(cropped_plate_path, cropped_plate)
+                chunk_results = plate_detector([images[i] for i in chunk], verbose=False)
+        for i, result in zip(chunk, chunk_results):
+            plate_results[i] = result
+
+    plates_per_image = {i: _plates_from_result(images[i], plate_results.get(i)) for i in decoded}
+
+    # OCR runs once over all crops of all images (through the OCR cache) instead of once per plate
+    all_crops = [plate[3] for i in decoded for plate in plates_per_image[i]]
+    ocr_results = []
+    if all_crops:
+        print(f"[INFO] Using {'Roboflow' if ocr_mode == 'roboflow' else 'batched local YOLO'} OCR for plate text recognition.")
+        ocr_results = run_ocr_batch(all_crops, ocr_mode, character_detector)
 
+    # Every image of the batch shares its processing time
+    processing_seconds = (time.perf_counter() - batch_start) / max(1, len(items))
+    processing_ms = round(processing_seconds * 1000, 1)
+    now = datetime.utcnow()
+    responses = []
+    detection_docs = []
+    ocr_iter = iter(ocr_results)
+    for i, (image_contents, image_filename) in enumerate(items):
+        img = images[i]
+        if img is None:
+            print(f"❌ ERROR: Could not decode image '{image_filename}'.")
+            responses.append({"error": "Could not decode image."})
+            continue
+
+        # Generate a unique result id for this image (its files exist only if artifacts are saved)
+        result_id = str(uuid.uuid4())
+        final_results = []
+        artifact_plates = []
+        for idx, (x1, y1, x2, y2), conf, _ in plates_per_image[i]:
+            ocr_result = next(ocr_iter)
+            print(f"[DEBUG] {'Roboflow' if ocr_mode == 'roboflow' else 'Local'} OCR result: {ocr_result}")
             plate_data = {
                 "bounding_box": { "x1": float(x1), "y1": float(y1), "x2": float(x2), "y2": float(y2) },
                 "confidence": float(conf) # <-- FIX: Add confidence to result
             }
-
-            # Remove drawing of plate_text on the full annotated image (viz_img)
-            # Draw the OCR text on the annotated image (above or inside the bounding box)
-            plate_text = ocr_result.get("text") if "text" in ocr_result else "OCR_FAILED"
-            font = cv2.FONT_HERSHEY_SIMPLEX
-            font_scale = 0.8
-            font_thickness = 2
-            text_color = (0, 255, 0) if plate_text != "OCR_FAILED" else (0, 0, 255)
-            text = plate_text if plate_text else "OCR_FAILED"
-            # Calculate text size and position
-            (text_width, text_height), _ = cv2.getTextSize(text, font, font_scale, font_thickness)
-            text_x = x1
-            text_y = y1 - text_height - 5 # Position above the bounding box
-            # cv2.putText(viz_img, text, (text_x, text_y), font, font_scale, text_color, font_thickness, cv2.LINE_AA)
-
             if "error" in ocr_result:
                 plate_data["plate_text"] = "OCR_FAILED"
                 plate_data["error_message"] = ocr_result["error"]
             else:
                 plate_data["plate_text"] = ocr_result["text"]
-            # Add char_color_legend to plate_data for frontend reference
-            if ocr_mode == "roboflow" and 'char_color_legend' in locals():
-                plate_data['char_color_legend'] = char_color_legend
+
+            # Roboflow characters are outlined on the cropped plate image in these colours;
+            # the legend is for frontend reference
+            characters = ocr_result.get("characters") if ocr_mode == "roboflow" else None
+            if ocr_mode == "roboflow":
+                plate_data['char_color_legend'] = character_color_legend(characters or [])
+            artifact_plates.append({"index": idx, "box": [x1, y1, x2, y2], "characters": characters})
             final_results.append(plate_data)
 
-    # --- FIX: Save the annotated image ---
-    annotated_img_path = os.path.join(result_folder, "plate_detection.jpg")
-    cv2.imwrite(annotated_img_path, viz_img)
-    annotated_image_url = f"/results/{result_id}/plate_detection.jpg"
-    # Now log to MongoDB
-    now = datetime.utcnow()
-    for plate in final_results:
-        detections_collection.insert_one({
+        # Artifacts: the upload is kept as-is, annotated images are rendered off the request path
+        annotated_file = save_image_artifacts(result_id, image_contents, image_filename, img, artifact_plates)
+        REQUEST_SECONDS.observe(processing_seconds, kind="image")
+        # Once per image, with or without plates (not once per plate)
+        detection_writer.record_request(processing_ms, now)
+        detection_docs.extend({
             "type": "image",
             "plate": plate.get("plate_text", "OCR_FAILED"),
             "confidence": plate.get("confidence", 0), # This now works correctly
             "status": "Success" if plate.get("plate_text") and plate.get("plate_text") != "OCR_FAILED" else "Failed",
             "timestamp": now,
             "result_id": result_id # Link to the specific result folder
+        } for plate in final_results)
+        # --- FIX: Return the URL to the annotated image ---
+        responses.append({
+            "results": final_results,
+            "result_id": result_id,
+            "annotated_image_url": f"/results/{result_id}/{annotated_file}" if annotated_file else None,
+            "processing_ms": processing_ms,
         })
-        
-    # --- FIX: Return the URL to the annotated image ---
-    return {
-        "results": final_results, 
-        "result_id": result_id,
-        "annotated_image_url": annotated_image_url
-    }
\ No newline at end of file
+
+    # Now log to MongoDB (queued; the detection writer inserts in bulk)
+    detection_writer.write_many(detection_docs)
+    return responses
+
+def process_image_file(plate_detector, character_detector, image_contents, image_filename, ocr_mode=None):
+    """Processes a single uploaded image (a batch of one)."""
+    return process_image_batch(plate_detector, character_detector, [(image_contents, image_filename)], ocr_mode)[0]
@@ -0,0 +1,232 @@
+"""
+inference_pool.py
+
+Runs the CPU-heavy image and video pipelines off the FastAPI event loop.
+
+The executor is either a thread pool or a process pool (INFERENCE_EXECUTOR=thread|process).
+YOLO models keep per-call predictor state and must not be shared between concurrent calls,
+so every worker gets its own instances: thread workers take clones from the app's
+ModelRegistry (shared weights, no disk reads), process workers load a registry of their own.
+Submissions are bounded: once INFERENCE_WORKERS tasks are running and INFERENCE_QUEUE_SIZE
+more are waiting, new submissions are rejected with ExecutorSaturated so the API can answer
+429 right away. Unless INFERENCE_THREADS is set, each worker's models get an even share of the
+cores as intra-op threads, so concurrent workers don't each start a thread per core.
+"""
+import asyncio
+import multiprocessing
+import multiprocessing.util
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait as wait_futures
+
+from model_backends import INFERENCE_THREADS
+
+# --- Executor Configuration (from environment variables) ---
+INFERENCE_EXECUTOR = os.environ.get("INFERENCE_EXECUTOR", "thread")
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", str(min(4, os.cpu_count() or 1))))
+INFERENCE_QUEUE_SIZE = int(os.environ.get("INFERENCE_QUEUE_SIZE", "16"))
+INFERENCE_RETRY_AFTER = int(os.environ.get("INFERENCE_RETRY_AFTER", "2"))
+# "pipeline" processes a video in one pipeline; "segmented" splits it across worker processes
+VIDEO_ENGINE = os.environ.get("VIDEO_ENGINE", "pipeline")
+
+
+class ExecutorSaturated(Exception):
+    """Raised when every worker is busy and the waiting queue is full."""
+
+
+class ExecutorUnavailable(Exception):
+    """Raised when the executor has been shut down."""
+
+
+# --- Per-worker model state ---
+# threading.local works for both pool kinds: a process pool runs its initializer and
+# its tasks on the main thread of each worker process.
+_worker_state = threading.local()
+
+def worker_threads(workers=INFERENCE_WORKERS):
+    """Intra-op threads per worker: INFERENCE_THREADS if set, else an even share of the cores."""
+    if INFERENCE_THREADS > 0:
+        return INFERENCE_THREADS
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+def _limit_torch_threads(threads):
+    # torch keeps the intra-op thread count per calling thread, so every worker sets its own
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(threads)
+
+def init_thread_worker(registry, threads=None):
+    """Thread executor initializer: takes private clones of the registry's models."""
+    _limit_torch_threads(threads or worker_threads())
+    _worker_state.registry = registry
+    _worker_state.plate_detector = registry.clone("plate_detector")
+    _worker_state.character_detector = registry.clone("character_detector")
+
+def init_process_worker(threads=None):
+    """Process executor initializer: loads and warms up a registry inside the worker process."""
+    from model_registry import ModelRegistry
+    from detection_store import detection_writer
+    threads = threads or worker_threads()
+    _limit_torch_threads(threads)
+    registry = ModelRegistry(threads=threads).load_all()
+    registry.warmup()
+    init_thread_worker(registry, threads)
+    # Pool workers leave through os._exit, which skips atexit; drain their detections on exit
+    multiprocessing.util.Finalize(None, detection_writer.close, exitpriority=10)
+    print(f"✅ Inference worker process {os.getpid()} loaded its models.")
+
+def worker_initializer(kind, registry, threads=None):
+    """Returns the (initializer, initargs) pair for an executor of the given kind."""
+    threads = threads or worker_threads()
+    if kind == "process":
+        return init_process_worker, (threads,)
+    return init_thread_worker, (registry, threads)
+
+def current_worker():
+    """The calling worker's model state: registry, plate_detector and character_detector."""
+    return _worker_state
+
+def process_image_job(image_contents, image_filename, ocr_mode=None):
+    """Runs process_image_file with the calling worker's models."""
+    from image_ocr import process_image_file
+    return process_image_file(
+        _worker_state.plate_detector, _worker_state.character_detector,
+        image_contents, image_filename, ocr_mode=ocr_mode,
+    )
+
+def process_image_batch_job(items, ocr_mode=None):
+    """Runs process_image_batch over [(image_contents, image_filename)] with the calling worker's models."""
+    from image_ocr import process_image_batch
+    return process_image_batch(
+        _worker_state.plate_detector, _worker_state.character_detector,
+        items, ocr_mode=ocr_mode,
+    )
+
+def process_video_job(video_path, ocr_mode=None, video_engine=VIDEO_ENGINE, **kwargs):
+    """
+    Runs process_video_file with the calling worker's models, or hands the video to the
+    segment-parallel engine when `video_engine="segmented"`.
+    """
+    if video_engine == "segmented":
+        from video_segments import process_video_segmented
+        return process_video_segmented(video_path, ocr_mode=ocr_mode, **kwargs)
+    from video_ocr import process_video_file
+    return process_video_file(
+        _worker_state.plate_detector, _worker_state.character_detector,
+        video_path, ocr_mode=ocr_mode,
+        vehicle_tracker=_worker_state.registry.new_tracker(), **kwargs,
+    )
+
+
+class InferenceExecutor:
+    """
+    A thread or process pool with a bounded number of outstanding tasks and
+    queue-depth / in-flight gauges.
+    """
+
+    def __init__(self, kind=INFERENCE_EXECUTOR, max_workers=INFERENCE_WORKERS,
+                 max_queue=INFERENCE_QUEUE_SIZE, initializer=None, initargs=()):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown inference executor kind: {kind}")
+        self.kind = kind
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        if kind == "process":
+            # Spawn instead of fork: forking a parent that already holds torch state is unsafe.
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=initializer, initargs=initargs,
+            )
+        else:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="inference",
+                initializer=initializer, initargs=initargs,
+            )
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._rejected = 0
+        self._completed = 0
+        self._cancelled = 0
+        self._closed = False
+
+    def is_saturated(self):
+        with self._lock:
+            return len(self._pending) >= self.max_workers + self.max_queue
+
+    def has_idle_worker(self):
+        """Whether a task submitted now would start right away instead of waiting in the queue."""
+        with self._lock:
+            return not self._closed and len(self._pending) < self.max_workers
+
+    def submit(self, fn, *args, **kwargs):
+        """Submits a task, raising ExecutorSaturated instead of queueing without bound."""
+        with self._lock:
+            if self._closed:
+                raise ExecutorUnavailable("Inference executor is shut down.")
+            if len(self._pending) >= self.max_workers + self.max_queue:
+                self._rejected += 1
+                raise ExecutorSaturated("Inference queue is full.")
+            future = self._submit_locked(fn, args, kwargs)
+        future.add_done_callback(self._on_done)
+        return future
+
+    def submit_if_idle(self, fn, *args, **kwargs):
+        """Like submit(), but returns None instead of queueing the task when no worker is idle."""
+        with self._lock:
+            if self._closed:
+                raise ExecutorUnavailable("Inference executor is shut down.")
+            if len(self._pending) >= self.max_workers:
+                return None
+            future = self._submit_locked(fn, args, kwargs)
+        future.add_done_callback(self._on_done)
+        return future
+
+    def _submit_locked(self, fn, args, kwargs):
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except RuntimeError as e:
+            raise ExecutorUnavailable(str(e))
+        self._pending.add(future)
+        return future
+
+    async def run(self, fn, *args, **kwargs):
+        """Awaitable version of submit() for use inside async endpoints."""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def _on_done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+            # A cancelled future was dropped from the queue and never ran
+            if future.cancelled():
+                self._cancelled += 1
+            else:
+                self._completed += 1
+
+    def stats(self):
+        with self._lock:
+            in_flight = sum(1 for f in self._pending if f.running())
+            queue_depth = len(self._pending) - in_flight
+            return {
+                "kind": self.kind,
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "in_flight": in_flight,
+                "queue_depth": queue_depth,
+                "completed": self._completed,
+                "cancelled": self._cancelled,
+                "rejected": self._rejected,
+            }
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def join(self, timeout=None):
+        """After shutdown(), waits up to `timeout` seconds for the running tasks to finish."""
+        with self._lock:
+            futures = list(self._pending)
+        wait_futures(futures, timeout=timeout)
@@ -0,0 +1,209 @@
+"""
+jobs.py
+
+Background video jobs: submitting a video returns a job id immediately, the video is
+processed on a dedicated worker pool, and clients poll (or stream) the job's progress.
+
+The job id doubles as the result id, so a finished job's result is stored next to its images
+(/results/<job_id>/job.json in the result store) and its detections are tagged with the
+same result_id.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+
+from inference_pool import ExecutorSaturated, process_video_job
+from result_store import result_store
+from video_ocr import VideoProcessingCancelled
+
+# --- Job Configuration (from environment variables) ---
+VIDEO_JOB_WORKERS = int(os.environ.get("VIDEO_JOB_WORKERS", "2"))
+VIDEO_JOB_QUEUE_SIZE = int(os.environ.get("VIDEO_JOB_QUEUE_SIZE", "32"))
+JOB_RETENTION_SECONDS = int(os.environ.get("JOB_RETENTION_SECONDS", "3600"))
+JOB_STATUS_FILE = "job.json"
+
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+
+class VideoJob:
+    """State of one background video job. Progress fields are updated from the worker thread."""
+
+    def __init__(self, job_id, filename, video_path, ocr_mode, options=None):
+        self.job_id = job_id
+        self.filename = filename
+        self.video_path = video_path
+        self.ocr_mode = ocr_mode
+        self.options = options or {}
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.frames_processed = 0
+        self.total_frames = 0
+        self.result = None
+        self.error = None
+        self.cancel_event = threading.Event()
+        self.future = None
+
+    def update_progress(self, frames_processed, total_frames):
+        self.frames_processed = frames_processed
+        self.total_frames = max(total_frames, frames_processed)
+
+    def to_dict(self):
+        elapsed = ((self.finished_at or time.time()) - self.started_at) if self.started_at else 0
+        fps = self.frames_processed / elapsed if elapsed > 0 else 0
+        eta = None
+        if self.status == "running" and fps > 0 and self.total_frames:
+            eta = round((self.total_frames - self.frames_processed) / fps, 1)
+        return {
+            "job_id": self.job_id,
+            "filename": self.filename,
+            "status": self.status,
+            "frames_processed": self.frames_processed,
+            "total_frames": self.total_frames,
+            "progress": round(self.frames_processed / self.total_frames * 100, 1) if self.total_frames else 0,
+            "fps": round(fps, 2),
+            "eta_seconds": eta,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "result": self.result,
+        }
+
+
+class JobManager:
+    """Runs VideoJobs on a bounded pool of worker threads, each with its own models."""
+
+    def __init__(self, results_dir, max_workers=VIDEO_JOB_WORKERS, max_queue=VIDEO_JOB_QUEUE_SIZE,
+                 initializer=None, initargs=()):
+        self.results_dir = results_dir
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="video-job",
+            initializer=initializer, initargs=initargs,
+        )
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def submit(self, video_path, filename, ocr_mode=None, job_id=None, options=None):
+        """
+        Queues a video for processing. The job takes ownership of (and deletes) video_path;
+        `options` are extra process_video_file keyword arguments.
+        """
+        with self._lock:
+            self._prune()
+            active = sum(1 for j in self._jobs.values() if j.status not in TERMINAL_STATUSES)
+            if active >= self.max_workers + self.max_queue:
+                raise ExecutorSaturated("Video job queue is full.")
+            job = VideoJob(job_id or str(uuid.uuid4()), filename, video_path, ocr_mode, options)
+            self._jobs[job.job_id] = job
+            job.future = self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        """Returns the job's status dict, falling back to the stored job.json of older jobs."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        try:
+            uuid.UUID(job_id)
+        except ValueError:
+            return None
+        stored = result_store.read(job_id, JOB_STATUS_FILE)
+        if stored is not None:
+            return json.loads(stored)
+        # Jobs that finished before the result store kept job.json in their own folder
+        status_path = os.path.join(self.results_dir, job_id, JOB_STATUS_FILE)
+        if not os.path.exists(status_path):
+            return None
+        with open(status_path, "r") as f:
+            return json.load(f)
+
+    def cancel(self, job_id):
+        """Cancels a queued or running job. Returns False if the job is unknown or already finished."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None or job.status in TERMINAL_STATUSES:
+            return False
+        job.cancel_event.set()
+        if job.future is not None and job.future.cancel():
+            # Never started: finish it here since _run will not be called
+            self._finish(job, "cancelled")
+            self._remove_video(job)
+        return True
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        statuses = [j.status for j in jobs]
+        return {
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "queued": statuses.count("queued"),
+            "running": statuses.count("running"),
+            "fps": round(sum(j.to_dict()["fps"] for j in jobs if j.status == "running"), 2),
+        }
+
+    def video_paths(self):
+        """Uploaded videos still owned by unfinished jobs (not orphans, however old)."""
+        with self._lock:
+            return [j.video_path for j in self._jobs.values() if j.status not in TERMINAL_STATUSES and j.video_path]
+
+    def shutdown(self, wait=False):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            job.cancel_event.set()
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def join(self, timeout=None):
+        """After shutdown(), waits up to `timeout` seconds for the running jobs to stop."""
+        with self._lock:
+            futures = [j.future for j in self._jobs.values() if j.future is not None]
+        wait_futures(futures, timeout=timeout)
+
+    def _run(self, job):
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            result = process_video_job(
+                job.video_path, ocr_mode=job.ocr_mode, result_id=job.job_id,
+                progress_callback=job.update_progress, cancel_event=job.cancel_event,
+                **job.options,
+            )
+            if "error" in result and "tracked_vehicles" not in result:
+                job.error = result["error"]
+                self._finish(job, "failed")
+            else:
+                job.result = result
+                self._finish(job, "completed")
+        except VideoProcessingCancelled:
+            self._finish(job, "cancelled")
+        except Exception as e:
+            print(f"❌ ERROR: Video job {job.job_id} failed: {e}")
+            job.error = str(e)
+            self._finish(job, "failed")
+        finally:
+            self._remove_video(job)
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished_at = time.time()
+        result_store.put(job.job_id, JOB_STATUS_FILE, json.dumps(job.to_dict()).encode())
+
+    def _remove_video(self, job):
+        if job.video_path and os.path.exists(job.video_path):
+            os.remove(job.video_path)
+
+    def _prune(self):
+        """Drops finished jobs from memory after JOB_RETENTION_SECONDS; job.json still answers for them."""
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        for job_id, job in list(self._jobs.items()):
+            if job.status in TERMINAL_STATUSES and job.finished_at and job.finished_at < cutoff:
+                del self._jobs[job_id]
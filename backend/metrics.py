@@ -0,0 +1,207 @@
+"""
+metrics.py
+
+In-process latency histograms, counters and gauges for the processing hot path, rendered in
+the Prometheus text exposition format by GET /metrics.
+
+Stage timings are recorded with `timed(STAGE_SECONDS, stage="...")` around the code they
+measure. Gauges are callbacks evaluated at scrape time, so queue depths are always current.
+Metrics live in the process that records them: with INFERENCE_EXECUTOR=process or the
+segmented video engine, work done inside worker processes is not included.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; spans a sub-millisecond imdecode up to a multi-minute video
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = [(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in pairs]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return {_format_labels(key): value for key, value in self._values.items()}
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self):
+        """{label string: {"count", "sum"}} per series."""
+        with self._lock:
+            return {_format_labels(key): {"count": series[-1], "sum": series[-2]}
+                    for key, series in self._series.items()}
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_format_labels(key, [('le', _format_value(bound))])} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(series[-2])}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    """A gauge whose samples come from `callback()`: a number, or a {label dict tuple: value} dict."""
+
+    def __init__(self, name, help_text, callback):
+        self.name = name
+        self.help = help_text
+        self.callback = callback
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            value = self.callback()
+        except Exception:
+            return lines
+        samples = value.items() if isinstance(value, dict) else [((), value)]
+        for key, sample in samples:
+            if sample is not None:
+                lines.append(f"{self.name}{_format_labels(key)} {_format_value(sample)}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics = [m for m in self._metrics if m.name != metric.name] + [metric]
+        return metric
+
+    def snapshot(self):
+        """Current counter values and histogram counts/sums by metric name (gauges are skipped)."""
+        with self._lock:
+            metrics = list(self._metrics)
+        return {m.name: m.snapshot() for m in metrics if hasattr(m, "snapshot")}
+
+    def reset(self):
+        """Clears every counter and histogram (used between benchmark runs)."""
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            if hasattr(metric, "reset"):
+                metric.reset()
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    "anpr_stage_seconds",
+    "Time spent per processing stage (upload_read, imdecode, plate_detection, image_write, mongo_write, video_frame).",
+))
+OCR_CROP_SECONDS = registry.register(Histogram(
+    "anpr_ocr_crop_seconds", "OCR time per plate crop, by OCR mode (local or roboflow).",
+))
+REQUEST_SECONDS = registry.register(Histogram(
+    "anpr_request_seconds", "End-to-end processing time per image or video.",
+))
+MODEL_CALLS = registry.register(Counter(
+    "anpr_model_calls_total", "Model invocations (one per batch), by model.",
+))
+FRAMES = registry.register(Counter(
+    "anpr_video_frames_total", "Video frames analyzed by the detection stage.",
+))
+STREAM_FRAMES = registry.register(Counter(
+    "anpr_stream_frames_total", "Live stream frames, by outcome (captured or dropped by the ring buffer).",
+))
+STREAM_LATENCY_SECONDS = registry.register(Histogram(
+    "anpr_stream_latency_seconds",
+    "Live stream latency: capture to inference (frame), capture of a vehicle's last frame to its event (event).",
+))
+
+
+@contextmanager
+def timed(histogram, **labels):
+    """Observes the wall time of the with-block into `histogram`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start, **labels)
+
+def percentiles(values, qs=(50, 95, 99)):
+    """Nearest-rank percentiles of `values` as {q: value}; empty input gives zeros."""
+    ordered = sorted(values)
+    if not ordered:
+        return {q: 0 for q in qs}
+    return {q: ordered[min(len(ordered) - 1, max(0, -(-q * len(ordered) // 100) - 1))] for q in qs}
+
+def register_gauge(name, help_text, callback):
+    return registry.register(Gauge(name, help_text, callback))
+
+def render_metrics():
+    return registry.render()
@@ -0,0 +1,121 @@
+"""
+mock_roboflow.py
+
+A local stand-in for the Roboflow hosted inference API, for testing and benchmarking the
+Roboflow OCR path offline. It accepts the same request (POST /<project>/<version>?api_key=...
+with a base64 JPEG body) and answers with fake character predictions after a configurable
+latency, optionally failing a share of requests with 429/503 to exercise retries and the
+circuit breaker.
+
+Serve it and point the backend at it:
+    python mock_roboflow.py serve --port 9001 --latency 0.15
+    ROBOFLOW_API_BASE=http://127.0.0.1:9001 ROBOFLOW_API_KEY=x ROBOFLOW_PROJECT=p ROBOFLOW_VERSION=1 ...
+
+Or compare sequential and concurrent clients against it in one go:
+    python mock_roboflow.py bench --crops 64 --latency 0.15 --concurrency 8
+"""
+import argparse
+import base64
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+PLATE_TEXT = "BA1PA2345"
+
+
+class MockRoboflowHandler(BaseHTTPRequestHandler):
+    # Set on the server instance: latency, jitter, error_rate
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(max(0.0, server.latency + random.uniform(-server.jitter, server.jitter)))
+        if random.random() < server.error_rate:
+            status = random.choice([429, 503])
+            self.send_response(status)
+            if status == 429:
+                self.send_header("Retry-After", "0")
+            self.end_headers()
+            return
+        img = cv2.imdecode(np.frombuffer(base64.b64decode(body), np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            self.send_response(400)
+            self.end_headers()
+            return
+        h, w = img.shape[:2]
+        step = w / len(PLATE_TEXT)
+        predictions = [
+            {"x": step * (i + 0.5), "y": h / 2, "width": step * 0.8, "height": h * 0.6,
+             "class": char, "confidence": 0.9}
+            for i, char in enumerate(PLATE_TEXT)
+        ]
+        payload = json.dumps({"predictions": predictions}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_mock_server(port=0, latency=0.15, jitter=0.0, error_rate=0.0):
+    """Starts the mock server on a background thread; returns (server, base_url)."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockRoboflowHandler)
+    server.daemon_threads = True
+    server.latency, server.jitter, server.error_rate = latency, jitter, error_rate
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def bench(crops, latency, jitter, error_rate, concurrency):
+    from roboflow_ocr import RoboflowClient, CircuitBreaker
+
+    server, base_url = start_mock_server(latency=latency, jitter=jitter, error_rate=error_rate)
+    images = [np.random.randint(0, 255, (80, 240, 3), dtype=np.uint8) for _ in range(crops)]
+    report = {"crops": crops, "latency": latency, "error_rate": error_rate}
+    try:
+        for name, workers in (("sequential", 1), ("concurrent", concurrency)):
+            client = RoboflowClient(api_key="mock", project="mock", version="1", api_base=base_url,
+                                    concurrency=workers, breaker=CircuitBreaker(threshold=crops + 1))
+            start = time.perf_counter()
+            results = client.ocr_batch(images)
+            elapsed = time.perf_counter() - start
+            report[name] = {
+                "workers": workers,
+                "seconds": round(elapsed, 3),
+                "crops_per_second": round(crops / elapsed, 2),
+                "errors": sum(1 for r in results if "error" in r),
+                **client.stats(),
+            }
+    finally:
+        server.shutdown()
+    report["speedup"] = round(report["sequential"]["seconds"] / report["concurrent"]["seconds"], 2)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Roboflow inference API.")
+    parser.add_argument("command", choices=["serve", "bench"])
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--latency", type=float, default=0.15, help="Seconds per request")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered 429/503")
+    parser.add_argument("--crops", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        server, base_url = start_mock_server(args.port, args.latency, args.jitter, args.error_rate)
+        print(f"[INFO] Mock Roboflow API listening on {base_url}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+    else:
+        print(json.dumps(bench(args.crops, args.latency, args.jitter, args.error_rate, args.concurrency), indent=2))
@@ -0,0 +1,404 @@
+"""
+model_backends.py
+
+CPU inference backends for the YOLO models. Each model runs on one of:
+
+    torch     the .pt weights through PyTorch (the default)
+    onnx      an ONNX export run by ONNX Runtime (pip install onnxruntime)
+    openvino  an OpenVINO IR export (pip install openvino)
+
+in FP32 or INT8. Exported models are loaded through ultralytics' YOLO(), so they keep the
+exact call interface (model(images, imgsz=...), model.track(...), result.boxes) that
+process_image_file, get_yolo_ocr_text and process_video_file use. Only where the weights
+come from changes.
+
+Per-model settings are read from <MODEL>_BACKEND, <MODEL>_PRECISION and <MODEL>_IMGSZ
+(e.g. CHARACTER_DETECTOR_BACKEND=openvino), falling back to MODEL_BACKEND / MODEL_PRECISION.
+Exports are written next to the .pt file and reused. A missing export is created at load
+time (MODEL_AUTO_EXPORT=1); INT8 needs a directory of calibration images (CALIBRATION_DIR).
+
+`python model_backends.py export ...` exports ahead of time, and
+`python model_backends.py compare ...` writes an accuracy/latency report per model and
+backend against the PyTorch FP32 reference.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+# --- Backend Configuration (from environment variables) ---
+MODEL_BACKENDS = ("torch", "onnx", "openvino")
+MODEL_PRECISIONS = ("fp32", "int8")
+MODEL_BACKEND = os.environ.get("MODEL_BACKEND", "torch")
+MODEL_PRECISION = os.environ.get("MODEL_PRECISION", "fp32")
+MODEL_AUTO_EXPORT = os.environ.get("MODEL_AUTO_EXPORT", "1") == "1"
+# Intra-op threads per model instance; 0 = an even share of the cores per model-running worker
+# (see inference_pool.worker_threads), or the backend default when loaded outside the pool
+INFERENCE_THREADS = int(os.environ.get("INFERENCE_THREADS", "0"))
+CALIBRATION_DIR = os.environ.get("CALIBRATION_DIR", "")
+CALIBRATION_IMAGES = int(os.environ.get("CALIBRATION_IMAGES", "200"))
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+# Default input sizes: the character detector reads wide letterboxed plate crops (image_ocr.py)
+DEFAULT_IMGSZ = {
+    "plate_detector": (640, 640),
+    "character_detector": (int(os.environ.get("OCR_INPUT_HEIGHT", "256")), int(os.environ.get("OCR_INPUT_WIDTH", "640"))),
+    "vehicle_tracker": (640, 640),
+}
+MATCH_IOU = 0.5
+
+
+def parse_imgsz(value):
+    """"640" -> (640, 640); "256,640" -> (256, 640) as (height, width)."""
+    parts = [int(p) for p in str(value).replace("x", ",").split(",") if p.strip()]
+    return (parts[0], parts[0]) if len(parts) == 1 else (parts[0], parts[1])
+
+def backend_config(name):
+    """The backend, precision and input size configured for model `name`."""
+    prefix = name.upper()
+    config = {
+        "backend": os.environ.get(f"{prefix}_BACKEND", MODEL_BACKEND),
+        "precision": os.environ.get(f"{prefix}_PRECISION", MODEL_PRECISION),
+        "imgsz": parse_imgsz(os.environ.get(f"{prefix}_IMGSZ", "")) if os.environ.get(f"{prefix}_IMGSZ")
+        else DEFAULT_IMGSZ.get(name, (640, 640)),
+    }
+    if config["backend"] not in MODEL_BACKENDS:
+        raise ValueError(f"Unknown backend for {name}: {config['backend']}")
+    if config["precision"] not in MODEL_PRECISIONS:
+        raise ValueError(f"Unknown precision for {name}: {config['precision']}")
+    if config["backend"] == "torch" and config["precision"] == "int8":
+        raise ValueError(f"INT8 for {name} needs the onnx or openvino backend")
+    return config
+
+def exported_path(weights, backend, precision):
+    """Where the export of `weights` for a backend/precision lives (ultralytics' naming for FP32)."""
+    stem = os.path.splitext(weights)[0]
+    if backend == "torch":
+        return weights
+    if backend == "onnx":
+        return f"{stem}.onnx" if precision == "fp32" else f"{stem}_int8.onnx"
+    return f"{stem}_openvino_model" if precision == "fp32" else f"{stem}_int8_openvino_model"
+
+
+# --- Calibration ---
+
+def calibration_images(calibration_dir=CALIBRATION_DIR, limit=CALIBRATION_IMAGES):
+    paths = sorted(p for p in glob.glob(os.path.join(calibration_dir, "**", "*"), recursive=True)
+                   if p.lower().endswith(IMAGE_EXTENSIONS))
+    if not paths:
+        raise ValueError(f"INT8 export needs calibration images; none found in '{calibration_dir}' (set CALIBRATION_DIR)")
+    return paths[:limit]
+
+def preprocess(image, imgsz):
+    """Letterboxes a BGR image to `imgsz` (h, w) the way ultralytics does: RGB, CHW, 0-1 float."""
+    h, w = image.shape[:2]
+    scale = min(imgsz[0] / h, imgsz[1] / w)
+    new_w, new_h = max(1, int(round(w * scale))), max(1, int(round(h * scale)))
+    canvas = np.full((imgsz[0], imgsz[1], 3), 114, dtype=np.uint8)
+    top, left = (imgsz[0] - new_h) // 2, (imgsz[1] - new_w) // 2
+    canvas[top:top + new_h, left:left + new_w] = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    return np.ascontiguousarray(canvas[:, :, ::-1].transpose(2, 0, 1)[None], dtype=np.float32) / 255.0
+
+def _calibration_yaml(calibration_dir, names):
+    """A minimal ultralytics dataset file over the calibration images (labels are not needed)."""
+    path = os.path.join(tempfile.mkdtemp(prefix="anpr-calib-"), "calibration.yaml")
+    with open(path, "w") as f:
+        json.dump({"path": os.path.abspath(calibration_dir), "train": ".", "val": ".", "names": names}, f)
+    return path
+
+
+# --- Export ---
+
+def export_model(weights, backend, precision="fp32", imgsz=(640, 640), calibration_dir=CALIBRATION_DIR):
+    """Exports `weights` for a backend/precision (reusing an existing export) and returns its path."""
+    target = exported_path(weights, backend, precision)
+    if backend == "torch" or os.path.exists(target):
+        return target
+    from ultralytics import YOLO
+    start = time.perf_counter()
+    print(f"[INFO] Exporting {weights} to {backend} {precision.upper()} at {imgsz[0]}x{imgsz[1]}...")
+    if backend == "onnx":
+        fp32_path = YOLO(weights).export(format="onnx", imgsz=list(imgsz), dynamic=True, simplify=True)
+        if precision == "int8":
+            _quantize_onnx(fp32_path, target, imgsz, calibration_dir)
+        elif fp32_path != target:
+            os.replace(fp32_path, target)
+    else:
+        model = YOLO(weights)
+        kwargs = {"format": "openvino", "imgsz": list(imgsz), "dynamic": True}
+        if precision == "int8":
+            calibration_images(calibration_dir)  # fail early with a clear message
+            kwargs.update(int8=True, data=_calibration_yaml(calibration_dir, model.names))
+        exported = model.export(**kwargs)
+        if os.path.abspath(exported) != os.path.abspath(target):
+            os.replace(exported, target)
+    print(f"✅ Exported {target} in {time.perf_counter() - start:.1f} s.")
+    return target
+
+def _quantize_onnx(fp32_path, int8_path, imgsz, calibration_dir):
+    """Static INT8 quantization (QDQ, per-channel weights) calibrated on letterboxed images."""
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+    import onnxruntime
+
+    input_name = onnxruntime.InferenceSession(fp32_path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+    paths = calibration_images(calibration_dir)
+
+    class Reader(CalibrationDataReader):
+        def __init__(self):
+            self._paths = iter(paths)
+
+        def get_next(self):
+            for path in self._paths:
+                image = cv2.imread(path, cv2.IMREAD_COLOR)
+                if image is not None:
+                    return {input_name: preprocess(image, imgsz)}
+            return None
+
+    quantize_static(fp32_path, int8_path, Reader(), quant_format=QuantFormat.QDQ, per_channel=True,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+
+
+# --- Loading ---
+
+def _limit_threads(model, backend, threads):
+    """
+    Caps intra-op threads so several workers do not oversubscribe the CPU. ultralytics builds
+    the ONNX Runtime session / OpenVINO compiled model when a clone is first called, so they
+    are rebuilt once with the thread limit from a predict-start callback.
+    """
+    if threads <= 0:
+        return
+    if backend == "torch":
+        import torch
+        torch.set_num_threads(threads)
+        return
+
+    def on_predict_start(predictor):
+        backend_model = predictor.model
+        if getattr(backend_model, "_anpr_threads", None) == threads:
+            return
+        try:
+            if backend == "onnx":
+                import onnxruntime
+                options = onnxruntime.SessionOptions()
+                options.intra_op_num_threads = threads
+                options.inter_op_num_threads = 1
+                backend_model.session = onnxruntime.InferenceSession(
+                    backend_model.w, sess_options=options, providers=["CPUExecutionProvider"])
+            else:
+                attr = "ov_compiled_model" if hasattr(backend_model, "ov_compiled_model") else "ov_compiled"
+                setattr(backend_model, attr, backend_model.core.compile_model(
+                    backend_model.ov_model, device_name="CPU",
+                    config={"INFERENCE_NUM_THREADS": threads, "PERFORMANCE_HINT": "LATENCY"}))
+            backend_model._anpr_threads = threads
+        except Exception as e:
+            print(f"[WARN] Could not limit {backend} threads to {threads}: {e}")
+            backend_model._anpr_threads = threads
+
+    model.add_callback("on_predict_start", on_predict_start)
+
+def load_model(name, weights, config=None, threads=INFERENCE_THREADS, auto_export=MODEL_AUTO_EXPORT):
+    """
+    Loads model `name` on its configured backend. Returns (model, info). A missing export is
+    created when `auto_export` is on; otherwise the PyTorch weights are used and info says so.
+    """
+    from ultralytics import YOLO
+    config = dict(config or backend_config(name))
+    path = exported_path(weights, config["backend"], config["precision"])
+    if not os.path.exists(path) and config["backend"] != "torch":
+        if auto_export:
+            path = export_model(weights, config["backend"], config["precision"], config["imgsz"])
+        else:
+            print(f"[WARN] No {config['backend']} {config['precision']} export of {weights}; using PyTorch.")
+            config.update(backend="torch", precision="fp32")
+            path = weights
+    model = YOLO(path, task="detect") if config["backend"] != "torch" else YOLO(path)
+    # Calls that pass no imgsz use the configured input size
+    model.overrides["imgsz"] = list(config["imgsz"])
+    _limit_threads(model, config["backend"], threads)
+    return model, {**config, "imgsz": list(config["imgsz"]), "artifact": path, "threads": threads or None}
+
+
+# --- Comparison report ---
+
+def _detections(result):
+    boxes = result.boxes
+    if boxes is None or len(boxes) == 0:
+        return np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, int)
+    return boxes.xyxy.cpu().numpy(), boxes.conf.cpu().numpy(), boxes.cls.cpu().numpy().astype(int)
+
+def _iou_matrix(a, b):
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)), np.float32)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+def _text(result, names):
+    xyxy, _, classes = _detections(result)
+    return "".join(names[int(c)] for _, c in sorted(zip(xyxy[:, 0], classes)))
+
+def agreement(reference, candidate, names=None):
+    """
+    How closely a candidate backend's results match the reference's, image by image: boxes are
+    matched greedily by IoU >= 0.5 with the same class. With `names` the detections are also
+    read left to right as plate text and compared exactly.
+    """
+    matched = ref_total = cand_total = text_equal = 0
+    ious, conf_deltas = [], []
+    for ref, cand in zip(reference, candidate):
+        ref_xyxy, ref_conf, ref_cls = _detections(ref)
+        cand_xyxy, cand_conf, cand_cls = _detections(cand)
+        ref_total += len(ref_xyxy)
+        cand_total += len(cand_xyxy)
+        iou = _iou_matrix(ref_xyxy, cand_xyxy)
+        iou[ref_cls[:, None] != cand_cls[None, :]] = 0
+        while iou.size and iou.max() >= MATCH_IOU:
+            i, j = np.unravel_index(np.argmax(iou), iou.shape)
+            ious.append(float(iou[i, j]))
+            conf_deltas.append(abs(float(ref_conf[i]) - float(cand_conf[j])))
+            matched += 1
+            iou[i, :] = 0
+            iou[:, j] = 0
+        if names is not None:
+            text_equal += _text(ref, names) == _text(cand, names)
+    report = {
+        "recall": round(matched / ref_total, 4) if ref_total else 1.0,
+        "precision": round(matched / cand_total, 4) if cand_total else 1.0,
+        "mean_iou": round(float(np.mean(ious)), 4) if ious else None,
+        "mean_confidence_delta": round(float(np.mean(conf_deltas)), 4) if conf_deltas else None,
+    }
+    if names is not None:
+        report["text_agreement"] = round(text_equal / len(reference), 4) if reference else 1.0
+    return report
+
+def _time_calls(model, inputs, imgsz, repeats):
+    results, latencies = [], []
+    model(inputs[0], imgsz=list(imgsz), verbose=False)  # warmup
+    for _ in range(repeats):
+        results = []
+        for image in inputs:
+            start = time.perf_counter()
+            results.extend(model(image, imgsz=list(imgsz), verbose=False))
+            latencies.append((time.perf_counter() - start) * 1000)
+    ordered = sorted(latencies)
+    return results, {
+        "mean_ms": round(float(np.mean(latencies)), 2),
+        "p50_ms": round(ordered[len(ordered) // 2], 2),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 2),
+    }
+
+def compare_backends(names, images_dir, variants, threads=INFERENCE_THREADS, repeats=3, limit=50,
+                     calibration_dir=None):
+    """
+    Runs each model on each (backend, precision) variant over the images in `images_dir` and
+    reports latency per call and agreement with the PyTorch FP32 outputs. The character
+    detector is evaluated on plate crops cut by the PyTorch plate detector. Missing INT8
+    exports are calibrated on `calibration_dir` (default: CALIBRATION_DIR, else `images_dir`).
+    """
+    calibration_dir = calibration_dir or CALIBRATION_DIR or images_dir
+    from ultralytics import YOLO
+    from model_registry import DEFAULT_MODEL_SPECS
+
+    images = [cv2.imread(p, cv2.IMREAD_COLOR) for p in calibration_images(images_dir, limit)]
+    images = [image for image in images if image is not None]
+    inputs = {"plate_detector": images, "vehicle_tracker": images}
+    if "character_detector" in names:
+        plate_detector = YOLO(DEFAULT_MODEL_SPECS["plate_detector"])
+        crops = []
+        for image in images:
+            xyxy, _, _ = _detections(plate_detector(image, verbose=False)[0])
+            crops.extend(image[int(y1):int(y2), int(x1):int(x2)] for x1, y1, x2, y2 in xyxy)
+        inputs["character_detector"] = [crop for crop in crops if crop.size] or images
+
+    report = {"created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "images": len(images), "threads": threads, "models": {}}
+    for name in names:
+        weights = DEFAULT_MODEL_SPECS[name]
+        imgsz = backend_config(name)["imgsz"]
+        rows = []
+        reference = None
+        for backend, precision in [("torch", "fp32")] + [v for v in variants if v != ("torch", "fp32")]:
+            row = {"backend": backend, "precision": precision}
+            try:
+                export_model(weights, backend, precision, imgsz, calibration_dir=calibration_dir)
+                model, info = load_model(name, weights, {"backend": backend, "precision": precision, "imgsz": imgsz},
+                                         threads=threads, auto_export=True)
+                results, latency = _time_calls(model, inputs[name], imgsz, repeats)
+                row.update(latency)
+                artifact = info["artifact"]
+                row["size_mb"] = round(sum(os.path.getsize(p) for p in glob.glob(os.path.join(artifact, "*")))
+                                       / 1e6 if os.path.isdir(artifact) else os.path.getsize(artifact) / 1e6, 1)
+                if reference is None:
+                    reference = results
+                else:
+                    row.update(agreement(reference, results, model.names if name == "character_detector" else None))
+            except Exception as e:
+                print(f"❌ ERROR: {name} on {backend} {precision} failed: {e}", file=sys.stderr)
+                row["error"] = str(e)
+            rows.append(row)
+        torch_ms = rows[0].get("mean_ms")
+        for row in rows:
+            if torch_ms and row.get("mean_ms"):
+                row["speedup"] = round(torch_ms / row["mean_ms"], 2)
+        report["models"][name] = {"imgsz": list(imgsz), "inputs": len(inputs[name]), "variants": rows}
+    return report
+
+def print_report(report):
+    for name, model in report["models"].items():
+        print(f"\n{name} ({model['inputs']} inputs at {model['imgsz'][0]}x{model['imgsz'][1]})")
+        print(f"  {'variant':<16}{'mean ms':>9}{'p95 ms':>9}{'speedup':>9}{'recall':>8}{'prec.':>8}{'IoU':>7}{'text':>7}")
+        for row in model["variants"]:
+            variant = f"{row['backend']} {row['precision']}"
+            if "error" in row:
+                print(f"  {variant:<16}  failed: {row['error']}")
+                continue
+            cells = [row.get(k) for k in ("mean_ms", "p95_ms", "speedup", "recall", "precision", "mean_iou", "text_agreement")]
+            widths = (9, 9, 9, 8, 8, 7, 7)
+            print(f"  {variant:<16}" + "".join(f"{'-' if c is None else c:>{w}}" for c, w in zip(cells, widths)))
+
+
+def main():
+    from model_registry import DEFAULT_MODEL_SPECS
+    variants_help = "backend:precision pairs, e.g. onnx:fp32 onnx:int8 openvino:fp32 openvino:int8"
+    parser = argparse.ArgumentParser(description="Export the ANPR models to CPU backends and compare them.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="export models ahead of time")
+    compare = sub.add_parser("compare", help="accuracy/latency report against PyTorch FP32")
+    for p in (export, compare):
+        p.add_argument("--models", nargs="+", choices=list(DEFAULT_MODEL_SPECS), default=list(DEFAULT_MODEL_SPECS))
+        p.add_argument("--variants", nargs="+", default=["onnx:fp32", "onnx:int8", "openvino:fp32", "openvino:int8"],
+                       help=variants_help)
+    compare.add_argument("--images", required=True, help="directory of evaluation images (e.g. gate camera stills)")
+    compare.add_argument("--limit", type=int, default=50, help="evaluation images used")
+    compare.add_argument("--repeats", type=int, default=3)
+    compare.add_argument("--threads", type=int, default=INFERENCE_THREADS)
+    compare.add_argument("--output", help="write the JSON report here")
+    args = parser.parse_args()
+    variants = [tuple(v.split(":")) for v in args.variants]
+
+    if args.command == "export":
+        for name in args.models:
+            for backend, precision in variants:
+                export_model(DEFAULT_MODEL_SPECS[name], backend, precision, backend_config(name)["imgsz"])
+        return
+    report = compare_backends(args.models, args.images, variants, threads=args.threads,
+                              repeats=args.repeats, limit=args.limit)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
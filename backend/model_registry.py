@@ -0,0 +1,153 @@
+"""
+model_registry.py
+
+Loads every YOLO model once at startup, warms it up, and hands out cheap per-worker clones.
+The API server loads them on a background thread (load_in_background), so it can answer
+health checks while torch and the weights are still loading.
+
+A clone shares the loaded weights with the registry's copy but has its own predictor and
+callbacks, so concurrent workers never share per-call state, and each video gets a fresh
+tracker state (persist=True keeps tracks on the predictor) without re-reading weights from disk.
+
+Each model runs on the backend configured for it (PyTorch, ONNX Runtime or OpenVINO, FP32 or
+INT8; see model_backends.py). Exported models are called exactly like the PyTorch ones.
+"""
+import copy
+import os
+import threading
+import time
+
+import numpy as np
+
+from model_backends import backend_config, load_model, INFERENCE_THREADS
+
+# --- Model Paths (from environment variables) ---
+PLATE_DETECTOR_PATH = os.environ.get("PLATE_DETECTOR_PATH", "./models/license_plate_detector.pt")
+CHARACTER_DETECTOR_PATH = os.environ.get("CHARACTER_DETECTOR_PATH", "./models/character_detector.pt")
+VEHICLE_TRACKER_PATH = os.environ.get("VEHICLE_TRACKER_PATH", "yolov8n.pt")
+MODEL_WARMUP = os.environ.get("MODEL_WARMUP", "1") == "1"
+
+DEFAULT_MODEL_SPECS = {
+    "plate_detector": PLATE_DETECTOR_PATH,
+    "character_detector": CHARACTER_DETECTOR_PATH,
+    "vehicle_tracker": VEHICLE_TRACKER_PATH,
+}
+
+
+class ModelRegistry:
+    """Holds one loaded instance of each model plus its load/warmup statistics."""
+
+    def __init__(self, specs=None, threads=INFERENCE_THREADS):
+        self.specs = dict(specs or DEFAULT_MODEL_SPECS)
+        self.threads = threads
+        self._models = {}
+        self._info = {name: {"path": path, "loaded": False} for name, path in self.specs.items()}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._done = threading.Event()
+
+    def load_all(self):
+        for name in self.specs:
+            self.load(name)
+        return self
+
+    def load_in_background(self, warmup=MODEL_WARMUP, on_loaded=None, on_ready=None):
+        """
+        Loads (and optionally warms up) every model on a background thread. `on_loaded` is
+        called once all models are loaded, `on_ready` once they are warm; see status().
+        """
+        def run():
+            try:
+                self.load_all()
+                if on_loaded is not None and self.is_ready():
+                    on_loaded()
+                if warmup:
+                    self.warmup()
+            finally:
+                self._done.set()
+            if self.is_ready():
+                print("✅ All models loaded successfully.")
+                if on_ready is not None:
+                    on_ready()
+
+        if self._thread is None:
+            self._thread = threading.Thread(target=run, name="model-loader", daemon=True)
+            self._thread.start()
+        return self
+
+    def status(self):
+        """"loading" until the background load and warmup finish, then "ready" or "failed"."""
+        if not self._done.is_set():
+            return "loading"
+        return "ready" if self.is_ready() else "failed"
+
+    def load(self, name):
+        path = self.specs[name]
+        start = time.perf_counter()
+        try:
+            model, backend = load_model(name, path, threads=self.threads)
+        except Exception as e:
+            print(f"❌ ERROR: Error loading model '{name}' from {path}: {e}")
+            self._info[name].update({"loaded": False, "error": str(e)})
+            return None
+        load_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self._models[name] = model
+        self._info[name].update({
+            "loaded": True,
+            "error": None,
+            "load_time_ms": round(load_ms, 1),
+            "device": str(getattr(model, "device", "cpu")),
+            **backend,
+        })
+        print(f"✅ Loaded model '{name}' from {backend['artifact']} ({backend['backend']} {backend['precision']}) in {load_ms:.0f} ms.")
+        return model
+
+    def warmup(self):
+        """Runs one dummy inference per loaded model so the first real request isn't slow."""
+        from image_ocr import OCR_INPUT_WIDTH, OCR_INPUT_HEIGHT
+        for name, model in list(self._models.items()):
+            if name == "character_detector":
+                imgsz = (OCR_INPUT_HEIGHT, OCR_INPUT_WIDTH)
+            else:
+                imgsz = tuple(self._info[name].get("imgsz") or backend_config(name)["imgsz"])
+            dummy = np.zeros((imgsz[0], imgsz[1], 3), np.uint8)
+            start = time.perf_counter()
+            try:
+                model(dummy, imgsz=imgsz, verbose=False)
+            except Exception as e:
+                print(f"❌ ERROR: Warmup of model '{name}' failed: {e}")
+                self._info[name]["warmup_error"] = str(e)
+                continue
+            self._info[name]["warmup_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        return self
+
+    def get(self, name):
+        with self._lock:
+            return self._models.get(name)
+
+    def clone(self, name):
+        """
+        Returns a copy of a loaded model that shares its weights but not its predictor,
+        callbacks or overrides. Returns None if the model failed to load.
+        """
+        base = self.get(name)
+        if base is None:
+            return None
+        model = copy.copy(base)
+        model.predictor = None
+        model.callbacks = {event: list(fns) for event, fns in base.callbacks.items()}
+        model.overrides = dict(base.overrides)
+        return model
+
+    def new_tracker(self):
+        """A vehicle tracker with empty tracking state, for one video."""
+        return self.clone("vehicle_tracker")
+
+    def is_ready(self, *names):
+        names = names or tuple(self.specs)
+        with self._lock:
+            return all(name in self._models for name in names)
+
+    def stats(self):
+        return {name: dict(info) for name, info in self._info.items()}
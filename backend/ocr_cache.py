@@ -0,0 +1,231 @@
+"""
+ocr_cache.py
+
+Caches OCR results by the content of the plate crop, so re-uploaded images and near-identical
+consecutive video shots don't pay for another character detector pass or Roboflow call.
+
+Entries are keyed by an exact hash of the crop's pixels and, optionally, a perceptual hash
+(the crop converted to grey, downscaled to 24x8 and thresholded at its mean), which also
+matches crops that differ only by compression noise or slight brightness changes. The
+perceptual hash is lossy (two different plates can share one), so a perceptual hit is only
+served if a finer grey thumbnail stored with the entry is within OCR_CACHE_PERCEPTUAL_MAX_DIFF
+of the new crop in every vertical strip, which is where differing characters show up. Keys
+are namespaced by OCR mode and model version, so switching models never returns stale text.
+Memory is bounded by OCR_CACHE_SIZE entries with LRU eviction and OCR_CACHE_TTL expiry. If
+OCR_CACHE_DIR is set, entries are also written to a SQLite file there and survive restarts;
+the file is held to the same TTL and entry limit (oldest entries are dropped first).
+"""
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+# --- Cache Configuration (from environment variables) ---
+OCR_CACHE_ENABLED = os.environ.get("OCR_CACHE_ENABLED", "1") == "1"
+OCR_CACHE_SIZE = int(os.environ.get("OCR_CACHE_SIZE", "4096"))
+OCR_CACHE_TTL = float(os.environ.get("OCR_CACHE_TTL", "3600"))
+OCR_CACHE_PERCEPTUAL = os.environ.get("OCR_CACHE_PERCEPTUAL", "0") == "1"
+OCR_CACHE_PERCEPTUAL_MAX_DIFF = float(os.environ.get("OCR_CACHE_PERCEPTUAL_MAX_DIFF", "12"))
+OCR_CACHE_DIR = os.environ.get("OCR_CACHE_DIR", "")
+PERCEPTUAL_SIZE = (24, 8)
+VERIFY_SIZE = (64, 16)
+VERIFY_STRIP_WIDTH = 4
+
+
+def exact_hash(image_np):
+    """Hash of the crop's shape and raw pixels (equivalent to hashing a lossless encoding)."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(image_np.shape).encode())
+    digest.update(np.ascontiguousarray(image_np).tobytes())
+    return "x" + digest.hexdigest()
+
+def perceptual_hash(image_np):
+    """Mean-thresholded 24x8 grey thumbnail of the crop, as a hex string."""
+    grey = image_np if image_np.ndim == 2 else cv2.cvtColor(image_np, cv2.COLOR_BGR2GRAY)
+    thumb = cv2.resize(grey, PERCEPTUAL_SIZE, interpolation=cv2.INTER_AREA).astype(np.float32)
+    bits = (thumb > thumb.mean()).flatten()
+    return "p" + np.packbits(bits).tobytes().hex()
+
+def verification_thumbnail(image_np):
+    """64x16 grey thumbnail stored with perceptual entries to confirm a perceptual match."""
+    grey = image_np if image_np.ndim == 2 else cv2.cvtColor(image_np, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(grey, VERIFY_SIZE, interpolation=cv2.INTER_AREA)
+
+def thumbnail_distance(a, b):
+    """
+    Largest mean absolute difference, in grey levels, over the thumbnails' vertical strips,
+    after removing each thumbnail's mean brightness. A single changed character moves its
+    strip a lot even though it barely moves the average over the whole plate.
+    """
+    a = a.astype(np.float32)
+    b = b.astype(np.float32)
+    diff = np.abs((a - a.mean()) - (b - b.mean())).mean(axis=0)
+    return float(diff.reshape(-1, VERIFY_STRIP_WIDTH).mean(axis=1).max())
+
+
+class OCRCache:
+    """Thread-safe LRU + TTL cache of OCR result dicts, with optional SQLite backing."""
+
+    def __init__(self, max_entries=OCR_CACHE_SIZE, ttl=OCR_CACHE_TTL, perceptual=OCR_CACHE_PERCEPTUAL,
+                 disk_dir=OCR_CACHE_DIR, perceptual_max_diff=OCR_CACHE_PERCEPTUAL_MAX_DIFF):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.perceptual = perceptual
+        self.perceptual_max_diff = perceptual_max_diff
+        self._entries = OrderedDict()  # (namespace, key) -> (stored_at, result, thumbnail or None)
+        self._lock = threading.Lock()
+        self._counters = {}  # namespace -> {"hits", "perceptual_hits", "misses"}
+        self._db = None
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._db = sqlite3.connect(os.path.join(disk_dir, "ocr_cache.sqlite3"), check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS ocr_cache "
+                "(namespace TEXT, key TEXT, stored_at REAL, result TEXT, thumbnail BLOB, "
+                "PRIMARY KEY (namespace, key))"
+            )
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(ocr_cache)")]
+            if "thumbnail" not in columns:
+                # Files written before perceptual verification; their perceptual rows never match
+                self._db.execute("ALTER TABLE ocr_cache ADD COLUMN thumbnail BLOB")
+            self._db.execute("CREATE INDEX IF NOT EXISTS ocr_cache_stored_at ON ocr_cache (stored_at)")
+            self._prune_disk(time.time())
+            self._db.commit()
+
+    def keys(self, image_np):
+        keys = [exact_hash(image_np)]
+        if self.perceptual:
+            keys.append(perceptual_hash(image_np))
+        return keys
+
+    def get(self, namespace, keys, image_np=None):
+        """
+        Returns a copy of the cached result for any of `keys`, or None. Perceptual keys are
+        only tried when the crop itself is passed as `image_np`, to verify the match.
+        """
+        now = time.time()
+        thumbnail = None
+        if image_np is not None and any(key.startswith("p") for key in keys):
+            thumbnail = verification_thumbnail(image_np)
+        with self._lock:
+            counters = self._counters.setdefault(namespace, {"hits": 0, "perceptual_hits": 0, "misses": 0})
+            for key in keys:
+                if key.startswith("p") and thumbnail is None:
+                    continue
+                result = self._lookup(namespace, key, now, thumbnail)
+                if result is not None:
+                    counters["perceptual_hits" if key.startswith("p") else "hits"] += 1
+                    return copy.deepcopy(result)
+            counters["misses"] += 1
+        return None
+
+    def put(self, namespace, keys, result, image_np=None):
+        """
+        Stores a successful OCR result under every key. Errors are never cached, and neither
+        are perceptual keys without the crop (`image_np`) to verify later matches against.
+        """
+        if "error" in result:
+            return
+        thumbnail = None
+        if image_np is not None and any(key.startswith("p") for key in keys):
+            thumbnail = verification_thumbnail(image_np)
+        rows = []
+        for key in keys:
+            if not key.startswith("p"):
+                rows.append((key, None))
+            elif thumbnail is not None:
+                rows.append((key, thumbnail))
+        now = time.time()
+        with self._lock:
+            for key, key_thumbnail in rows:
+                self._entries[(namespace, key)] = (now, copy.deepcopy(result), key_thumbnail)
+                self._entries.move_to_end((namespace, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            if self._db is not None:
+                payload = json.dumps(result)
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO ocr_cache VALUES (?, ?, ?, ?, ?)",
+                    [(namespace, key, now, payload, None if t is None else t.tobytes()) for key, t in rows],
+                )
+                self._prune_disk(now)
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            namespaces = {}
+            for namespace, counters in self._counters.items():
+                lookups = counters["hits"] + counters["perceptual_hits"] + counters["misses"]
+                namespaces[namespace] = {
+                    **counters,
+                    "hit_rate": round((lookups - counters["misses"]) / lookups, 3) if lookups else 0,
+                }
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "perceptual": self.perceptual,
+                "disk_backed": self._db is not None,
+                "disk_entries": (self._db.execute("SELECT COUNT(*) FROM ocr_cache").fetchone()[0]
+                                 if self._db is not None else 0),
+                "namespaces": namespaces,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._counters.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM ocr_cache")
+                self._db.commit()
+
+    def _lookup(self, namespace, key, now, thumbnail=None):
+        """Memory first, then disk; must be called with the lock held."""
+        entry = self._entries.get((namespace, key))
+        if entry is not None:
+            if now - entry[0] <= self.ttl:
+                self._entries.move_to_end((namespace, key))
+                return entry[1] if self._verified(key, entry[2], thumbnail) else None
+            del self._entries[(namespace, key)]
+        if self._db is not None:
+            row = self._db.execute(
+                "SELECT stored_at, result, thumbnail FROM ocr_cache WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            ).fetchone()
+            if row is not None and now - row[0] <= self.ttl:
+                stored_thumbnail = None
+                if row[2] is not None:
+                    stored_thumbnail = np.frombuffer(row[2], dtype=np.uint8).reshape(VERIFY_SIZE[::-1])
+                result = json.loads(row[1])
+                self._entries[(namespace, key)] = (row[0], result, stored_thumbnail)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                return result if self._verified(key, stored_thumbnail, thumbnail) else None
+        return None
+
+    def _verified(self, key, stored_thumbnail, thumbnail):
+        """Exact keys always match; perceptual keys only if the thumbnails are close enough."""
+        if not key.startswith("p"):
+            return True
+        if stored_thumbnail is None or thumbnail is None:
+            return False
+        return thumbnail_distance(stored_thumbnail, thumbnail) <= self.perceptual_max_diff
+
+    def _prune_disk(self, now):
+        """Drops expired rows, then the oldest rows beyond max_entries; caller commits."""
+        self._db.execute("DELETE FROM ocr_cache WHERE stored_at < ?", (now - self.ttl,))
+        self._db.execute(
+            "DELETE FROM ocr_cache WHERE rowid IN "
+            "(SELECT rowid FROM ocr_cache ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+
+ocr_cache = OCRCache()
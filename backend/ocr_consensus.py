@@ -0,0 +1,114 @@
+"""
+ocr_consensus.py
+
+Fuses the OCR readings of several shots of the same vehicle into one plate string.
+
+Shots are OCR'd best-first and in rounds, so that OCR for many vehicles still batches: the
+first round reads OCR_CONSENSUS_AGREE shots of every vehicle, and each later round reads one
+more shot of the vehicles that are still undecided. A vehicle is decided as soon as
+OCR_CONSENSUS_AGREE readings agree exactly, or a per-character vote weighted by shot and
+character confidence reaches OCR_CONSENSUS_THRESHOLD, or it runs out of shots.
+"""
+import os
+from collections import Counter, defaultdict
+
+# --- Consensus Configuration (from environment variables) ---
+OCR_CONSENSUS_AGREE = int(os.environ.get("OCR_CONSENSUS_AGREE", "2"))
+OCR_CONSENSUS_THRESHOLD = float(os.environ.get("OCR_CONSENSUS_THRESHOLD", "0.8"))
+
+
+def _character_weights(ocr_result, shot_confidence):
+    """Per-character vote weights: the shot's detection confidence times each character's confidence."""
+    text = ocr_result["text"]
+    char_confs = ocr_result.get("confidences")
+    if char_confs is None and "characters" in ocr_result:
+        # Roboflow predictions carry a confidence per character
+        char_confs = [c.get("confidence", 1.0) for c in ocr_result["characters"]]
+    if not char_confs or len(char_confs) != len(text):
+        char_confs = [1.0] * len(text)
+    return [shot_confidence * c for c in char_confs]
+
+def fuse_readings(readings):
+    """
+    Combines (text, per-character weights) readings into (text, confidence).
+
+    The plate length is chosen by total weight first; then each position is a weighted vote
+    among the readings of that length. The confidence is the weakest position's winning share,
+    scaled by the share of weight behind the chosen length.
+    """
+    if not readings:
+        return "OCR_FAILED", 0.0
+    length_weight = defaultdict(float)
+    for text, weights in readings:
+        length_weight[len(text)] += sum(weights) / len(weights)
+    length = max(length_weight, key=length_weight.get)
+    same_length = [(text, weights) for text, weights in readings if len(text) == length]
+
+    chars, shares = [], []
+    for i in range(length):
+        votes = defaultdict(float)
+        for text, weights in same_length:
+            votes[text[i]] += weights[i]
+        winner = max(votes, key=votes.get)
+        total = sum(votes.values())
+        chars.append(winner)
+        shares.append(votes[winner] / total if total > 0 else 0.0)
+    confidence = min(shares) * length_weight[length] / sum(length_weight.values())
+    return "".join(chars), confidence
+
+
+def consensus_ocr(vehicle_shots, ocr_fn, agree=OCR_CONSENSUS_AGREE, threshold=OCR_CONSENSUS_THRESHOLD):
+    """
+    Runs consensus OCR for several vehicles at once.
+
+    `vehicle_shots` is a list (one entry per vehicle) of shot lists sorted best-first, where each
+    shot has 'image' and 'confidence'. `ocr_fn(images)` OCRs a list of crops and returns one OCR
+    dict per crop. Returns, per vehicle, {"plate", "plate_confidence", "ocr_results"} where
+    ocr_results[i] is the OCR dict of shot i, or None if that shot never had to be read.
+    """
+    agree = max(1, agree)
+    states = [{"shots": shots, "next": 0, "readings": [], "ocr_results": [None] * len(shots), "done": not shots}
+              for shots in vehicle_shots]
+
+    take = agree
+    while True:
+        requests = []
+        for v, state in enumerate(states):
+            if state["done"]:
+                continue
+            end = min(len(state["shots"]), state["next"] + take)
+            requests.extend((v, i) for i in range(state["next"], end))
+            state["next"] = end
+        if not requests:
+            break
+
+        results = ocr_fn([states[v]["shots"][i]["image"] for v, i in requests])
+        for (v, i), ocr_result in zip(requests, results):
+            state = states[v]
+            state["ocr_results"][i] = ocr_result
+            if "error" not in ocr_result and ocr_result.get("text"):
+                state["readings"].append(
+                    (ocr_result["text"], _character_weights(ocr_result, state["shots"][i]["confidence"]))
+                )
+
+        for state in states:
+            if state["done"]:
+                continue
+            texts = Counter(text for text, _ in state["readings"])
+            if texts and texts.most_common(1)[0][1] >= agree:
+                state["done"] = True
+            elif len(state["readings"]) >= 2 and fuse_readings(state["readings"])[1] >= threshold:
+                state["done"] = True
+            elif state["next"] >= len(state["shots"]):
+                state["done"] = True
+        take = 1
+
+    fused = []
+    for state in states:
+        plate, confidence = fuse_readings(state["readings"])
+        fused.append({
+            "plate": plate,
+            "plate_confidence": round(confidence, 3),
+            "ocr_results": state["ocr_results"],
+        })
+    return fused
@@ -0,0 +1,382 @@
+"""
+plate_search.py
+
+Fuzzy search over every plate ever detected ("all sightings of ~AB12CD3 in the last 30 days").
+
+Plates are compared through a confusion-aware key: the text is upper-cased, reduced to
+letters and digits, and characters OCR commonly mixes up are folded together (O/Q/D -> 0,
+I/L -> 1, Z -> 2, S -> 5, G -> 6, B -> 8). "AB12CD3" and "A812C03" share the key
+"A812C03". Around the key distance, edit distance is used to tolerate misread, missing or
+extra characters.
+
+PlateIndex holds, in memory:
+- per distinct plate text, its sightings: detection timestamps (sorted) and ObjectIds,
+  packed into arrays (about 20 bytes per detection);
+- per distinct key, the plate texts folding to it;
+- a bigram index over the keys ("^A", "A8", ..., "3$"), to find candidate keys within edit
+  distance k of the query without comparing against every plate: a key within distance k
+  shares at least (query bigrams - 2k) bigrams with the query.
+
+The index is built from the detections collection on a background thread and then tails it
+by ObjectId every PLATE_INDEX_REFRESH_SECONDS, so detections written by any worker (thread
+or process) become searchable within a few seconds. Only the page of sightings returned is
+read from MongoDB (by _id).
+"""
+import argparse
+import os
+import random
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+
+from metrics import timed, STAGE_SECONDS
+
+# --- Plate Search Configuration (from environment variables) ---
+PLATE_INDEX_ENABLED = os.environ.get("PLATE_INDEX_ENABLED", "1") == "1"
+PLATE_INDEX_REFRESH_SECONDS = float(os.environ.get("PLATE_INDEX_REFRESH_SECONDS", "2"))
+PLATE_INDEX_BATCH = int(os.environ.get("PLATE_INDEX_BATCH", "10000"))
+# ObjectIds are generated by each writer process; the tail re-reads this many seconds of
+# ids to pick up documents that were inserted late with a slightly older id
+PLATE_INDEX_OVERLAP_SECONDS = 30
+SEARCH_MAX_LIMIT = 500
+
+CONFUSIONS = str.maketrans({"O": "0", "Q": "0", "D": "0", "I": "1", "L": "1", "Z": "2",
+                            "S": "5", "G": "6", "B": "8"})
+UNREADABLE_PLATES = ("", "OCRFAILED")
+
+
+def normalize_plate(text):
+    """Upper-cased letters and digits only: " ab-12 cd3" -> "AB12CD3"."""
+    return "".join(c for c in str(text or "").upper() if c.isalnum())
+
+def plate_key(text):
+    """The confusion-aware key of a plate: OCR look-alike characters folded together."""
+    return normalize_plate(text).translate(CONFUSIONS)
+
+def _bigrams(key):
+    padded = f"^{key}$"
+    return {padded[i:i + 2] for i in range(len(padded) - 1)}
+
+def default_max_distance(key):
+    """Edits tolerated for a query of this length: 0 up to 3 characters, 1 up to 5, else 2."""
+    return 0 if len(key) <= 3 else 1 if len(key) <= 5 else 2
+
+def edit_distance(a, b, limit):
+    """Levenshtein distance of `a` and `b`, or limit + 1 as soon as it must exceed `limit`."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+def _to_utc_naive(value):
+    """Detection timestamps are naive UTC; aware query bounds are converted to match."""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def _epoch(value):
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+class _Sightings:
+    """The detections of one plate text: sorted timestamps with their ObjectIds (12 bytes each)."""
+
+    __slots__ = ("times", "ids")
+
+    def __init__(self):
+        self.times = array("d")
+        self.ids = bytearray()
+
+    def add(self, timestamp, oid):
+        # Detections arrive roughly in time order; out-of-order ones are inserted in place
+        if not self.times or timestamp >= self.times[-1]:
+            self.times.append(timestamp)
+            self.ids += oid
+            return
+        i = bisect_right(self.times, timestamp)
+        self.times.insert(i, timestamp)
+        self.ids[i * 12:i * 12] = oid
+
+    def window(self, since, until):
+        """The (start, end) positions of sightings in [since, until]."""
+        start = 0 if since is None else bisect_left(self.times, since)
+        end = len(self.times) if until is None else bisect_right(self.times, until)
+        return start, end
+
+    def oid(self, i):
+        return ObjectId(bytes(self.ids[i * 12:(i + 1) * 12]))
+
+
+class PlateIndex:
+    """In-memory fuzzy index of plate sightings, fed from the detections collection."""
+
+    def __init__(self, collection=None, refresh_seconds=PLATE_INDEX_REFRESH_SECONDS,
+                 batch_size=PLATE_INDEX_BATCH):
+        self.collection = collection
+        self.refresh_seconds = refresh_seconds
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._plates = {}        # plate text -> _Sightings
+        self._keys = {}          # key -> set of plate texts
+        self._grams = {}         # bigram -> set of keys
+        self._recent_ids = {}    # ObjectId -> generation time, for ids inside the tail overlap
+        self._last_id = None
+        self._sightings = 0
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._build_seconds = None
+        self._error = None
+
+    # --- Maintenance ---
+
+    def add(self, doc):
+        """Indexes one detection document (needs _id, plate and timestamp); returns whether it was new."""
+        oid, plate = doc.get("_id"), normalize_plate(doc.get("plate"))
+        if not isinstance(oid, ObjectId) or plate in UNREADABLE_PLATES or doc.get("status") == "Failed":
+            return False
+        timestamp = doc.get("timestamp") or oid.generation_time.replace(tzinfo=None)
+        with self._lock:
+            if oid in self._recent_ids:
+                return False
+            self._recent_ids[oid] = oid.generation_time.timestamp()
+            sightings = self._plates.get(plate)
+            if sightings is None:
+                sightings = self._plates[plate] = _Sightings()
+                key = plate_key(plate)
+                plates = self._keys.get(key)
+                if plates is None:
+                    plates = self._keys[key] = set()
+                    for gram in _bigrams(key):
+                        self._grams.setdefault(gram, set()).add(key)
+                plates.add(plate)
+            sightings.add(_epoch(timestamp), oid.binary)
+            self._sightings += 1
+        return True
+
+    def refresh(self):
+        """Indexes the detections inserted since the last call; returns how many were added."""
+        if self.collection is None:
+            return 0
+        query = {}
+        if self._last_id is not None:
+            # Re-read the overlap window; ids already indexed are skipped
+            overlap = self._last_id.generation_time - timedelta(seconds=PLATE_INDEX_OVERLAP_SECONDS)
+            query = {"_id": {"$gte": ObjectId.from_datetime(overlap)}}
+        added = 0
+        while True:
+            cursor = self.collection.find(query, {"plate": 1, "timestamp": 1, "status": 1}) \
+                .sort("_id", 1).limit(self.batch_size)
+            docs = list(cursor)
+            for doc in docs:
+                added += self.add(doc)
+            if docs:
+                newest = docs[-1]["_id"]
+                if self._last_id is None or newest > self._last_id:
+                    self._last_id = newest
+            self._prune_recent_ids()
+            if len(docs) < self.batch_size:
+                break
+            query = {"_id": {"$gt": docs[-1]["_id"]}}
+        return added
+
+    def _prune_recent_ids(self):
+        if self._last_id is None:
+            return
+        horizon = self._last_id.generation_time.timestamp() - PLATE_INDEX_OVERLAP_SECONDS
+        with self._lock:
+            self._recent_ids = {oid: t for oid, t in self._recent_ids.items() if t >= horizon}
+
+    def start(self):
+        """Builds the index on a background thread, then keeps tailing the collection."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="plate-index", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        start = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                added = self.refresh()
+                if not self._ready.is_set():
+                    self._build_seconds = round(time.perf_counter() - start, 2)
+                    self._ready.set()
+                    print(f"✅ Plate index built: {self._sightings} sightings of {len(self._plates)} plates "
+                          f"in {self._build_seconds:.1f} s.")
+                elif added:
+                    print(f"[DEBUG] Plate index: {added} new sightings.")
+                self._error = None
+            except Exception as e:
+                if self._error != str(e):
+                    print(f"❌ ERROR: Plate index refresh failed: {e}")
+                self._error = str(e)
+            self._stop.wait(self.refresh_seconds)
+
+    def is_ready(self):
+        return self._ready.is_set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "ready": self.is_ready(),
+                "plates": len(self._plates),
+                "keys": len(self._keys),
+                "sightings": self._sightings,
+                "build_seconds": self._build_seconds,
+                "last_id": str(self._last_id) if self._last_id else None,
+                "error": self._error,
+            }
+
+    # --- Search ---
+
+    def _candidate_keys(self, key, max_distance):
+        grams = _bigrams(key)
+        needed = len(grams) - 2 * max_distance
+        if needed <= 0:
+            # Too short for the bigram filter to prune anything; compare with every key
+            return list(self._keys)
+        counts = Counter()
+        for gram in grams:
+            counts.update(self._grams.get(gram, ()))
+        return [k for k, n in counts.items() if n >= needed]
+
+    def match(self, query, max_distance=None, since=None, until=None):
+        """
+        The plate texts matching `query`, best first, with their sightings inside the time range:
+        [(plate, key distance, text distance, _Sightings, start, end)]. Ranked by distance between
+        the keys, then between the plain texts, then by number of sightings in range.
+        """
+        plate = normalize_plate(query)
+        key = plate_key(plate)
+        if max_distance is None:
+            max_distance = default_max_distance(key)
+        since = None if since is None else _epoch(since)
+        until = None if until is None else _epoch(until)
+        matches = []
+        with self._lock:
+            for candidate in self._candidate_keys(key, max_distance):
+                distance = edit_distance(key, candidate, max_distance)
+                if distance > max_distance:
+                    continue
+                for text in self._keys[candidate]:
+                    sightings = self._plates[text]
+                    start, end = sightings.window(since, until)
+                    if end > start:
+                        matches.append((text, distance, edit_distance(plate, text, len(text) + len(plate)),
+                                        sightings, start, end))
+        matches.sort(key=lambda m: (m[1], m[2], -(m[5] - m[4]), m[0]))
+        return matches
+
+    def search(self, query, since=None, until=None, max_distance=None, limit=50):
+        """
+        Ranked sightings of plates like `query` between `since` and `until` (naive UTC or aware
+        datetimes). Returns {"key", "max_distance", "total", "plates": [...], "ids": [ObjectId]}:
+        one summary per matching plate text, and the ids of the first `limit` sightings (best
+        plate first, newest first within a plate).
+        """
+        with timed(STAGE_SECONDS, stage="plate_search"):
+            key = plate_key(query)
+            if max_distance is None:
+                max_distance = default_max_distance(key)
+            matches = self.match(query, max_distance, _to_utc_naive(since), _to_utc_naive(until))
+            plates, ids = [], []
+            for text, distance, text_distance, sightings, start, end in matches:
+                plates.append({
+                    "plate": text,
+                    "distance": distance,
+                    "text_distance": text_distance,
+                    "sightings": end - start,
+                    "first_seen": datetime.fromtimestamp(sightings.times[start], timezone.utc).replace(tzinfo=None),
+                    "last_seen": datetime.fromtimestamp(sightings.times[end - 1], timezone.utc).replace(tzinfo=None),
+                })
+                for i in range(end - 1, start - 1, -1):
+                    if len(ids) >= limit:
+                        break
+                    ids.append((sightings.oid(i), distance, text_distance))
+        return {
+            "key": key,
+            "max_distance": max_distance,
+            "total": sum(p["sightings"] for p in plates),
+            "plates": plates,
+            "ids": ids,
+        }
+
+
+# --- Synthetic benchmark (python plate_search.py bench) ---
+
+def _random_plate(rng):
+    letters, digits = "ABCDEFGHJKMNPRTUVWXY", "0123456789"
+    return "".join(rng.choice(letters) for _ in range(2)) + "".join(rng.choice(digits) for _ in range(2)) \
+        + "".join(rng.choice(letters) for _ in range(2)) + rng.choice(digits)
+
+def _misread(plate, rng):
+    swaps = {"0": "O", "8": "B", "1": "I", "5": "S", "2": "Z", "D": "0", "B": "8"}
+    chars = list(plate)
+    i = rng.randrange(len(chars))
+    chars[i] = swaps.get(chars[i], rng.choice("ABCDEFGHJKMNPRTUVWXY0123456789"))
+    return "".join(chars)
+
+def benchmark(rows=1_000_000, plates=200_000, queries=200, seed=0):
+    """Builds an index of `rows` synthetic sightings and times searches against it."""
+    rng = random.Random(seed)
+    index = PlateIndex()
+    population = [_random_plate(rng) for _ in range(plates)]
+    now = datetime.utcnow()
+    start = time.perf_counter()
+    for n in range(rows):
+        plate = rng.choice(population)
+        if rng.random() < 0.1:
+            plate = _misread(plate, rng)
+        timestamp = now - timedelta(seconds=(rows - n) * 5)
+        index.add({"_id": ObjectId.from_datetime(timestamp), "plate": plate, "timestamp": timestamp})
+    build_seconds = time.perf_counter() - start
+    since = now - timedelta(days=30)
+    latencies = []
+    for _ in range(queries):
+        query = _misread(rng.choice(population), rng)
+        start = time.perf_counter()
+        index.search(query, since=since, limit=50)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return {
+        **{k: v for k, v in index.stats().items() if k in ("plates", "keys", "sightings")},
+        "build_seconds": round(build_seconds, 2),
+        "queries": queries,
+        "p50_ms": round(latencies[len(latencies) // 2], 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95)], 2),
+        "max_ms": round(latencies[-1], 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fuzzy plate search index.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench = sub.add_parser("bench", help="time searches over a synthetic index")
+    bench.add_argument("--rows", type=int, default=1_000_000)
+    bench.add_argument("--plates", type=int, default=200_000)
+    bench.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+    if args.command == "bench":
+        print(benchmark(args.rows, args.plates, args.queries))
+
+
+if __name__ == "__main__":
+    main()
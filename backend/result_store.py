@@ -0,0 +1,316 @@
+"""
+result_store.py
+
+Content-addressed storage for result files (uploaded originals, detections.json, rendered
+plate images, video best shots, job.json). Every file is stored once per content, however
+many results refer to it:
+
+    results/blobs/<ab>/<cd>/<sha256><ext>    the bytes, sharded by the first 4 hex digits
+    results/index.sqlite3                    result_id/name -> blob, plus per-result times
+
+The URLs stay /results/<result_id>/<name>; the index resolves them to a blob. Uploading the
+same image twice stores its original (and identical renderings) once. Result folders written
+before the store existed (results/<uuid>/) are still served as they are.
+
+A background sweeper (RetentionSweeper) deletes results last written more than
+RESULTS_MAX_AGE_DAYS ago, then the oldest results until the blobs fit in RESULTS_MAX_BYTES,
+then blobs no result refers to any more. It also removes files left behind in temp/ (e.g.
+by a crashed upload) once they are TEMP_MAX_AGE_SECONDS old.
+
+The index is a SQLite database in WAL mode, shared by every thread and worker process.
+A blob is only unlinked inside the write transaction that removes its last reference, and
+writers add their reference before checking that the blob file exists, so a blob being
+re-used is never lost to a concurrent sweep.
+"""
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+
+import cv2
+
+from metrics import timed, STAGE_SECONDS
+
+# --- Results Storage Configuration (from environment variables) ---
+RESULTS_DIR = "results"
+TEMP_DIR = "temp"
+# 0 disables the corresponding limit
+RESULTS_MAX_AGE_DAYS = float(os.environ.get("RESULTS_MAX_AGE_DAYS", "30"))
+RESULTS_MAX_BYTES = int(os.environ.get("RESULTS_MAX_BYTES", str(20 * 1024 ** 3)))
+RESULTS_SWEEP_INTERVAL = float(os.environ.get("RESULTS_SWEEP_INTERVAL", "600"))
+TEMP_MAX_AGE_SECONDS = float(os.environ.get("TEMP_MAX_AGE_SECONDS", str(24 * 3600)))
+BLOBS_DIR = "blobs"
+INDEX_FILE = "index.sqlite3"
+JPEG_QUALITY = 95
+SWEEP_BATCH = 500
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS results (result_id TEXT PRIMARY KEY, created_at REAL, updated_at REAL)",
+    "CREATE INDEX IF NOT EXISTS results_updated_at ON results (updated_at)",
+    "CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, ext TEXT, size INTEGER, created_at REAL)",
+    "CREATE TABLE IF NOT EXISTS artifacts (result_id TEXT, name TEXT, digest TEXT, size INTEGER, "
+    "created_at REAL, PRIMARY KEY (result_id, name))",
+    "CREATE INDEX IF NOT EXISTS artifacts_digest ON artifacts (digest)",
+)
+
+
+def is_result_id(value):
+    try:
+        uuid.UUID(value)
+        return True
+    except ValueError:
+        return False
+
+
+class ResultStore:
+    """Deduplicated result files addressed by (result_id, name)."""
+
+    def __init__(self, root=RESULTS_DIR):
+        self.root = root
+        self._local = threading.local()
+        self._schema_ready = False
+
+    # --- Connection ---
+
+    def _db(self):
+        """One connection per thread (and per process: a forked worker opens its own)."""
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            os.makedirs(self.root, exist_ok=True)
+            db = sqlite3.connect(os.path.join(self.root, INDEX_FILE), timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            if not self._schema_ready:
+                for statement in SCHEMA:
+                    db.execute(statement)
+                self._schema_ready = True
+            self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+    def _blob_path(self, digest, ext):
+        return os.path.join(self.root, BLOBS_DIR, digest[:2], digest[2:4], digest + ext)
+
+    # --- Writing ---
+
+    def put(self, result_id, name, data):
+        """Stores `data` as /results/<result_id>/<name> (replacing an earlier file of that name)."""
+        digest = hashlib.sha256(data).hexdigest()
+        ext = os.path.splitext(name)[1].lower()
+        now = time.time()
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute("INSERT OR IGNORE INTO blobs VALUES (?, ?, ?, ?)", (digest, ext, len(data), now))
+            db.execute("INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?)",
+                       (result_id, name, digest, len(data), now))
+            db.execute("INSERT INTO results VALUES (?, ?, ?) ON CONFLICT (result_id) DO UPDATE SET updated_at = ?",
+                       (result_id, now, now, now))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        # Referenced before this check, so a sweep cannot remove the blob from under us
+        path = self._blob_path(digest, ext)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return digest
+
+    def put_image(self, result_id, name, image):
+        """JPEG-encodes `image` and stores it."""
+        with timed(STAGE_SECONDS, stage="image_write"):
+            ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+            if not ok:
+                raise ValueError(f"Could not encode {name}")
+            return self.put(result_id, name, encoded.tobytes())
+
+    # --- Reading ---
+
+    def path(self, result_id, name):
+        """The blob file behind /results/<result_id>/<name>, or None."""
+        row = self._db().execute(
+            "SELECT artifacts.digest, blobs.ext FROM artifacts JOIN blobs ON blobs.digest = artifacts.digest "
+            "WHERE result_id = ? AND name = ?", (result_id, name)).fetchone()
+        if row is None:
+            return None
+        path = self._blob_path(*row)
+        return path if os.path.exists(path) else None
+
+    def read(self, result_id, name):
+        path = self.path(result_id, name)
+        if path is None:
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def names(self, result_id):
+        return [row[0] for row in self._db().execute(
+            "SELECT name FROM artifacts WHERE result_id = ? ORDER BY name", (result_id,))]
+
+    def stats(self):
+        db = self._db()
+        results, = db.execute("SELECT COUNT(*) FROM results").fetchone()
+        files, logical = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM artifacts").fetchone()
+        blobs, stored = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        return {
+            "results": results,
+            "files": files,
+            "blobs": blobs,
+            "bytes": stored,
+            "logical_bytes": logical,
+            "dedup_saved_bytes": logical - stored,
+            "max_bytes": RESULTS_MAX_BYTES or None,
+            "max_age_days": RESULTS_MAX_AGE_DAYS or None,
+        }
+
+    # --- Retention ---
+
+    def delete_results(self, result_ids):
+        """Drops results from the index; their blobs go in the next collect_garbage()."""
+        if not result_ids:
+            return
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.executemany("DELETE FROM artifacts WHERE result_id = ?", [(r,) for r in result_ids])
+            db.executemany("DELETE FROM results WHERE result_id = ?", [(r,) for r in result_ids])
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def collect_garbage(self):
+        """Deletes blobs no result refers to; returns (blobs, bytes) freed."""
+        db = self._db()
+        freed = size = 0
+        while True:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = db.execute(
+                    "SELECT digest, ext, size FROM blobs WHERE NOT EXISTS "
+                    "(SELECT 1 FROM artifacts WHERE artifacts.digest = blobs.digest) LIMIT ?", (SWEEP_BATCH,)
+                ).fetchall()
+                for digest, ext, blob_size in rows:
+                    db.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+                    try:
+                        os.remove(self._blob_path(digest, ext))
+                    except FileNotFoundError:
+                        pass
+                    size += blob_size
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            freed += len(rows)
+            if len(rows) < SWEEP_BATCH:
+                return freed, size
+
+    def sweep(self, max_age_days=RESULTS_MAX_AGE_DAYS, max_bytes=RESULTS_MAX_BYTES):
+        """One retention pass: expired results, then the oldest results over the size cap."""
+        db = self._db()
+        expired = 0
+        if max_age_days:
+            cutoff = time.time() - max_age_days * 86400
+            while True:
+                ids = [row[0] for row in db.execute(
+                    "SELECT result_id FROM results WHERE updated_at < ? LIMIT ?", (cutoff, SWEEP_BATCH))]
+                self.delete_results(ids)
+                expired += len(ids)
+                if len(ids) < SWEEP_BATCH:
+                    break
+        freed_blobs, freed_bytes = self.collect_garbage()
+        evicted = 0
+        if max_bytes:
+            while db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0] > max_bytes:
+                ids = [row[0] for row in db.execute(
+                    "SELECT result_id FROM results ORDER BY updated_at LIMIT ?", (max(1, SWEEP_BATCH // 10),))]
+                if not ids:
+                    break
+                self.delete_results(ids)
+                evicted += len(ids)
+                blobs, size = self.collect_garbage()
+                freed_blobs += blobs
+                freed_bytes += size
+        return {"expired": expired, "evicted": evicted, "blobs_freed": freed_blobs, "bytes_freed": freed_bytes}
+
+    def sweep_legacy_folders(self, max_age_days=RESULTS_MAX_AGE_DAYS):
+        """Removes pre-store results/<uuid>/ folders not modified for `max_age_days`."""
+        if not max_age_days or not os.path.isdir(self.root):
+            return 0
+        cutoff = time.time() - max_age_days * 86400
+        removed = 0
+        for entry in os.scandir(self.root):
+            if entry.is_dir() and is_result_id(entry.name) and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+        return removed
+
+
+def sweep_temp_dir(temp_dir=TEMP_DIR, max_age_seconds=TEMP_MAX_AGE_SECONDS, in_use=()):
+    """Deletes files in temp/ untouched for `max_age_seconds`, except the paths in `in_use`."""
+    if not max_age_seconds or not os.path.isdir(temp_dir):
+        return 0
+    cutoff = time.time() - max_age_seconds
+    keep = {os.path.abspath(path) for path in in_use}
+    removed = 0
+    for entry in os.scandir(temp_dir):
+        if entry.is_file() and entry.stat().st_mtime < cutoff and os.path.abspath(entry.path) not in keep:
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except OSError as e:
+                print(f"[WARN] Could not remove orphaned temp file {entry.path}: {e}")
+    return removed
+
+
+class RetentionSweeper:
+    """Runs the result store's retention pass and the temp/ cleanup every RESULTS_SWEEP_INTERVAL seconds."""
+
+    def __init__(self, store, interval=RESULTS_SWEEP_INTERVAL, temp_dir=TEMP_DIR, temp_in_use=lambda: ()):
+        self.store = store
+        self.interval = interval
+        self.temp_dir = temp_dir
+        self.temp_in_use = temp_in_use
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_run = None
+
+    def start(self):
+        if self._thread is None and self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name="result-sweeper", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def run_once(self):
+        start = time.perf_counter()
+        summary = self.store.sweep()
+        summary["legacy_folders"] = self.store.sweep_legacy_folders()
+        summary["temp_files"] = sweep_temp_dir(self.temp_dir, in_use=self.temp_in_use())
+        summary["seconds"] = round(time.perf_counter() - start, 2)
+        summary["finished_at"] = time.time()
+        self.last_run = summary
+        if any(summary[k] for k in ("expired", "evicted", "blobs_freed", "legacy_folders", "temp_files")):
+            print(f"[INFO] Results sweep: {summary}")
+        return summary
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"❌ ERROR: Results sweep failed: {e}")
+            self._stop.wait(self.interval)
+
+
+result_store = ResultStore()
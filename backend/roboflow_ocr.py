@@ -9,30 +9,201 @@ Instructions:
     ROBOFLOW_API_KEY, ROBOFLOW_PROJECT, ROBOFLOW_VERSION
 - You can use a .env file and python-dotenv, or set them in your shell.
 - The function accepts a numpy image (cropped plate) and returns OCR results.
+
+Requests go through one RoboflowClient: a pooled requests.Session with timeouts, exponential
+backoff retries on 429/5xx and connection errors, a thread pool so many crops are in flight at
+once, and a circuit breaker that fails fast while Roboflow is down (callers then fall back to
+the local character detector). Point ROBOFLOW_API_BASE at mock_roboflow.py to test offline.
 """
-import requests
-import numpy as np
-import cv2
 import base64
 import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import OCR_CROP_SECONDS
 
 # --- Roboflow API Configuration (from environment variables) ---
 ROBOFLOW_API_KEY = os.environ.get("ROBOFLOW_API_KEY")
 ROBOFLOW_PROJECT = os.environ.get("ROBOFLOW_PROJECT")
 ROBOFLOW_VERSION = os.environ.get("ROBOFLOW_VERSION")
-print("[DEBUG] ROBOFLOW_API_KEY:", ROBOFLOW_API_KEY)
-print("[DEBUG] ROBOFLOW_PROJECT:", ROBOFLOW_PROJECT)
-print("[DEBUG] ROBOFLOW_VERSION:", ROBOFLOW_VERSION)
+ROBOFLOW_API_BASE = os.environ.get("ROBOFLOW_API_BASE", "https://detect.roboflow.com")
+ROBOFLOW_CONCURRENCY = int(os.environ.get("ROBOFLOW_CONCURRENCY", "8"))
+ROBOFLOW_CONNECT_TIMEOUT = float(os.environ.get("ROBOFLOW_CONNECT_TIMEOUT", "3.05"))
+ROBOFLOW_READ_TIMEOUT = float(os.environ.get("ROBOFLOW_READ_TIMEOUT", "10"))
+ROBOFLOW_MAX_RETRIES = int(os.environ.get("ROBOFLOW_MAX_RETRIES", "3"))
+ROBOFLOW_BACKOFF = float(os.environ.get("ROBOFLOW_BACKOFF", "0.5"))
+ROBOFLOW_MAX_BACKOFF = 8.0
+ROBOFLOW_BREAKER_THRESHOLD = int(os.environ.get("ROBOFLOW_BREAKER_THRESHOLD", "5"))
+ROBOFLOW_BREAKER_COOLDOWN = float(os.environ.get("ROBOFLOW_BREAKER_COOLDOWN", "30"))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+print("[DEBUG] Roboflow OCR configured:", all([ROBOFLOW_API_KEY, ROBOFLOW_PROJECT, ROBOFLOW_VERSION]))
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures; while open, calls are refused until
+    `cooldown` seconds have passed, then a single trial call is let through (half-open).
+    """
+
+    def __init__(self, threshold=ROBOFLOW_BREAKER_THRESHOLD, cooldown=ROBOFLOW_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.cooldown and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half-open" if time.monotonic() - self._opened_at >= self.cooldown else "open"
+
+
+class RoboflowClient:
+    """Pooled, concurrent, retrying client for the Roboflow hosted inference API."""
+
+    def __init__(self, api_key=ROBOFLOW_API_KEY, project=ROBOFLOW_PROJECT, version=ROBOFLOW_VERSION,
+                 api_base=ROBOFLOW_API_BASE, concurrency=ROBOFLOW_CONCURRENCY,
+                 timeout=(ROBOFLOW_CONNECT_TIMEOUT, ROBOFLOW_READ_TIMEOUT),
+                 max_retries=ROBOFLOW_MAX_RETRIES, backoff=ROBOFLOW_BACKOFF, breaker=None):
+        if not all([api_key, project, version]):
+            raise RuntimeError(
+                "Roboflow API configuration is missing. "
+                "Please set ROBOFLOW_API_KEY, ROBOFLOW_PROJECT, and ROBOFLOW_VERSION as environment variables."
+            )
+        # Example cURL equivalent:
+        # cat [YOUR_IMAGE_FILE] | base64 | curl -d @- "https://detect.roboflow.com/[MODEL_ID]/[VERSION_NUMBER]?api_key=[YOUR_API_KEY]"
+        self.url = f"{api_base.rstrip('/')}/{project}/{version}"
+        self.params = {"api_key": api_key}
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, concurrency))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="roboflow")
+        self._lock = threading.Lock()
+        self._counters = {"requests": 0, "retries": 0, "failures": 0, "short_circuited": 0}
+
+    def ocr(self, image_np):
+        """OCRs one crop. Returns {"text", "characters"} or {"error", ...}; never raises."""
+        if not self.breaker.allow():
+            self._count("short_circuited")
+            return {"error": "Roboflow circuit breaker is open.", "circuit_open": True}
+        start = time.perf_counter()
+        try:
+            # Encode the image to JPG format and then to a base64 string
+            _, img_encoded = cv2.imencode('.jpg', image_np)
+            img_base64 = base64.b64encode(img_encoded).decode('utf-8')
+            data = self._post_with_retries(img_base64)
+            OCR_CROP_SECONDS.observe(time.perf_counter() - start, mode="roboflow")
+        except requests.exceptions.HTTPError as http_err:
+            self.breaker.record_failure()
+            self._count("failures")
+            return {"error": f"Roboflow API error: {http_err.response.status_code} {http_err.response.text}"}
+        except Exception as e:
+            self.breaker.record_failure()
+            self._count("failures")
+            return {"error": f"Exception in Roboflow OCR: {e}"}
+        self.breaker.record_success()
+        predictions = data.get("predictions", [])
+        if not predictions:
+            return {"text": "", "characters": []}
+        predictions.sort(key=lambda p: p.get("x", 0))
+        ocr_text = "".join([p.get("class", "") for p in predictions])
+        return {"text": ocr_text, "characters": predictions}
+
+    def ocr_batch(self, images):
+        """OCRs many crops concurrently; results are in the same order as `images`."""
+        return list(self._executor.map(self.ocr, images))
+
+    def stats(self):
+        with self._lock:
+            return {**self._counters, "breaker": self.breaker.state}
+
+    def _post_with_retries(self, img_base64):
+        # Set the correct headers for the Roboflow API
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        for attempt in range(self.max_retries + 1):
+            self._count("requests")
+            try:
+                response = self.session.post(self.url, params=self.params, data=img_base64,
+                                             headers=headers, timeout=self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                self._sleep_before_retry(attempt)
+                continue
+            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                self._sleep_before_retry(attempt, response.headers.get("Retry-After"))
+                continue
+            response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
+            return response.json()
+
+    def _sleep_before_retry(self, attempt, retry_after=None):
+        """Exponential backoff with full jitter, or the server's Retry-After if it sent one."""
+        self._count("retries")
+        try:
+            delay = float(retry_after)
+        except (TypeError, ValueError):
+            delay = random.uniform(0, self.backoff * (2 ** attempt))
+        time.sleep(min(delay, ROBOFLOW_MAX_BACKOFF))
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
 
-if not all([ROBOFLOW_API_KEY, ROBOFLOW_PROJECT, ROBOFLOW_VERSION]):
-    raise RuntimeError(
-        "Roboflow API configuration is missing. "
-        "Please set ROBOFLOW_API_KEY, ROBOFLOW_PROJECT, and ROBOFLOW_VERSION as environment variables."
-    )
 
-# Example cURL equivalent:
-# cat [YOUR_IMAGE_FILE] | base64 | curl -d @- "https://detect.roboflow.com/[MODEL_ID]/[VERSION_NUMBER]?api_key=[YOUR_API_KEY]"
-ROBOFLOW_API_URL = f"https://detect.roboflow.com/{ROBOFLOW_PROJECT}/{ROBOFLOW_VERSION}?api_key={ROBOFLOW_API_KEY}"
+_client = None
+_client_lock = threading.Lock()
+
+def get_roboflow_client():
+    """The shared RoboflowClient, created on first use. Raises RuntimeError if not configured."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = RoboflowClient()
+        return _client
+
+def roboflow_client_stats():
+    """Request/retry/failure counters and breaker state, or None if Roboflow was never used."""
+    with _client_lock:
+        client = _client
+    return client.stats() if client is not None else None
 
 def roboflow_ocr_text(image_np: np.ndarray) -> dict:
     """
@@ -43,22 +214,15 @@ def roboflow_ocr_text(image_np: np.ndarray) -> dict:
         dict: {"text": str, "characters": list} or {"error": str}
     """
     try:
-        # Encode the image to JPG format and then to a base64 string
-        _, img_encoded = cv2.imencode('.jpg', image_np)
-        img_base64 = base64.b64encode(img_encoded).decode('utf-8')
-        # Set the correct headers for the Roboflow API
-        headers = {"Content-Type": "application/x-www-form-urlencoded"}
-        # Send the request
-        response = requests.post(ROBOFLOW_API_URL, data=img_base64, headers=headers)
-        response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
-        data = response.json()
-        predictions = data.get("predictions", [])
-        if not predictions:
-            return {"text": "", "characters": []}
-        predictions.sort(key=lambda p: p.get("x", 0))
-        ocr_text = "".join([p.get("class", "") for p in predictions])
-        return {"text": ocr_text, "characters": predictions}
-    except requests.exceptions.HTTPError as http_err:
-        return {"error": f"Roboflow API error: {http_err.response.status_code} {http_err.response.text}"}
-    except Exception as e:
-        return {"error": f"Exception in Roboflow OCR: {e}"}
\ No newline at end of file
+        client = get_roboflow_client()
+    except RuntimeError as e:
+        return {"error": str(e)}
+    return client.ocr(image_np)
+
+def roboflow_ocr_text_batch(images):
+    """Performs Roboflow OCR on many cropped plate images concurrently."""
+    try:
+        client = get_roboflow_client()
+    except RuntimeError as e:
+        return [{"error": str(e)} for _ in images]
+    return client.ocr_batch(images)
@@ -0,0 +1,61 @@
+"""
+startup.py
+
+Measures how long this process takes to come up. Times are seconds since the process was
+started (read from /proc on Linux, so interpreter and uvicorn start-up are included; elsewhere
+since this module was first imported):
+
+    imported   app.py and everything it imports are loaded
+    healthy    the lifespan startup finished; /healthz answers from here on
+    loaded     every model is loaded
+    ready      every model is warmed up; /readyz answers 200 from here on
+
+Each phase is logged once, kept for /healthz and /readyz, and exported as the
+anpr_startup_seconds{phase} gauge.
+"""
+import os
+import threading
+import time
+
+IMPORT_STARTED_AT = time.time()
+PHASES = ("imported", "healthy", "loaded", "ready")
+
+
+def process_started_at():
+    """Wall-clock time this process was started, to about 10 ms (Linux), or the import time of this module."""
+    try:
+        with open("/proc/self/stat") as f:
+            # Fields after the parenthesised command name; starttime is field 22 overall
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - (uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return IMPORT_STARTED_AT
+
+
+class StartupTimer:
+    """Records the first time each start-up phase is reached."""
+
+    def __init__(self):
+        self.started_at = process_started_at()
+        self._phases = {}
+        self._lock = threading.Lock()
+
+    def mark(self, phase):
+        """Records `phase` (only the first time) and returns its seconds since process start."""
+        with self._lock:
+            if phase not in self._phases:
+                self._phases[phase] = round(time.time() - self.started_at, 3)
+                print(f"✅ Startup: {phase} after {self._phases[phase]:.2f} s.")
+            return self._phases[phase]
+
+    def seconds(self):
+        with self._lock:
+            return dict(self._phases)
+
+    def uptime(self):
+        return round(time.time() - self.started_at, 3)
+
+
+startup_timer = StartupTimer()
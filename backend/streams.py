@@ -0,0 +1,428 @@
+"""
+streams.py
+
+Live stream ingestion for fixed gate cameras. A stream source is an RTSP/HTTP URL, a local
+capture device ("0" for /dev/video0), or a video file played back at its real-time rate
+(for testing). Each registered stream has:
+
+- a capture thread that reads frames into a small ring buffer (STREAM_BUFFER_SIZE frames).
+  When inference falls behind, the oldest buffered frame is dropped, so latency stays
+  bounded instead of building up. URL and device sources are reopened after
+  STREAM_RECONNECT_SECONDS when they fail;
+- one long-lived video pipeline (run_video_pipeline) with its own tracker, running on a
+  stream worker thread with its own models until the stream is stopped;
+- subscribers (the WebSocket endpoint) that receive each finalized vehicle as an event.
+
+Vehicles are written to the detections collection with type "stream" and the stream id as
+result_id, so their best shots are served from /results/<stream_id>/.
+"""
+import asyncio
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+from datetime import datetime
+
+import cv2
+
+from artifacts import ARTIFACT_LEVEL
+from inference_pool import ExecutorSaturated, current_worker
+from metrics import percentiles, STREAM_FRAMES, STREAM_LATENCY_SECONDS
+from video_ocr import run_video_pipeline, persist_vehicle
+
+# --- Stream Configuration (from environment variables) ---
+STREAM_MAX_STREAMS = int(os.environ.get("STREAM_MAX_STREAMS", "4"))
+STREAM_BUFFER_SIZE = int(os.environ.get("STREAM_BUFFER_SIZE", "4"))
+STREAM_RECONNECT_SECONDS = float(os.environ.get("STREAM_RECONNECT_SECONDS", "2"))
+STREAM_EVENT_HISTORY = int(os.environ.get("STREAM_EVENT_HISTORY", "50"))
+STREAM_SUBSCRIBER_QUEUE = int(os.environ.get("STREAM_SUBSCRIBER_QUEUE", "100"))
+STREAM_LATENCY_WINDOW = int(os.environ.get("STREAM_LATENCY_WINDOW", "500"))
+STREAM_RETENTION_SECONDS = int(os.environ.get("STREAM_RETENTION_SECONDS", "3600"))
+STREAM_FPS_WINDOW = 5.0  # seconds over which fps is measured
+CAPTURE_TIMES_KEPT = 4096  # capture times of recently analyzed frames, for event latency
+STREAM_FINISHED_STATUSES = ("stopped", "failed")
+
+
+class FrameRing:
+    """
+    A bounded buffer of (sequence number, capture time, frame) that never blocks the capture
+    thread: when it is full the oldest frame is dropped to make room for the newest.
+    """
+
+    def __init__(self, capacity=STREAM_BUFFER_SIZE):
+        self._frames = deque(maxlen=max(1, capacity))
+        self._cond = threading.Condition()
+        self._closed = False
+        self.captured = 0
+        self.dropped = 0
+
+    def put(self, frame):
+        with self._cond:
+            if len(self._frames) == self._frames.maxlen:
+                self.dropped += 1
+                STREAM_FRAMES.inc(outcome="dropped")
+            self._frames.append((self.captured, time.time(), frame))
+            self.captured += 1
+            STREAM_FRAMES.inc(outcome="captured")
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """The oldest buffered frame, waiting up to `timeout`; None on timeout or once closed and drained."""
+        with self._cond:
+            if not self._frames and not self._closed:
+                self._cond.wait(timeout)
+            return self._frames.popleft() if self._frames else None
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class LiveSampler:
+    """
+    The FrameSampler interface over a stream's FrameRing. Frame numbers are capture sequence
+    numbers, so they skip the frames the ring dropped; the pipeline finalizes vehicles by
+    analyzed frames, not by these numbers.
+    """
+
+    mode = "live"
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.frames_analyzed = 0
+        self.tracks_active = False
+
+    def read(self, ring):
+        while True:
+            item = ring.get(timeout=0.5)
+            if item is not None:
+                break
+            if ring.closed or self.stream.stop_event.is_set():
+                return None, None
+        frame_nmr, captured_at, frame = item
+        self.stream.remember_capture(frame_nmr, captured_at)
+        self.frames_analyzed += 1
+        return frame_nmr, frame
+
+    def update(self, num_tracks):
+        self.tracks_active = num_tracks > 0
+
+    def stats(self):
+        return {
+            "sampling_mode": "live",
+            "frames_read": self.stream.ring.captured,
+            "frames_decoded": self.stream.ring.captured,
+            "frames_analyzed": self.frames_analyzed,
+        }
+
+
+def _iso(timestamp):
+    return datetime.utcfromtimestamp(timestamp).isoformat() + "Z" if timestamp else None
+
+def _offer(queue, event):
+    """Queues an event for one subscriber, dropping its oldest event if it is not keeping up."""
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(event)
+
+
+class LiveStream:
+    """One registered stream: its capture thread, pipeline, subscribers and rolling stats."""
+
+    def __init__(self, stream_id, source, name=None, realtime=None, loop=False, ocr_mode=None):
+        self.stream_id = stream_id
+        self.source = source
+        self.name = name or source
+        self.is_file = os.path.isfile(source)
+        self.realtime = self.is_file if realtime is None else realtime
+        self.loop = loop
+        self.ocr_mode = ocr_mode
+        self.status = "starting"
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.stopped_at = None
+        self.vehicles = 0
+        self.ring = FrameRing()
+        self.stop_event = threading.Event()
+        self.future = None
+        self._lock = threading.Lock()
+        self._events = deque(maxlen=STREAM_EVENT_HISTORY)
+        self._subscribers = set()
+        self._capture_times = {}
+        self._capture_order = deque()
+        self._captured_at = deque()
+        self._analyzed_at = deque()
+        self._frame_lag = deque(maxlen=STREAM_LATENCY_WINDOW)
+        self._event_latency = deque(maxlen=STREAM_LATENCY_WINDOW)
+
+    # --- Capture ---
+
+    def _open(self):
+        return cv2.VideoCapture(int(self.source) if self.source.isdigit() else self.source)
+
+    def capture(self):
+        """Capture thread: reads frames into the ring until stopped, reconnecting URL and device sources."""
+        try:
+            while not self.stop_event.is_set():
+                cap = self._open()
+                if not cap.isOpened():
+                    cap.release()
+                    if self.is_file:
+                        self.error = "Could not open stream source."
+                        break
+                    self._set_status("reconnecting")
+                    print(f"[WARN] Stream {self.stream_id} could not open {self.name}; retrying in {STREAM_RECONNECT_SECONDS}s.")
+                    self.stop_event.wait(STREAM_RECONNECT_SECONDS)
+                    continue
+                self._set_status("running")
+                fps = cap.get(cv2.CAP_PROP_FPS) or 25
+                start, frames = time.monotonic(), 0
+                try:
+                    while not self.stop_event.is_set():
+                        ok, frame = cap.read()
+                        if not ok:
+                            break
+                        if self.realtime:
+                            # Play files back at the rate a camera would deliver them
+                            delay = start + frames / fps - time.monotonic()
+                            if delay > 0 and self.stop_event.wait(delay):
+                                break
+                            frames += 1
+                        with self._lock:
+                            self._captured_at.append(time.time())
+                        self.ring.put(frame)
+                finally:
+                    cap.release()
+                if self.is_file and not self.loop:
+                    break
+                if not self.is_file and not self.stop_event.is_set():
+                    self._set_status("reconnecting")
+                    print(f"[WARN] Stream {self.stream_id} lost {self.name}; reconnecting in {STREAM_RECONNECT_SECONDS}s.")
+                    self.stop_event.wait(STREAM_RECONNECT_SECONDS)
+        except Exception as e:
+            print(f"❌ ERROR: Stream {self.stream_id} capture failed: {e}")
+            self.error = str(e)
+        finally:
+            self.ring.close()
+
+    def _set_status(self, status):
+        # A stop request wins over whatever the capture thread is doing
+        if not self.stop_event.is_set():
+            self.status = status
+
+    def remember_capture(self, frame_nmr, captured_at):
+        with self._lock:
+            self._capture_times[frame_nmr] = captured_at
+            self._capture_order.append(frame_nmr)
+            if len(self._capture_order) > CAPTURE_TIMES_KEPT:
+                self._capture_times.pop(self._capture_order.popleft(), None)
+
+    # --- Pipeline ---
+
+    def run(self):
+        """Runs on a stream worker thread until the stream is stopped or its source ends."""
+        worker = current_worker()
+        self.started_at = time.time()
+        capture_thread = threading.Thread(target=self.capture, name=f"stream-capture-{self.stream_id[:8]}", daemon=True)
+        capture_thread.start()
+        try:
+            run_video_pipeline(
+                self.ring, worker.plate_detector, worker.character_detector,
+                worker.registry.new_tracker(), self._on_vehicle,
+                ocr_mode=self.ocr_mode, progress_callback=self._on_frame,
+                sampler=LiveSampler(self), frame_queue_size=1,
+            )
+        except Exception as e:
+            print(f"❌ ERROR: Stream {self.stream_id} failed: {e}")
+            self.error = str(e)
+        finally:
+            self.stop_event.set()
+            capture_thread.join(timeout=STREAM_RECONNECT_SECONDS + 5)
+            self.status = "failed" if self.error else "stopped"
+            self.stopped_at = time.time()
+            self._publish(None)
+
+    def _on_frame(self, frames_processed, _total_frames):
+        now = time.time()
+        with self._lock:
+            captured_at = self._capture_times.get(frames_processed - 1)
+            self._analyzed_at.append(now)
+            if captured_at is not None:
+                self._frame_lag.append(now - captured_at)
+        if captured_at is not None:
+            STREAM_LATENCY_SECONDS.observe(now - captured_at, kind="frame")
+
+    def _on_vehicle(self, vehicle_info, vehicle):
+        persist_vehicle(self.stream_id, vehicle_info, vehicle['shots'][0], detection_type="stream")
+        now = time.time()
+        with self._lock:
+            first_seen = self._capture_times.get(vehicle['first_frame'])
+            last_seen = self._capture_times.get(vehicle['last_frame'])
+            self.vehicles += 1
+            if last_seen is not None:
+                self._event_latency.append(now - last_seen)
+        if last_seen is not None:
+            STREAM_LATENCY_SECONDS.observe(now - last_seen, kind="event")
+        self._publish({
+            "type": "vehicle",
+            "stream_id": self.stream_id,
+            "vehicle": vehicle_info,
+            "image_url": (f"/results/{self.stream_id}/vehicle_{vehicle_info['vehicle_id']}_best.jpg"
+                          if ARTIFACT_LEVEL != "none" else None),
+            "first_seen_at": _iso(first_seen),
+            "last_seen_at": _iso(last_seen),
+            "emitted_at": _iso(now),
+            "latency_ms": round((now - last_seen) * 1000, 1) if last_seen is not None else None,
+        })
+
+    # --- Subscribers ---
+
+    def subscribe(self, loop):
+        """An asyncio.Queue on `loop` that receives every new event, then None when the stream ends."""
+        queue = asyncio.Queue(maxsize=STREAM_SUBSCRIBER_QUEUE)
+        with self._lock:
+            self._subscribers.add((loop, queue))
+        return queue
+
+    def unsubscribe(self, loop, queue):
+        with self._lock:
+            self._subscribers.discard((loop, queue))
+
+    def _publish(self, event):
+        with self._lock:
+            if event is not None:
+                self._events.append(event)
+            subscribers = list(self._subscribers)
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, event)
+            except RuntimeError:
+                # The subscriber's event loop is closed
+                self.unsubscribe(loop, queue)
+
+    # --- Stats ---
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            for timestamps in (self._captured_at, self._analyzed_at):
+                while timestamps and timestamps[0] < now - STREAM_FPS_WINDOW:
+                    timestamps.popleft()
+            window = min(STREAM_FPS_WINDOW, now - self.started_at) if self.started_at else 0
+            capture_fps = len(self._captured_at) / window if window > 0 else 0
+            analyzed_fps = len(self._analyzed_at) / window if window > 0 else 0
+            frame_lag = percentiles([lag * 1000 for lag in self._frame_lag], (50, 95))
+            event_latency = percentiles([lag * 1000 for lag in self._event_latency], (50, 95))
+        captured, dropped = self.ring.captured, self.ring.dropped
+        return {
+            "capture_fps": round(capture_fps, 2),
+            "fps": round(analyzed_fps, 2),
+            "frames_captured": captured,
+            "frames_dropped": dropped,
+            "drop_rate": round(dropped / captured * 100, 2) if captured else 0,
+            "frame_lag_ms": {"p50": round(frame_lag[50], 1), "p95": round(frame_lag[95], 1)},
+            "event_latency_ms": {"p50": round(event_latency[50], 1), "p95": round(event_latency[95], 1)},
+            "vehicles": self.vehicles,
+        }
+
+    def to_dict(self, events=False):
+        stream = {
+            "stream_id": self.stream_id,
+            "name": self.name,
+            "source": self.source,
+            "realtime": self.realtime,
+            "loop": self.loop,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "stopped_at": self.stopped_at,
+            "stats": self.stats(),
+        }
+        if events:
+            with self._lock:
+                stream["recent_events"] = list(self._events)
+        return stream
+
+
+class StreamManager:
+    """Runs LiveStreams, each on its own worker thread with its own models, for as long as it is registered."""
+
+    def __init__(self, max_streams=STREAM_MAX_STREAMS, initializer=None, initargs=()):
+        self.max_streams = max(1, max_streams)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_streams, thread_name_prefix="stream",
+            initializer=initializer, initargs=initargs,
+        )
+        self._lock = threading.Lock()
+        self._streams = {}
+
+    def start(self, source, name=None, realtime=None, loop=False, ocr_mode=None):
+        """Registers a stream and starts ingesting it; raises ExecutorSaturated when every slot is in use."""
+        with self._lock:
+            self._prune()
+            active = sum(1 for s in self._streams.values() if s.status not in STREAM_FINISHED_STATUSES)
+            if active >= self.max_streams:
+                raise ExecutorSaturated("Every stream slot is in use.")
+            stream = LiveStream(str(uuid.uuid4()), source, name=name,
+                                realtime=realtime, loop=loop, ocr_mode=ocr_mode)
+            self._streams[stream.stream_id] = stream
+            stream.future = self._executor.submit(stream.run)
+        return stream
+
+    def get(self, stream_id):
+        with self._lock:
+            return self._streams.get(stream_id)
+
+    def list(self):
+        with self._lock:
+            self._prune()
+            streams = list(self._streams.values())
+        return [stream.to_dict() for stream in streams]
+
+    def stop(self, stream_id):
+        """Stops a stream; vehicles still in view are finalized and emitted first. False if unknown or finished."""
+        stream = self.get(stream_id)
+        if stream is None or stream.status in STREAM_FINISHED_STATUSES:
+            return False
+        stream.status = "stopping"
+        stream.stop_event.set()
+        return True
+
+    def stats(self):
+        with self._lock:
+            streams = list(self._streams.values())
+        running = [s for s in streams if s.status not in STREAM_FINISHED_STATUSES]
+        return {
+            "max_streams": self.max_streams,
+            "running": len(running),
+            "fps": round(sum(s.stats()["fps"] for s in running), 2),
+        }
+
+    def shutdown(self, wait=False):
+        with self._lock:
+            streams = list(self._streams.values())
+        for stream in streams:
+            stream.stop_event.set()
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def join(self, timeout=None):
+        """After shutdown(), waits up to `timeout` seconds for the streams to stop."""
+        with self._lock:
+            futures = [s.future for s in self._streams.values() if s.future is not None]
+        wait_futures(futures, timeout=timeout)
+
+    def _prune(self):
+        """Forgets finished streams after STREAM_RETENTION_SECONDS."""
+        cutoff = time.time() - STREAM_RETENTION_SECONDS
+        for stream_id, stream in list(self._streams.items()):
+            if stream.status in STREAM_FINISHED_STATUSES and stream.stopped_at and stream.stopped_at < cutoff:
+                del self._streams[stream_id]
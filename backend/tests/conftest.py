@@ -0,0 +1,16 @@
+"""
+Shared pytest setup. The backend modules are flat (imported as `import video_ocr`), so the
+backend directory is put on sys.path, and every test runs in its own temporary directory
+so nothing is written to results/ or temp/ of the checkout.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def _isolated_cwd(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
@@ -0,0 +1,135 @@
+"""
+Stand-ins for the YOLO models and cv2.VideoCapture, shaped like the ultralytics results the
+pipelines read (result.boxes.xyxy/conf/cls/id as tensors with .cpu().numpy()), and a segment
+task for the segment worker processes.
+"""
+import os
+import time
+
+import numpy as np
+
+
+class Tensor:
+    def __init__(self, values):
+        self.values = np.asarray(values, dtype=np.float32)
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.values
+
+
+class Boxes:
+    def __init__(self, xyxy=(), conf=(), cls=None, ids=None):
+        self.xyxy = Tensor(np.asarray(xyxy, dtype=np.float32).reshape(-1, 4))
+        self.conf = Tensor(conf)
+        self.cls = Tensor(cls if cls is not None else [0] * len(conf))
+        self.id = None if ids is None else Tensor(ids)
+
+    def __len__(self):
+        return len(self.conf.values)
+
+
+class Result:
+    def __init__(self, boxes, names=None):
+        self.boxes = boxes
+        self.names = names or {}
+
+
+class ScriptedTracker:
+    """
+    Tracks the vehicles `script(frame_number)` returns as [(track_id, (x1, y1, x2, y2))].
+    The frame number is read from the first pixel of the frame (see FakeCapture).
+    """
+
+    def __init__(self, script, delay=0.0):
+        self.script = script
+        self.delay = delay
+        self.calls = 0
+
+    def track(self, frame, **kwargs):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        vehicles = self.script(frame_number(frame))
+        if not vehicles:
+            return [Result(Boxes())]
+        ids, boxes = zip(*vehicles)
+        return [Result(Boxes(boxes, [0.9] * len(ids), [2] * len(ids), ids))]
+
+
+class PlateInVehicleDetector:
+    """Finds one plate in the lower middle of every box the tracker script reports."""
+
+    def __init__(self, script):
+        self.script = script
+
+    def __call__(self, frame, **kwargs):
+        boxes = [(x1 + (x2 - x1) * 0.3, y1 + (y2 - y1) * 0.6, x1 + (x2 - x1) * 0.7, y1 + (y2 - y1) * 0.8)
+                 for _, (x1, y1, x2, y2) in self.script(frame_number(frame))]
+        return [Result(Boxes(boxes, [0.8] * len(boxes)))]
+
+
+class CharacterDetector:
+    """Reads every crop as `text`."""
+
+    def __init__(self, text="AB123"):
+        self.text = text
+        self.calls = 0
+
+    def __call__(self, images, **kwargs):
+        self.calls += 1
+        names = {i: c for i, c in enumerate(self.text)}
+        boxes = [(10 * i, 0, 10 * i + 8, 10) for i in range(len(self.text))]
+        return [Result(Boxes(boxes, [0.9] * len(boxes), list(names)), names) for _ in images]
+
+
+def frame_number(frame):
+    return int(frame[0, 0, 0]) + 256 * int(frame[0, 0, 1])
+
+
+class FakeCapture:
+    """A cv2.VideoCapture of `frames` black frames, each carrying its frame number in pixel (0, 0)."""
+
+    def __init__(self, frames, size=(120, 160)):
+        self.frames = frames
+        self.size = size
+        self.position = 0
+
+    def grab(self):
+        if self.position >= self.frames:
+            return False
+        self.position += 1
+        return True
+
+    def read(self):
+        if self.position >= self.frames:
+            return False, None
+        frame = np.zeros((*self.size, 3), dtype=np.uint8)
+        frame[0, 0, 0], frame[0, 0, 1] = self.position % 256, self.position // 256
+        self.position += 1
+        return True, frame
+
+    def release(self):
+        pass
+
+
+def endless_segment(video_path, start_frame, end_frame, ocr_mode=None, cancel_event=None, marker_dir=None,
+                    fail_segment=None, **options):
+    """
+    Stands in for video_segments.process_segment in a worker process: runs until its cancel
+    file is set, leaving "<start_frame>.started" / ".stopped" markers in `marker_dir`. The
+    segment starting at `fail_segment` raises once every segment has started instead.
+    """
+    from video_ocr import VideoProcessingCancelled
+    open(os.path.join(marker_dir, f"{start_frame}.started"), "w").close()
+    deadline = time.monotonic() + 30
+    while not cancel_event.is_set():
+        if start_frame == fail_segment and len(os.listdir(marker_dir)) >= 2:
+            raise ValueError("segment failed")
+        if time.monotonic() > deadline:
+            raise RuntimeError("segment was never cancelled")
+        time.sleep(0.01)
+    open(os.path.join(marker_dir, f"{start_frame}.stopped"), "w").close()
+    raise VideoProcessingCancelled("segment cancelled")
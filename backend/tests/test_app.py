@@ -0,0 +1,161 @@
+import io
+import json
+import os
+import threading
+import time
+import zipfile
+
+import pytest
+from fastapi.testclient import TestClient
+
+import model_registry
+from model_registry import ModelRegistry
+from startup import StartupTimer
+
+
+@pytest.fixture
+def app_module(tmp_path, monkeypatch):
+    """The API without its lifespan: no models are loaded and nothing connects to MongoDB."""
+    os.makedirs("temp")
+    import app
+    monkeypatch.setattr(app, "TEMP_DIR", str(tmp_path / "temp"))
+    return app
+
+
+@pytest.fixture
+def client(app_module):
+    return TestClient(app_module.app)
+
+
+@pytest.fixture
+def models_ready(app_module, monkeypatch):
+    monkeypatch.setattr(app_module.model_registry, "is_ready", lambda *names: True)
+
+
+def fake_batch_job(batches):
+    def process_image_batch_job(items, ocr_mode=None):
+        batches.append([name for _, name in items])
+        return [{"plates": [contents.decode()]} for contents, _ in items]
+    return process_image_batch_job
+
+
+def test_process_images_streams_one_line_per_image_in_upload_order(app_module, client, models_ready, monkeypatch):
+    batches = []
+    monkeypatch.setattr(app_module, "process_image_batch_job", fake_batch_job(batches))
+    monkeypatch.setattr(app_module, "IMAGE_BATCH_SIZE", 2)
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as z:
+        z.writestr("b.jpg", b"B")
+        z.writestr("readme.txt", b"skipped")
+        z.writestr("c.png", b"C")
+    files = [("files", ("a.jpg", b"A")), ("files", ("set.zip", archive.getvalue())), ("files", ("d.jpg", b"D"))]
+
+    response = client.post("/api/v1/process-images", files=files)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines == [
+        {"index": 0, "filename": "a.jpg", "plates": ["A"]},
+        {"index": 1, "filename": "set.zip/b.jpg", "plates": ["B"]},
+        {"index": 2, "filename": "set.zip/c.png", "plates": ["C"]},
+        {"index": 3, "filename": "d.jpg", "plates": ["D"]},
+    ]
+    assert batches == [["a.jpg", "set.zip/b.jpg"], ["set.zip/c.png", "d.jpg"]]
+    # The spooled uploads are closed and gone once the stream ends
+    assert os.listdir("temp") == []
+
+
+def test_process_images_reports_skipped_and_failed_images_in_their_lines(app_module, client, models_ready, monkeypatch):
+    def failing_batch_job(items, ocr_mode=None):
+        raise RuntimeError("model crashed")
+
+    monkeypatch.setattr(app_module, "process_image_batch_job", failing_batch_job)
+    files = [("files", ("broken.zip", b"not a zip")), ("files", ("a.jpg", b"A"))]
+
+    lines = [json.loads(line) for line in client.post("/api/v1/process-images", files=files).text.splitlines()]
+
+    assert lines[0]["filename"] == "broken.zip" and lines[0]["error"].startswith("Could not read archive")
+    assert lines[1] == {"index": 1, "filename": "a.jpg", "error": "Processing failed: model crashed"}
+
+
+def test_process_images_needs_the_models(app_module, client, monkeypatch):
+    monkeypatch.setattr(app_module.model_registry, "status", lambda: "loading")
+    response = client.post("/api/v1/process-images", files=[("files", ("a.jpg", b"A"))])
+    assert response.status_code == 503 and response.headers["retry-after"] == "5"
+
+
+class GatedModel:
+    """A model whose warmup call waits for `gate`."""
+
+    def __init__(self, gate):
+        self.gate = gate
+
+    def __call__(self, image, **kwargs):
+        assert self.gate.wait(timeout=10)
+        return []
+
+
+@pytest.fixture
+def start_models(app_module, monkeypatch):
+    """Swaps in a fresh registry and start-up timer and starts loading the way the lifespan does."""
+    gate = threading.Event()
+
+    def load_model(name, path, threads=None):
+        if path == "missing.pt":
+            raise FileNotFoundError(path)
+        return GatedModel(gate), {"backend": "torch", "precision": "fp32", "artifact": path, "imgsz": [64, 64]}
+
+    def start(**specs):
+        monkeypatch.setattr(model_registry, "load_model", load_model)
+        registry, timer = ModelRegistry(specs), StartupTimer()
+        monkeypatch.setattr(app_module, "model_registry", registry)
+        monkeypatch.setattr(app_module, "startup_timer", timer)
+        timer.mark("healthy")
+        registry.load_in_background(warmup=True, on_loaded=lambda: timer.mark("loaded"),
+                                    on_ready=lambda: timer.mark("ready"))
+        return timer
+
+    yield start, gate
+    gate.set()
+
+
+def wait_until(condition):
+    deadline = time.monotonic() + 10
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_readyz_turns_ready_only_once_the_models_are_warm(client, start_models):
+    start, gate = start_models
+    timer = start(plate_detector="plate.pt", character_detector="chars.pt")
+
+    # Loaded but still warming up: alive, not ready
+    wait_until(lambda: "loaded" in timer.seconds())
+    health = client.get("/healthz")
+    assert health.status_code == 200 and health.json()["status"] == "ok"
+    response = client.get("/readyz")
+    assert response.status_code == 503 and response.headers["retry-after"] == "5"
+    assert response.json()["status"] == "loading"
+
+    gate.set()
+    wait_until(lambda: client.get("/readyz").status_code == 200)
+    body = client.get("/readyz").json()
+    assert body["status"] == "ready"
+    assert list(body["startup_seconds"]) == ["healthy", "loaded", "ready"]
+    assert all(model["loaded"] and "warmup_ms" in model for model in body["models"].values())
+    assert client.get("/healthz").json()["startup_seconds"] == body["startup_seconds"]
+
+
+def test_readyz_reports_a_failed_model_without_retry_after(client, start_models):
+    start, gate = start_models
+    gate.set()
+    timer = start(plate_detector="plate.pt", vehicle_tracker="missing.pt")
+
+    wait_until(lambda: client.get("/readyz").json()["status"] != "loading")
+    response = client.get("/readyz")
+    assert response.status_code == 503 and "retry-after" not in response.headers
+    assert response.json()["status"] == "failed"
+    assert response.json()["models"]["vehicle_tracker"]["error"] == "missing.pt"
+    assert "loaded" not in timer.seconds() and client.get("/healthz").status_code == 200
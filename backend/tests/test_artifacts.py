@@ -0,0 +1,100 @@
+import json
+import os
+import uuid
+
+import cv2
+import numpy as np
+import pytest
+
+import artifacts
+from artifacts import ANNOTATED_FILE, DETECTIONS_FILE, artifact_writer, render_artifact, save_image_artifacts
+from result_store import ResultStore
+
+PLATE_BOX = (40, 60, 120, 90)
+CHARACTERS = [{"class": "A", "x": 20, "y": 15, "width": 10, "height": 20},
+              {"class": "B", "x": 50, "y": 15, "width": 10, "height": 20}]
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = ResultStore(str(tmp_path / "results"))
+    monkeypatch.setattr(artifacts, "result_store", store)
+    return store
+
+
+def upload():
+    image = np.full((120, 160, 3), 200, np.uint8)
+    image[PLATE_BOX[1]:PLATE_BOX[3], PLATE_BOX[0]:PLATE_BOX[2]] = 255
+    return image, cv2.imencode(".png", image)[1].tobytes()
+
+
+def decode(data):
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+
+def save(level, characters=None):
+    result_id = str(uuid.uuid4())
+    image, contents = upload()
+    plates = [{"index": 0, "box": PLATE_BOX, "characters": characters or []}]
+    assert save_image_artifacts(result_id, contents, "car.PNG", image, plates, level=level) == ANNOTATED_FILE
+    return result_id, contents
+
+
+def test_annotated_level_stores_the_upload_untouched_and_renders_on_request(store):
+    result_id, contents = save("annotated")
+    assert store.names(result_id) == [DETECTIONS_FILE, "original.png"]
+    assert store.read(result_id, "original.png") == contents
+
+    assert render_artifact(result_id, ANNOTATED_FILE)
+    annotated = decode(store.read(result_id, ANNOTATED_FILE))
+    # The plate outline is drawn in green on the original
+    assert annotated[PLATE_BOX[1], 80].tolist() == pytest.approx([0, 255, 0], abs=40)
+    assert annotated[10, 10].tolist() == pytest.approx([200, 200, 200], abs=10)
+
+    assert render_artifact(result_id, "cropped_plate_0.jpg")
+    assert decode(store.read(result_id, "cropped_plate_0.jpg")).shape == (30, 80, 3)
+
+
+def test_cropped_plate_is_outlined_with_the_roboflow_characters(store):
+    result_id, _ = save("annotated", CHARACTERS)
+
+    assert render_artifact(result_id, "cropped_plate_0.jpg")
+    crop = decode(store.read(result_id, "cropped_plate_0.jpg")).astype(int)
+    # Thin character outlines, blended over the white plate, tint only the pixels they cross
+    assert min(crop[5, 20]) < 200 and min(crop[5, 50]) < 200
+    assert crop[15, 35].tolist() == pytest.approx([255, 255, 255], abs=10)
+
+
+def test_names_that_are_not_artifacts_of_the_result_are_not_rendered(store):
+    result_id, _ = save("annotated")
+
+    assert not render_artifact(result_id, "cropped_plate_1.jpg")
+    assert not render_artifact(result_id, "original.png")
+    assert not render_artifact(str(uuid.uuid4()), ANNOTATED_FILE)
+    assert store.names(result_id) == [DETECTIONS_FILE, "original.png"]
+
+
+def test_full_level_renders_everything_in_the_background(store):
+    result_id, _ = save("full")
+
+    for name in (ANNOTATED_FILE, "cropped_plate_0.jpg"):
+        artifact_writer.wait_for(artifacts.artifact_key(result_id, name))
+    assert store.names(result_id) == ["cropped_plate_0.jpg", DETECTIONS_FILE, "original.png", ANNOTATED_FILE]
+
+
+def test_none_level_stores_nothing(store):
+    image, contents = upload()
+    assert save_image_artifacts(str(uuid.uuid4()), contents, "car.png", image, [], level="none") is None
+    assert store.stats()["files"] == 0
+
+
+def test_legacy_folder_is_rendered_into_in_place(tmp_path):
+    folder = tmp_path / "legacy"
+    folder.mkdir()
+    _, contents = upload()
+    (folder / "original.jpg").write_bytes(contents)
+    (folder / DETECTIONS_FILE).write_text(json.dumps({"original": "original.jpg", "plates": [{"index": 0, "box": PLATE_BOX}]}))
+
+    assert render_artifact("legacy", "cropped_plate_0.jpg", legacy_folder=str(folder))
+    assert decode((folder / "cropped_plate_0.jpg").read_bytes()).shape == (30, 80, 3)
+    assert sorted(os.listdir(folder)) == ["cropped_plate_0.jpg", DETECTIONS_FILE, "original.jpg"]
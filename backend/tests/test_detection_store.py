@@ -0,0 +1,220 @@
+import threading
+from datetime import datetime
+
+import pytest
+from pymongo.errors import AutoReconnect
+
+import detection_store
+from detection_store import DetectionWriter, backfill_rollups, read_stats, rollup_cutoff
+
+mongomock = pytest.importorskip("mongomock")
+
+
+@pytest.fixture
+def db():
+    database = mongomock.MongoClient()["anpr_test"]
+    return database["detections"], database["detection_stats"]
+
+
+def detection(status="Success", confidence=0.5, **extra):
+    return {"type": "image", "plate": "AB123", "status": status, "confidence": confidence,
+            "timestamp": datetime.utcnow(), **extra}
+
+
+def make_writer(collection, stats):
+    return DetectionWriter(collection, stats, batch_size=10, flush_interval=0.01)
+
+
+def test_backfill_counts_history_when_the_writer_created_the_totals_first(db):
+    collection, stats = db
+    collection.insert_many([detection(status="Failed"), detection(), detection()])
+    writer = make_writer(collection, stats)
+    writer.write(detection())
+    writer.flush()
+    assert read_stats(stats)["total"] == 1
+
+    backfill_rollups(collection, stats)
+
+    totals = read_stats(stats)
+    assert totals["total"] == 4
+    assert totals["failures"] == 1
+    writer.close()
+
+
+class Serialized:
+    """A mongomock collection behind a lock: unlike a real server, mongomock is not thread-safe."""
+
+    def __init__(self, collection, lock):
+        self._collection = collection
+        self._lock = lock
+
+    def __getattr__(self, name):
+        method = getattr(self._collection, name)
+
+        def call(*args, **kwargs):
+            with self._lock:
+                result = method(*args, **kwargs)
+                return list(result) if name in ("aggregate", "find") else result
+        return call
+
+
+def test_backfill_next_to_a_live_writer_counts_every_detection_once(db):
+    lock = threading.RLock()
+    collection, stats = (Serialized(c, lock) for c in db)
+    collection.insert_many([detection() for _ in range(50)])
+    writer = make_writer(collection, stats)
+
+    def produce():
+        for _ in range(200):
+            writer.write(detection())
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    backfill_rollups(collection, stats)
+    producer.join()
+    writer.close()
+
+    assert collection.count_documents({}) == 250
+    assert read_stats(stats)["total"] == 250
+
+
+def test_backfill_runs_only_once(db):
+    collection, stats = db
+    collection.insert_many([detection() for _ in range(5)])
+    backfill_rollups(collection, stats)
+    backfill_rollups(collection, stats)
+    assert read_stats(stats)["total"] == 5
+
+
+def test_totals_from_before_the_cutoff_are_not_backfilled_again(db):
+    collection, stats = db
+    collection.insert_many([detection() for _ in range(5)])
+    stats.insert_one({"_id": "totals", "total": 5, "failures": 0, "confidence_sum": 2.5})
+    backfill_rollups(collection, stats)
+    assert read_stats(stats)["total"] == 5
+
+
+def test_cutoff_is_fixed_by_the_first_caller(db):
+    _, stats = db
+    assert rollup_cutoff(stats) == rollup_cutoff(stats)
+    assert detection_store.ObjectId() > rollup_cutoff(stats)
+
+
+def test_backfill_fills_the_hourly_buckets(db):
+    collection, stats = db
+    collection.insert_many([
+        detection(timestamp=datetime(2026, 3, 1, 8, 5)),
+        detection(timestamp=datetime(2026, 3, 1, 8, 55), status="Failed"),
+        detection(timestamp=datetime(2026, 3, 1, 10, 0)),
+    ])
+    writer = make_writer(collection, stats)
+    writer.write(detection(timestamp=datetime(2026, 3, 1, 10, 30)))
+    writer.close()
+
+    backfill_rollups(collection, stats)
+
+    hourly = detection_store.read_hourly_stats(datetime(2026, 3, 1), stats)
+    assert [(h["hour"], h["total"], h["failures"]) for h in hourly] == [
+        (datetime(2026, 3, 1, 8), 2, 1),
+        (datetime(2026, 3, 1, 10), 2, 0),
+    ]
+    assert read_stats(stats)["total"] == 4
+
+
+class FlakyCollection:
+    """Fails the first `failures` insert_many calls; the first one loses the connection half-way."""
+
+    def __init__(self, collection, failures):
+        self.collection = collection
+        self.failures = failures
+        self.calls = 0
+
+    def insert_many(self, docs, ordered=True):
+        self.calls += 1
+        if self.calls <= self.failures:
+            if self.calls == 1:
+                self.collection.insert_many(docs[:len(docs) // 2], ordered=ordered)
+            raise AutoReconnect("connection reset")
+        return self.collection.insert_many(docs, ordered=ordered)
+
+
+def test_failed_batches_are_retried_and_rolled_up_once(db, monkeypatch):
+    collection, stats = db
+    monkeypatch.setattr(detection_store, "RETRY_BACKOFF", 0.01)
+    writer = DetectionWriter(FlakyCollection(collection, failures=2), stats, batch_size=10, flush_interval=0.01)
+    writer.write_many([detection() for _ in range(10)])
+    writer.close()
+
+    assert collection.count_documents({}) == 10
+    assert read_stats(stats)["total"] == 10
+    assert writer.stats()["retries"] == 2
+    assert writer.stats()["failed"] == 0
+
+
+def test_rejected_documents_are_not_rolled_up(db):
+    collection, stats = db
+    collection.insert_one({"_id": "taken"})
+    writer = make_writer(collection, stats)
+    writer.write_many([detection(), detection(_id="taken"), detection()])
+    writer.close()
+
+    assert read_stats(stats)["total"] == 2
+    assert writer.stats()["written"] == 2
+    assert writer.stats()["failed"] == 1
+
+
+def test_a_batch_is_dropped_once_the_retry_time_is_up(db, monkeypatch):
+    collection, stats = db
+    monkeypatch.setattr(detection_store, "RETRY_BACKOFF", 0.01)
+    writer = DetectionWriter(FlakyCollection(collection, failures=100), stats, batch_size=10,
+                             flush_interval=0.01, retry_seconds=0.05)
+    writer.write_many([detection() for _ in range(4)])
+    writer.close()
+
+    assert writer.stats()["failed"] == 4
+    assert read_stats(stats)["total"] == 0
+
+
+def test_detections_written_after_close_are_inserted_directly(db):
+    collection, stats = db
+    writer = make_writer(collection, stats)
+    writer.write(detection())
+    writer.close()
+
+    writer.write(detection())
+
+    assert collection.count_documents({}) == 2
+    assert read_stats(stats)["total"] == 2
+
+
+def test_processing_time_is_counted_once_per_request(db, monkeypatch):
+    collection, stats = db
+    monkeypatch.setattr(detection_store, "STATS_PERCENTILE_WINDOW", 3)
+    writer = make_writer(collection, stats)
+    # An image with three plates, one without plates, and two videos
+    writer.write_many([detection(result_id="a") for _ in range(3)])
+    for processing_ms in (100.0, 50.0, 4000.0, 6000.0):
+        writer.record_request(processing_ms)
+    writer.close()
+
+    totals = read_stats(stats)
+    assert totals["total"] == 3
+    assert totals["processing_count"] == 4
+    assert totals["processing_ms_sum"] == 10150.0
+    assert detection_store.recent_processing_times(stats) == [50.0, 4000.0, 6000.0]
+
+
+def test_backfill_counts_old_per_plate_processing_times_once_per_result(db):
+    collection, stats = db
+    collection.insert_many([
+        detection(result_id="a", processing_ms=120.0),
+        detection(result_id="a", processing_ms=120.0),
+        detection(result_id="b", processing_ms=80.0),
+        {**detection(), "type": "video"},
+    ])
+    backfill_rollups(collection, stats)
+
+    totals = read_stats(stats)
+    assert totals["total"] == 4
+    assert totals["processing_count"] == 2
+    assert totals["processing_ms_sum"] == 200.0
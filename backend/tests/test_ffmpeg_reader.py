@@ -0,0 +1,31 @@
+import struct
+
+from ffmpeg_reader import is_pipe_decodable
+
+
+def box(kind, payload=b""):
+    return struct.pack(">I4s", 8 + len(payload), kind) + payload
+
+
+FTYP = box(b"ftyp", b"isom\x00\x00\x02\x00")
+
+
+def test_faststart_mp4_is_pipe_decodable():
+    assert is_pipe_decodable(FTYP + box(b"moov", b"\x00" * 32) + box(b"mdat")) is True
+
+
+def test_mp4_with_the_index_after_the_media_is_not():
+    assert is_pipe_decodable(FTYP + box(b"free") + box(b"mdat", b"\x00" * 32)) is False
+
+
+def test_large_box_sizes_are_followed():
+    large_free = struct.pack(">I4sQ", 1, b"free", 24) + b"\x00" * 8
+    assert is_pipe_decodable(FTYP + large_free + box(b"moov")) is True
+    # The 64-bit size is cut off: not enough bytes yet to decide
+    assert is_pipe_decodable(FTYP + large_free[:12]) is None
+
+
+def test_short_head_is_undecided_and_other_containers_stream():
+    assert is_pipe_decodable(FTYP + struct.pack(">I4s", 4096, b"free")) is None
+    assert is_pipe_decodable(b"\x1a\x45\xdf\xa3" + b"\x00" * 60) is True  # Matroska / WebM
+    assert is_pipe_decodable(FTYP + struct.pack(">I4s", 4, b"bad!")) is False
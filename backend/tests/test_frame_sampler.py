@@ -0,0 +1,48 @@
+import pytest
+
+from fakes import FakeCapture, frame_number
+from frame_sampler import FrameSampler
+
+
+def read_all(sampler, cap, tracks=lambda n: 0):
+    analyzed = []
+    while True:
+        frame_nmr, frame = sampler.read(cap)
+        if frame is None:
+            return analyzed
+        assert frame_number(frame) == frame_nmr
+        analyzed.append(frame_nmr)
+        sampler.update(tracks(frame_nmr))
+
+
+def test_full_mode_analyzes_every_frame():
+    sampler = FrameSampler("full")
+    assert read_all(sampler, FakeCapture(20)) == list(range(20))
+    assert sampler.stats() == {"sampling_mode": "full", "frames_read": 20, "frames_decoded": 20, "frames_analyzed": 20}
+
+
+def test_adaptive_mode_on_a_still_scene_analyzes_only_every_max_gap_frames():
+    sampler = FrameSampler("adaptive", base_stride=5, max_gap=30)
+    analyzed = read_all(sampler, FakeCapture(200))
+    # The first frame counts as motion; after that only the gap limit lets frames through
+    assert analyzed == [4, 34, 64, 94, 124, 154, 184]
+    assert sampler.stats()["frames_decoded"] == 40
+
+
+def test_adaptive_mode_follows_tracked_vehicles_at_every_frame():
+    sampler = FrameSampler("adaptive", base_stride=5, max_gap=30)
+    analyzed = read_all(sampler, FakeCapture(60), tracks=lambda n: 1 if 30 <= n < 40 else 0)
+    assert [n for n in analyzed if 34 <= n <= 40] == [34, 35, 36, 37, 38, 39, 40]
+
+
+def test_start_frame_offsets_frame_numbers():
+    sampler = FrameSampler("full", start_frame=100)
+    cap = FakeCapture(5)
+    frame_nmr, _ = sampler.read(cap)
+    assert frame_nmr == 100
+    assert sampler.stats()["frames_read"] == 1
+
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(ValueError):
+        FrameSampler("sometimes")
@@ -0,0 +1,75 @@
+import cv2
+import numpy as np
+import pytest
+
+from fakes import Boxes, Result
+from image_ocr import get_yolo_ocr_text_batch, letterbox_crop
+
+
+def plate(shape, characters):
+    """A white crop with a black rectangle per (label, (x1, y1, x2, y2)) character."""
+    crop = np.full((*shape, 3), 255, np.uint8)
+    for _, (x1, y1, x2, y2) in characters:
+        crop[y1:y2, x1:x2] = 0
+    return crop
+
+
+class BlobCharacterDetector:
+    """Reports every dark blob of a letterboxed canvas as a character, labelled by `labels(canvas)`."""
+
+    def __init__(self, labels):
+        self.labels = labels
+        self.batches = []
+
+    def __call__(self, images, **kwargs):
+        self.batches.append([image.shape for image in images])
+        results = []
+        for image, labels in zip(images, self.labels):
+            count, _, stats, _ = cv2.connectedComponentsWithStats((image[:, :, 0] < 60).astype(np.uint8))
+            blobs = sorted(stats[1:count].tolist(), key=lambda s: -s[0])
+            boxes = [(x, y, x + w, y + h) for x, y, w, h, _ in blobs]
+            # Report right to left so the test also sees the sort back into reading order
+            names = dict(enumerate(labels[::-1]))
+            results.append(Result(Boxes(boxes, [0.9] * len(boxes), list(names)), names))
+        return results
+
+
+@pytest.mark.parametrize("shape", [(40, 200), (200, 40), (256, 640), (17, 33)])
+def test_letterbox_box_maps_back_to_the_crop(shape):
+    h, w = shape
+    box = (w // 4, h // 4, w // 2, h // 2)
+    canvas, scale, (pad_x, pad_y) = letterbox_crop(plate(shape, [("A", box)]), width=640, height=256)
+
+    assert canvas.shape == (256, 640, 3)
+    # One side fills the canvas, the other is centred in grey padding
+    assert pad_x == 0 or pad_y == 0
+    assert canvas[0, 0].tolist() == ([114] * 3 if (pad_x or pad_y) else [255] * 3)
+    ys, xs = np.nonzero(canvas[:, :, 0] < 60)
+    mapped = (np.array([xs.min(), ys.min(), xs.max() + 1, ys.max() + 1]) - [pad_x, pad_y, pad_x, pad_y]) / scale
+    assert np.abs(mapped - box).max() <= 1 / scale + 1
+
+
+def test_batch_reads_mixed_shapes_in_one_call_and_in_reading_order():
+    wide = plate((40, 200), [("A", (10, 10, 30, 30)), ("B", (60, 10, 80, 30)), ("7", (150, 10, 170, 30))])
+    tall = plate((120, 60), [("X", (5, 40, 25, 80)), ("9", (35, 40, 55, 80))])
+    detector = BlobCharacterDetector(["AB7", "X9"])
+
+    results = get_yolo_ocr_text_batch([wide, np.zeros((0, 0, 3), np.uint8), tall], detector, batch_size=8)
+
+    assert detector.batches == [[(256, 640, 3), (256, 640, 3)]]
+    assert [r["text"] for r in results] == ["AB7", "", "X9"]
+    assert results[0]["confidences"] == pytest.approx([0.9] * 3)
+
+
+def test_a_failing_chunk_only_fails_its_own_crops():
+    class FailsSecondBatch(BlobCharacterDetector):
+        def __call__(self, images, **kwargs):
+            if self.batches:
+                raise RuntimeError("out of memory")
+            return super().__call__(images, **kwargs)
+
+    crop = plate((40, 200), [("A", (10, 10, 30, 30))])
+    results = get_yolo_ocr_text_batch([crop, crop], FailsSecondBatch(["A"]), batch_size=1)
+
+    assert results[0]["text"] == "A"
+    assert "out of memory" in results[1]["error"]
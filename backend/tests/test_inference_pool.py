@@ -0,0 +1,59 @@
+import threading
+import time
+
+import pytest
+
+from inference_pool import InferenceExecutor, ExecutorSaturated, ExecutorUnavailable
+
+
+@pytest.fixture
+def executor():
+    executor = InferenceExecutor(kind="thread", max_workers=1, max_queue=1)
+    yield executor
+    executor.shutdown(wait=False)
+
+
+def test_submit_if_idle_never_queues(executor):
+    release = threading.Event()
+    assert executor.has_idle_worker()
+    running = executor.submit_if_idle(release.wait)
+
+    # The only worker is busy: submit() may still queue, submit_if_idle() declines
+    assert not executor.has_idle_worker()
+    assert executor.submit_if_idle(lambda: None) is None
+    queued = executor.submit(lambda: "queued")
+    with pytest.raises(ExecutorSaturated):
+        executor.submit(lambda: None)
+
+    release.set()
+    assert running.result(timeout=5) is True
+    assert queued.result(timeout=5) == "queued"
+    # Futures resolve just before the executor's done callback frees their slot
+    deadline = time.monotonic() + 5
+    while not executor.has_idle_worker():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert executor.submit_if_idle(lambda: "idle").result(timeout=5) == "idle"
+
+
+def test_submit_if_idle_after_shutdown(executor):
+    executor.shutdown()
+    assert not executor.has_idle_worker()
+    with pytest.raises(ExecutorUnavailable):
+        executor.submit_if_idle(lambda: None)
+
+
+def test_cancelled_tasks_are_not_counted_as_completed(executor):
+    release = threading.Event()
+    running = executor.submit(release.wait)
+    queued = executor.submit(lambda: "never")
+    assert queued.cancel()
+
+    release.set()
+    running.result(timeout=5)
+    deadline = time.monotonic() + 5
+    while executor.stats()["completed"] < 1:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    stats = executor.stats()
+    assert (stats["completed"], stats["cancelled"], stats["queue_depth"]) == (1, 1, 0)
@@ -0,0 +1,112 @@
+import json
+import threading
+
+import pytest
+
+import jobs
+from inference_pool import ExecutorSaturated
+from jobs import JobManager
+from result_store import ResultStore
+from video_ocr import VideoProcessingCancelled
+
+
+class FakeVideoJob:
+    """Stands in for process_video_job: reports progress until cancelled, or finishes when `finish` is set."""
+
+    def __init__(self):
+        self.started = []
+        self.running = threading.Event()
+        self.finish = threading.Event()
+
+    def __call__(self, video_path, ocr_mode=None, result_id=None, progress_callback=None, cancel_event=None, **options):
+        self.started.append(video_path)
+        progress_callback(10, 100)
+        self.running.set()
+        while not self.finish.wait(0.01):
+            if cancel_event.is_set():
+                raise VideoProcessingCancelled("cancelled")
+        return {"tracked_vehicles": 0}
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = ResultStore(str(tmp_path / "results"))
+    monkeypatch.setattr(jobs, "result_store", store)
+    return store
+
+
+@pytest.fixture
+def video_job(monkeypatch):
+    fake = FakeVideoJob()
+    monkeypatch.setattr(jobs, "process_video_job", fake)
+    yield fake
+    fake.finish.set()
+
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = JobManager(str(tmp_path / "results"), max_workers=1, max_queue=1)
+    yield manager
+    manager.shutdown(wait=True)
+
+
+def upload(tmp_path, name):
+    path = tmp_path / name
+    path.write_bytes(b"video")
+    return str(path)
+
+
+def test_cancelling_a_running_job_stops_it_and_removes_its_video(tmp_path, store, video_job, manager):
+    job = manager.submit(upload(tmp_path, "a.mp4"), "a.mp4")
+    assert video_job.running.wait(5)
+    assert manager.get(job.job_id)["status"] == "running"
+
+    assert manager.cancel(job.job_id)
+    job.future.result(timeout=5)
+
+    status = manager.get(job.job_id)
+    assert (status["status"], status["frames_processed"], status["total_frames"]) == ("cancelled", 10, 100)
+    assert json.loads(store.read(job.job_id, jobs.JOB_STATUS_FILE))["status"] == "cancelled"
+    assert not (tmp_path / "a.mp4").exists() and manager.video_paths() == []
+    assert not manager.cancel(job.job_id)
+
+
+def test_cancelling_a_queued_job_finishes_it_without_running_it(tmp_path, store, video_job, manager):
+    running = manager.submit(upload(tmp_path, "a.mp4"), "a.mp4")
+    assert video_job.running.wait(5)
+    queued = manager.submit(upload(tmp_path, "b.mp4"), "b.mp4")
+    assert manager.stats()["queued"] == 1
+    assert manager.video_paths() == [str(tmp_path / "a.mp4"), str(tmp_path / "b.mp4")]
+
+    assert manager.cancel(queued.job_id)
+
+    assert manager.get(queued.job_id)["status"] == "cancelled"
+    assert not (tmp_path / "b.mp4").exists()
+    video_job.finish.set()
+    running.future.result(timeout=5)
+    assert manager.get(running.job_id)["status"] == "completed"
+    assert video_job.started == [str(tmp_path / "a.mp4")]
+
+
+def test_full_queue_rejects_new_jobs_until_one_is_cancelled(tmp_path, store, video_job, manager):
+    manager.submit(upload(tmp_path, "a.mp4"), "a.mp4")
+    queued = manager.submit(upload(tmp_path, "b.mp4"), "b.mp4")
+    with pytest.raises(ExecutorSaturated):
+        manager.submit(upload(tmp_path, "c.mp4"), "c.mp4")
+
+    manager.cancel(queued.job_id)
+    assert manager.submit(upload(tmp_path, "c.mp4"), "c.mp4").status == "queued"
+
+
+def test_finished_jobs_are_answered_from_the_store_after_pruning(tmp_path, store, video_job, manager, monkeypatch):
+    video_job.finish.set()
+    job = manager.submit(upload(tmp_path, "a.mp4"), "a.mp4")
+    job.future.result(timeout=5)
+
+    monkeypatch.setattr(jobs, "JOB_RETENTION_SECONDS", -1)
+    manager.submit(upload(tmp_path, "b.mp4"), "b.mp4").future.result(timeout=5)
+
+    assert job.job_id not in manager._jobs
+    assert manager.get(job.job_id)["status"] == "completed"
+    assert manager.get("not-a-job-id") is None
+    assert not manager.cancel(job.job_id)
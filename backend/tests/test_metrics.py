@@ -0,0 +1,87 @@
+import pytest
+
+from metrics import Counter, Gauge, Histogram, MetricsRegistry, percentiles, timed
+
+
+@pytest.fixture
+def registry():
+    return MetricsRegistry()
+
+
+def test_counters_render_one_sample_per_label_set(registry):
+    calls = registry.register(Counter("anpr_calls_total", "Calls."))
+    calls.inc(model="plate")
+    calls.inc(2, model="plate")
+    calls.inc(model='say "hi"\n')
+    calls.inc()
+
+    assert registry.render().splitlines() == [
+        "# HELP anpr_calls_total Calls.",
+        "# TYPE anpr_calls_total counter",
+        "anpr_calls_total 1",
+        'anpr_calls_total{model="plate"} 3',
+        'anpr_calls_total{model="say \\"hi\\"\\n"} 1',
+    ]
+
+
+def test_histogram_buckets_are_cumulative(registry):
+    seconds = registry.register(Histogram("anpr_seconds", "Time.", buckets=(0.5, 0.1, 1.0)))
+    for value in (0.05, 0.1, 0.7, 3.0):
+        seconds.observe(value, stage="ocr")
+
+    lines = [line for line in registry.render().splitlines() if not line.startswith("#")]
+    assert lines == [
+        'anpr_seconds_bucket{stage="ocr",le="0.1"} 2',
+        'anpr_seconds_bucket{stage="ocr",le="0.5"} 2',
+        'anpr_seconds_bucket{stage="ocr",le="1.0"} 3',
+        'anpr_seconds_bucket{stage="ocr",le="+Inf"} 4',
+        'anpr_seconds_sum{stage="ocr"} 3.85',
+        'anpr_seconds_count{stage="ocr"} 4',
+    ]
+    assert seconds.snapshot() == {'{stage="ocr"}': {"count": 4, "sum": pytest.approx(3.85)}}
+
+
+def test_gauges_are_read_at_render_time_and_skip_missing_samples(registry):
+    depth = [3]
+    registry.register(Gauge("anpr_depth", "Depth.", lambda: depth[0]))
+    registry.register(Gauge("anpr_fps", "FPS.", lambda: {(("stream", "a"),): 2.5, (("stream", "b"),): None}))
+    registry.register(Gauge("anpr_broken", "Broken.", lambda: 1 / 0))
+    depth[0] = 7
+
+    samples = [line for line in registry.render().splitlines() if not line.startswith("#")]
+    assert samples == ["anpr_depth 7", 'anpr_fps{stream="a"} 2.5']
+    # Gauges have no snapshot; a failing callback still renders its HELP/TYPE lines
+    assert registry.snapshot() == {}
+    assert "# TYPE anpr_broken gauge" in registry.render()
+
+
+def test_registering_a_name_again_replaces_the_metric(registry):
+    registry.register(Counter("anpr_calls_total", "Old.")).inc()
+    registry.register(Counter("anpr_calls_total", "New."))
+    assert registry.render().splitlines() == ["# HELP anpr_calls_total New.", "# TYPE anpr_calls_total counter"]
+
+
+def test_reset_clears_counters_and_histograms(registry):
+    calls = registry.register(Counter("anpr_calls_total", "Calls."))
+    seconds = registry.register(Histogram("anpr_seconds", "Time."))
+    calls.inc(model="plate")
+    with timed(seconds, stage="ocr"):
+        pass
+
+    assert registry.snapshot()["anpr_seconds"]['{stage="ocr"}']["count"] == 1
+    registry.reset()
+    assert registry.snapshot() == {"anpr_calls_total": {}, "anpr_seconds": {}}
+
+
+def test_timed_observes_even_when_the_block_raises(registry):
+    seconds = registry.register(Histogram("anpr_seconds", "Time."))
+    with pytest.raises(ValueError):
+        with timed(seconds, stage="decode"):
+            raise ValueError("bad image")
+    assert seconds.snapshot()['{stage="decode"}']["count"] == 1
+
+
+def test_percentiles_use_the_nearest_rank():
+    assert percentiles(range(1, 101)) == {50: 50, 95: 95, 99: 99}
+    assert percentiles([5, 1, 3], qs=(0, 50, 100)) == {0: 1, 50: 3, 100: 5}
+    assert percentiles([]) == {50: 0, 95: 0, 99: 0}
@@ -0,0 +1,78 @@
+import pytest
+
+from fakes import Boxes, Result
+from model_backends import agreement, backend_config, exported_path, parse_imgsz
+
+NAMES = {0: "A", 1: "B", 2: "7"}
+
+
+def result(*detections):
+    """A detector result of (x1, y1, x2, y2, confidence, class) detections."""
+    if not detections:
+        return Result(Boxes())
+    xyxy = [d[:4] for d in detections]
+    return Result(Boxes(xyxy, [d[4] for d in detections], [d[5] for d in detections]))
+
+
+@pytest.mark.parametrize("value, imgsz", [("640", (640, 640)), ("256,640", (256, 640)), ("256x640", (256, 640)),
+                                          (" 320 , 320 ", (320, 320)), (480, (480, 480))])
+def test_parse_imgsz(value, imgsz):
+    assert parse_imgsz(value) == imgsz
+
+
+def test_backend_config_reads_per_model_overrides(monkeypatch):
+    monkeypatch.setenv("PLATE_DETECTOR_BACKEND", "onnx")
+    monkeypatch.setenv("PLATE_DETECTOR_PRECISION", "int8")
+    monkeypatch.setenv("PLATE_DETECTOR_IMGSZ", "320")
+
+    assert backend_config("plate_detector") == {"backend": "onnx", "precision": "int8", "imgsz": (320, 320)}
+    assert exported_path("models/plate.pt", "onnx", "int8") == "models/plate_int8.onnx"
+    assert exported_path("models/plate.pt", "openvino", "fp32") == "models/plate_openvino_model"
+
+
+@pytest.mark.parametrize("backend, precision", [("tensorrt", "fp32"), ("onnx", "fp16"), ("torch", "int8")])
+def test_backend_config_rejects_unsupported_combinations(monkeypatch, backend, precision):
+    monkeypatch.setenv("VEHICLE_TRACKER_BACKEND", backend)
+    monkeypatch.setenv("VEHICLE_TRACKER_PRECISION", precision)
+    with pytest.raises(ValueError):
+        backend_config("vehicle_tracker")
+
+
+def test_identical_results_agree_fully():
+    plate = result((10, 10, 50, 30, 0.9, 0), (60, 10, 100, 30, 0.8, 1))
+    assert agreement([plate, result()], [plate, result()], NAMES) == {
+        "recall": 1.0, "precision": 1.0, "mean_iou": 1.0, "mean_confidence_delta": 0.0, "text_agreement": 1.0,
+    }
+
+
+def test_boxes_match_by_iou_and_class_only():
+    reference = [result((0, 0, 10, 10, 0.9, 0), (20, 0, 30, 10, 0.9, 1), (40, 0, 50, 10, 0.9, 2))]
+    # Shifted by one pixel (IoU 0.82), wrong class, and a box far from any reference box
+    candidate = [result((1, 0, 11, 10, 0.7, 0), (20, 0, 30, 10, 0.9, 0), (80, 0, 90, 10, 0.9, 2), (90, 0, 99, 10, 0.5, 2))]
+
+    report = agreement(reference, candidate, NAMES)
+
+    assert report["recall"] == pytest.approx(1 / 3, abs=1e-4)
+    assert report["precision"] == 0.25
+    assert report["mean_iou"] == pytest.approx(90 / 110, abs=1e-4)
+    assert report["mean_confidence_delta"] == pytest.approx(0.2, abs=1e-4)
+    assert report["text_agreement"] == 0.0
+
+
+def test_each_box_is_matched_once_to_its_best_partner():
+    reference = [result((0, 0, 10, 10, 0.9, 0))]
+    candidate = [result((2, 0, 12, 10, 0.9, 0), (0, 0, 10, 10, 0.9, 0))]
+
+    report = agreement(reference, candidate)
+
+    assert (report["recall"], report["precision"], report["mean_iou"]) == (1.0, 0.5, 1.0)
+    assert "text_agreement" not in report
+
+
+def test_text_agreement_reads_left_to_right():
+    reference = [result((0, 0, 10, 10, 0.9, 0), (20, 0, 30, 10, 0.9, 2))]
+    # Same characters, listed in the other order
+    candidate = [result((20, 0, 30, 10, 0.9, 2), (0, 0, 10, 10, 0.9, 0))]
+    assert agreement(reference, candidate, NAMES)["text_agreement"] == 1.0
+    assert agreement([result()], [result()]) == {"recall": 1.0, "precision": 1.0, "mean_iou": None,
+                                                 "mean_confidence_delta": None}
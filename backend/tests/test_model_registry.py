@@ -0,0 +1,59 @@
+import model_registry
+from model_registry import ModelRegistry
+
+
+class FakeYOLO:
+    """The parts of ultralytics.YOLO a clone has to keep apart: predictor, callbacks and overrides."""
+
+    def __init__(self, path):
+        self.model = {"weights": path}
+        self.predictor = None
+        self.callbacks = {"on_predict_start": [print]}
+        self.overrides = {"imgsz": [640, 640]}
+
+    def track(self, frame, persist=False, **kwargs):
+        if self.predictor is None:
+            self.predictor = {"tracks": []}
+        self.predictor["tracks"].append(frame)
+
+
+def fake_load_model(name, path, threads=None):
+    if path.endswith("missing.pt"):
+        raise FileNotFoundError(path)
+    return FakeYOLO(path), {"backend": "torch", "precision": "fp32", "artifact": path, "imgsz": [640, 640]}
+
+
+def registry(monkeypatch, **specs):
+    monkeypatch.setattr(model_registry, "load_model", fake_load_model)
+    return ModelRegistry(specs).load_all()
+
+
+def test_clones_share_weights_but_not_per_call_state(monkeypatch):
+    models = registry(monkeypatch, vehicle_tracker="yolov8n.pt")
+    base = models.get("vehicle_tracker")
+    first, second = models.clone("vehicle_tracker"), models.clone("vehicle_tracker")
+
+    assert first is not base and first.model is second.model is base.model
+    first.callbacks["on_predict_start"].append(len)
+    first.overrides["conf"] = 0.5
+    assert base.callbacks == second.callbacks == {"on_predict_start": [print]}
+    assert "conf" not in base.overrides and "conf" not in second.overrides
+
+
+def test_each_new_tracker_starts_without_tracks(monkeypatch):
+    models = registry(monkeypatch, vehicle_tracker="yolov8n.pt")
+    used = models.new_tracker()
+    used.track("frame 1", persist=True)
+    used.track("frame 2", persist=True)
+
+    assert used.predictor == {"tracks": ["frame 1", "frame 2"]}
+    assert models.new_tracker().predictor is None
+    assert models.get("vehicle_tracker").predictor is None
+
+
+def test_a_model_that_failed_to_load_has_no_clone(monkeypatch):
+    models = registry(monkeypatch, vehicle_tracker="yolov8n.pt", plate_detector="missing.pt")
+
+    assert models.clone("plate_detector") is None
+    assert models.is_ready("vehicle_tracker") and not models.is_ready()
+    assert models.stats()["plate_detector"]["loaded"] is False
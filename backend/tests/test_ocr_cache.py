@@ -0,0 +1,92 @@
+import sqlite3
+
+import cv2
+import numpy as np
+
+import ocr_cache
+from ocr_cache import OCRCache, exact_hash, perceptual_hash
+
+RESULT = {"text": "ABC123", "confidence": 0.9}
+
+
+def plate(text):
+    image = np.full((60, 220, 3), 230, np.uint8)
+    cv2.putText(image, text, (10, 45), cv2.FONT_HERSHEY_SIMPLEX, 1.4, (20, 20, 20), 3)
+    return image
+
+
+def recompressed(image):
+    return cv2.imdecode(cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 40])[1], cv2.IMREAD_COLOR)
+
+
+def disk_rows(tmp_path):
+    with sqlite3.connect(tmp_path / "ocr_cache.sqlite3") as db:
+        return [row[0] for row in db.execute("SELECT key FROM ocr_cache ORDER BY stored_at")]
+
+
+def test_perceptual_key_matches_a_recompressed_crop():
+    cache = OCRCache(perceptual=True)
+    crop = plate("ABC123")
+    cache.put("ns", cache.keys(crop), RESULT, crop)
+
+    noisy = recompressed(crop)
+    assert cache.get("ns", cache.keys(noisy), noisy) == RESULT
+    assert cache.stats()["namespaces"]["ns"]["perceptual_hits"] == 1
+
+
+def test_perceptual_key_shared_by_another_plate_is_not_served():
+    cache = OCRCache(perceptual=True)
+    crop = plate("ABC123")
+    cache.put("ns", cache.keys(crop), RESULT, crop)
+
+    # Force the collision the coarse hash allows: a different plate under the same perceptual key
+    other = plate("ABC128")
+    assert cache.get("ns", [exact_hash(other), perceptual_hash(crop)], other) is None
+    assert cache.stats()["namespaces"]["ns"]["misses"] == 1
+
+
+def test_perceptual_keys_are_skipped_without_the_crop():
+    cache = OCRCache(perceptual=True)
+    crop = plate("ABC123")
+    cache.put("ns", cache.keys(crop), RESULT)
+    assert cache.stats()["entries"] == 1
+
+    noisy = recompressed(crop)
+    assert cache.get("ns", cache.keys(noisy)) is None
+
+
+def test_disk_table_is_held_to_max_entries(tmp_path, monkeypatch):
+    clock = iter(range(100))
+    monkeypatch.setattr(ocr_cache.time, "time", lambda: float(next(clock)))
+    cache = OCRCache(max_entries=2, disk_dir=str(tmp_path))
+    for text in ["A1", "B2", "C3"]:
+        cache.put("ns", [exact_hash(plate(text))], {"text": text})
+
+    assert disk_rows(tmp_path) == [exact_hash(plate("B2")), exact_hash(plate("C3"))]
+    assert cache.stats()["disk_entries"] == 2
+
+
+def test_disk_table_drops_expired_entries(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ocr_cache.time, "time", lambda: now[0])
+    cache = OCRCache(ttl=10, disk_dir=str(tmp_path))
+    cache.put("ns", ["xold"], {"text": "OLD"})
+    now[0] += 60
+    cache.put("ns", ["xnew"], {"text": "NEW"})
+    assert disk_rows(tmp_path) == ["xnew"]
+
+    # A restart reads what is left, and prunes again on open
+    now[0] += 60
+    reopened = OCRCache(ttl=10, disk_dir=str(tmp_path))
+    assert reopened.get("ns", ["xnew"]) is None
+    assert disk_rows(tmp_path) == []
+
+
+def test_perceptual_match_survives_a_restart(tmp_path):
+    crop = plate("ABC123")
+    OCRCache(perceptual=True, disk_dir=str(tmp_path)).put("ns", OCRCache(perceptual=True).keys(crop), RESULT, crop)
+
+    reopened = OCRCache(perceptual=True, disk_dir=str(tmp_path))
+    noisy, other = recompressed(crop), plate("ABC128")
+    assert reopened.get("ns", [exact_hash(other), perceptual_hash(crop)], other) is None
+    assert reopened.get("ns", reopened.keys(noisy), noisy) == RESULT
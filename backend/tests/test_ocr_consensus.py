@@ -0,0 +1,50 @@
+from ocr_consensus import consensus_ocr, fuse_readings
+
+
+def shots(*confidences, vehicle="shot"):
+    return [{"image": f"{vehicle}-{i}", "confidence": c} for i, c in enumerate(confidences)]
+
+
+class ScriptedOCR:
+    """Reads each shot name as the text listed for it, recording every batch it was given."""
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.batches = []
+
+    def __call__(self, images):
+        self.batches.append(list(images))
+        return [{"text": self.texts[image]} if self.texts[image] else {"error": "unreadable"} for image in images]
+
+
+def test_agreeing_shots_stop_consensus_early():
+    first = ScriptedOCR({"shot-0": "AB123", "shot-1": "AB123", "shot-2": "XX999", "shot-3": "XX999"})
+    (result,) = consensus_ocr([shots(0.9, 0.8, 0.7, 0.6)], first, agree=2)
+
+    assert result["plate"] == "AB123"
+    assert first.batches == [["shot-0", "shot-1"]]
+    assert result["ocr_results"][2:] == [None, None]
+
+
+def test_undecided_vehicles_read_one_more_shot_per_round_in_shared_batches():
+    ocr = ScriptedOCR({"a-0": "AB123", "a-1": "AB128", "a-2": "AB123",
+                       "b-0": "CD456", "b-1": "CD456", "b-2": "CD999"})
+    vehicles = [shots(0.9, 0.8, 0.7, vehicle="a"), shots(0.9, 0.8, 0.7, vehicle="b")]
+    results = consensus_ocr(vehicles, ocr, agree=2, threshold=1.0)
+
+    # Round one reads two shots of each vehicle together; only the first is undecided after it
+    assert ocr.batches == [["a-0", "a-1", "b-0", "b-1"], ["a-2"]]
+    assert [r["plate"] for r in results] == ["AB123", "CD456"]
+    assert results[1]["ocr_results"][2] is None
+
+
+def test_vehicles_without_readable_shots_fail():
+    results = consensus_ocr([[], shots(0.9)], ScriptedOCR({"shot-0": None}))
+    assert [r["plate"] for r in results] == ["OCR_FAILED", "OCR_FAILED"]
+    assert [r["plate_confidence"] for r in results] == [0.0, 0.0]
+
+
+def test_fuse_readings_votes_per_character_by_weight():
+    text, confidence = fuse_readings([("AB123", [1.0] * 5), ("AB128", [0.2] * 5), ("AB12", [0.1] * 4)])
+    assert text == "AB123"
+    assert 0 < confidence < 1
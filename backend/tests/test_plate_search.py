@@ -0,0 +1,92 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from bson import ObjectId
+
+from plate_search import PlateIndex, edit_distance, normalize_plate, plate_key
+
+NOW = datetime(2026, 10, 1, 12, 0, 0)
+
+
+def sighting(plate, minutes_ago=0, **extra):
+    timestamp = NOW - timedelta(minutes=minutes_ago)
+    return {"_id": ObjectId.from_datetime(timestamp), "plate": plate, "timestamp": timestamp, **extra}
+
+
+def brute_force_distance(a, b):
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def test_plate_key_folds_ocr_lookalikes():
+    assert normalize_plate(" ab-12 cd3") == "AB12CD3"
+    assert plate_key("AB12CD3") == plate_key("A812C03") == "A812C03"
+
+
+def test_edit_distance_is_exact_within_the_limit():
+    rng = random.Random(0)
+    for _ in range(500):
+        a = "".join(rng.choice("AB12") for _ in range(rng.randint(0, 7)))
+        b = "".join(rng.choice("AB12") for _ in range(rng.randint(0, 7)))
+        exact = brute_force_distance(a, b)
+        for limit in range(4):
+            distance = edit_distance(a, b, limit)
+            # Past the limit only "more than limit" is promised, not the exact distance
+            assert distance == exact if exact <= limit else distance > limit
+
+
+def test_search_ranks_exact_key_before_edits_and_pages_newest_first():
+    index = PlateIndex()
+    docs = [sighting("AB12CD3", m) for m in (30, 20, 10)]
+    docs += [sighting("A812C03", 5), sighting("AB12CD", 1), sighting("XY98ZW7", 2)]
+    for doc in docs:
+        assert index.add(doc)
+
+    result = index.search("ab12cd3", limit=2)
+    # Same key first (more sightings wins the tie), then one edit away; unrelated plates never
+    assert [(p["plate"], p["distance"], p["sightings"]) for p in result["plates"]] == [
+        ("AB12CD3", 0, 3), ("A812C03", 0, 1), ("AB12CD", 1, 1),
+    ]
+    assert result["total"] == 5
+    assert [oid for oid, _, _ in result["ids"]] == [docs[2]["_id"], docs[1]["_id"]]
+
+
+def test_search_filters_by_time_range_with_aware_bounds():
+    index = PlateIndex()
+    for minutes_ago in (120, 60, 10):
+        index.add(sighting("AB12CD3", minutes_ago))
+
+    since = (NOW - timedelta(minutes=90)).replace(tzinfo=timezone.utc)
+    until = (NOW - timedelta(minutes=30)).replace(tzinfo=timezone.utc)
+    result = index.search("AB12CD3", since=since, until=until)
+    assert result["total"] == 1
+    assert result["plates"][0]["first_seen"] == NOW - timedelta(minutes=60)
+
+
+def test_unreadable_failed_and_repeated_detections_are_not_indexed():
+    index = PlateIndex()
+    doc = sighting("AB12CD3")
+    assert index.add(doc)
+    assert not index.add(doc)
+    assert not index.add(sighting("OCR_FAILED", 1))
+    assert not index.add(sighting("AB12CD3", 2, status="Failed"))
+    assert index.stats()["sightings"] == 1
+
+
+def test_refresh_tails_the_collection():
+    mongomock = pytest.importorskip("mongomock")
+    collection = mongomock.MongoClient()["anpr_test"]["detections"]
+    collection.insert_many([sighting("AB12CD3", 10), sighting("XY98ZW7", 5)])
+    index = PlateIndex(collection, batch_size=1)
+
+    assert index.refresh() == 2
+    collection.insert_one(sighting("AB12CD3", 1))
+    # Later refreshes re-read the overlap window but only count the new detection
+    assert index.refresh() == 1
+    assert index.search("AB12CD3")["total"] == 2
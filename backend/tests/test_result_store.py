@@ -0,0 +1,105 @@
+import os
+import time
+import uuid
+
+import pytest
+
+import result_store
+from result_store import ResultStore, sweep_temp_dir
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(result_store.time, "time", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ResultStore(str(tmp_path / "results"))
+
+
+def blob_files(store):
+    return sorted(name for _, _, names in os.walk(os.path.join(store.root, "blobs")) for name in names)
+
+
+def test_identical_files_are_stored_once(store):
+    first, second = str(uuid.uuid4()), str(uuid.uuid4())
+    store.put(first, "original.jpg", b"same bytes")
+    store.put(second, "original.jpg", b"same bytes")
+    store.put(second, "detections.json", b"{}")
+
+    assert store.read(first, "original.jpg") == store.read(second, "original.jpg") == b"same bytes"
+    assert store.names(second) == ["detections.json", "original.jpg"]
+    assert len(blob_files(store)) == 2
+    stats = store.stats()
+    assert (stats["files"], stats["blobs"], stats["dedup_saved_bytes"]) == (3, 2, len(b"same bytes"))
+    assert store.read(first, "missing.jpg") is None
+
+
+def test_replacing_a_file_frees_its_old_blob_on_collection(store):
+    result_id = str(uuid.uuid4())
+    store.put(result_id, "detections.json", b"old")
+    store.put(result_id, "detections.json", b"new")
+
+    assert store.collect_garbage() == (1, 3)
+    assert store.read(result_id, "detections.json") == b"new"
+    assert len(blob_files(store)) == 1
+
+
+def test_sweep_expires_old_results_but_keeps_blobs_still_referenced(store, clock):
+    old, recent = str(uuid.uuid4()), str(uuid.uuid4())
+    store.put(old, "original.jpg", b"shared")
+    store.put(old, "plate.jpg", b"only old")
+    clock[0] += 10 * 86400
+    store.put(recent, "original.jpg", b"shared")
+
+    summary = store.sweep(max_age_days=5, max_bytes=0)
+    assert summary == {"expired": 1, "evicted": 0, "blobs_freed": 1, "bytes_freed": len(b"only old")}
+    assert store.names(old) == []
+    assert store.read(recent, "original.jpg") == b"shared"
+
+
+def test_sweep_evicts_the_oldest_results_until_under_max_bytes(store, clock, monkeypatch):
+    # Eviction deletes SWEEP_BATCH // 10 results per round; one at a time shows the order
+    monkeypatch.setattr(result_store, "SWEEP_BATCH", 10)
+    ids = [str(uuid.uuid4()) for _ in range(3)]
+    for n, result_id in enumerate(ids):
+        store.put(result_id, "original.jpg", bytes([n]) * 100)
+        clock[0] += 60
+    # Writing to a result makes it recent again
+    store.put(ids[0], "job.json", b"x" * 10)
+
+    summary = store.sweep(max_age_days=0, max_bytes=250)
+    assert summary["evicted"] == 1 and summary["bytes_freed"] == 100
+    assert store.names(ids[1]) == []
+    assert store.names(ids[0]) == ["job.json", "original.jpg"]
+    assert store.stats()["bytes"] == 210
+
+
+def test_sweep_temp_dir_removes_only_stale_unused_files(tmp_path):
+    temp_dir = tmp_path / "temp"
+    temp_dir.mkdir()
+    stale, in_use, fresh = (temp_dir / name for name in ("stale.mp4", "in_use.mp4", "fresh.mp4"))
+    for path in (stale, in_use, fresh):
+        path.write_bytes(b"video")
+    day_ago = time.time() - 86400
+    for path in (stale, in_use):
+        os.utime(path, (day_ago, day_ago))
+
+    assert sweep_temp_dir(str(temp_dir), max_age_seconds=3600, in_use=[str(in_use)]) == 1
+    assert sorted(os.listdir(temp_dir)) == ["fresh.mp4", "in_use.mp4"]
+
+
+def test_sweep_legacy_folders_removes_old_result_folders(store):
+    os.makedirs(store.root)
+    old, recent, other = (os.path.join(store.root, name) for name in (str(uuid.uuid4()), str(uuid.uuid4()), "blobs"))
+    for path in (old, recent, other):
+        os.makedirs(path)
+    day_ago = time.time() - 2 * 86400
+    for path in (old, other):
+        os.utime(path, (day_ago, day_ago))
+
+    assert store.sweep_legacy_folders(max_age_days=1) == 1
+    assert not os.path.exists(old) and os.path.exists(recent) and os.path.exists(other)
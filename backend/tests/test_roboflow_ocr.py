@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+
+import roboflow_ocr
+from mock_roboflow import PLATE_TEXT, start_mock_server
+from roboflow_ocr import CircuitBreaker, RoboflowClient
+
+
+@pytest.fixture
+def mock_api():
+    server, base_url = start_mock_server(latency=0.0)
+    yield server, base_url
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(roboflow_ocr.time, "monotonic", lambda: now[0])
+    return now
+
+
+def client(base_url, **options):
+    options.setdefault("backoff", 0.001)
+    return RoboflowClient(api_key="mock", project="mock", version="1", api_base=base_url, **options)
+
+
+def crop(width=240):
+    return np.random.default_rng(width).integers(0, 255, (80, width, 3), dtype=np.uint8)
+
+
+def test_batch_results_are_read_concurrently_and_returned_in_order(mock_api):
+    server, base_url = mock_api
+    ocr = client(base_url, concurrency=4)
+    images = [crop(), np.zeros((0, 0, 3), np.uint8), crop(300)]
+
+    results = ocr.ocr_batch(images)
+
+    assert results[0]["text"] == results[2]["text"] == PLATE_TEXT
+    # An empty crop fails on its own without tripping anything else
+    assert "error" in results[1]
+    assert ocr.stats() == {"requests": 2, "retries": 0, "failures": 1, "short_circuited": 0, "breaker": "closed"}
+
+
+def test_throttled_requests_are_retried_then_reported(mock_api):
+    server, base_url = mock_api
+    server.error_rate = 1.0
+    ocr = client(base_url, max_retries=2)
+
+    result = ocr.ocr(crop())
+
+    assert result["error"].startswith("Roboflow API error: ")
+    assert ocr.stats()["requests"] == 3 and ocr.stats()["retries"] == 2 and ocr.stats()["failures"] == 1
+
+    server.error_rate = 0.0
+    assert ocr.ocr(crop())["text"] == PLATE_TEXT
+
+
+def test_connection_errors_are_retried(mock_api):
+    server, base_url = mock_api
+    server.shutdown()
+    server.server_close()
+    ocr = client(base_url, max_retries=1)
+
+    assert ocr.ocr(crop())["error"].startswith("Exception in Roboflow OCR: ")
+    assert ocr.stats()["requests"] == 2 and ocr.stats()["retries"] == 1
+
+
+def test_open_breaker_short_circuits_until_a_trial_call_succeeds(mock_api, clock):
+    server, base_url = mock_api
+    server.error_rate = 1.0
+    ocr = client(base_url, max_retries=0, breaker=CircuitBreaker(threshold=2, cooldown=30))
+
+    ocr.ocr(crop())
+    ocr.ocr(crop())
+    assert ocr.breaker.state == "open"
+    assert ocr.ocr(crop())["circuit_open"] is True
+    assert ocr.stats()["requests"] == 2 and ocr.stats()["short_circuited"] == 1
+
+    server.error_rate = 0.0
+    clock[0] += 30
+    assert ocr.breaker.state == "half-open"
+    assert ocr.ocr(crop())["text"] == PLATE_TEXT
+    assert ocr.breaker.state == "closed"
+
+
+def test_half_open_breaker_lets_one_trial_through_and_reopens_if_it_fails(clock):
+    breaker = CircuitBreaker(threshold=3, cooldown=10)
+    for _ in range(3):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert not breaker.allow()
+
+    clock[0] += 10
+    assert breaker.allow()
+    # Only one trial at a time
+    assert not breaker.allow()
+    breaker.record_failure()
+    # A failed trial opens the breaker for a full cooldown again, without waiting for `threshold` failures
+    assert breaker.state == "open"
+    clock[0] += 9
+    assert not breaker.allow()
+    clock[0] += 1
+    assert breaker.allow()
@@ -0,0 +1,68 @@
+import numpy as np
+
+import video_ocr
+from fakes import CharacterDetector, PlateInVehicleDetector, ScriptedTracker
+from streams import FrameRing, LiveSampler, LiveStream
+
+CAR = (20.0, 20.0, 100.0, 90.0)
+
+
+def numbered_frame(n):
+    frame = np.zeros((120, 160, 3), np.uint8)
+    frame[0, 0, 0], frame[0, 0, 1] = n % 256, n // 256
+    return frame
+
+
+class CapturingTracker(ScriptedTracker):
+    """Captures `burst` more frames into the ring on every call, so all but the newest few are dropped."""
+
+    def __init__(self, script, ring, frames, burst):
+        super().__init__(script)
+        self.ring, self.frames, self.burst = ring, frames, burst
+        self.captured = 0
+
+    def capture(self, count):
+        for _ in range(min(count, self.frames - self.captured)):
+            self.ring.put(numbered_frame(self.captured))
+            self.captured += 1
+        if self.captured >= self.frames:
+            self.ring.close()
+
+    def track(self, frame, **kwargs):
+        result = super().track(frame, **kwargs)
+        self.capture(self.burst)
+        return result
+
+
+def test_frame_ring_drops_the_oldest_frame_when_full():
+    ring = FrameRing(capacity=2)
+    for n in range(5):
+        ring.put(numbered_frame(n))
+    ring.close()
+
+    assert (ring.captured, ring.dropped) == (5, 3)
+    assert [ring.get()[0] for _ in range(2)] == [3, 4]
+    assert ring.get() is None
+
+
+def test_dropped_frames_do_not_count_toward_finalizing_a_live_vehicle():
+    def script(frame_nmr):
+        return [(1, CAR)] if frame_nmr < 20 or 120 <= frame_nmr < 140 else []
+
+    stream = LiveStream("test-stream", "camera")
+    stream.ring = FrameRing(capacity=2)
+    tracker = CapturingTracker(script, stream.ring, frames=200, burst=8)
+    tracker.capture(2)
+    emitted = []
+
+    video_ocr.run_video_pipeline(
+        stream.ring, PlateInVehicleDetector(script), CharacterDetector("AB123"), tracker,
+        lambda vehicle_info, vehicle: emitted.append(vehicle), ocr_mode="local",
+        sampler=LiveSampler(stream), frame_queue_size=1,
+    )
+
+    # 100 capture sequence numbers without the vehicle, but only about a tenth reached the tracker
+    assert stream.ring.dropped > 100
+    assert tracker.calls < 60
+    assert len(emitted) == 1
+    assert emitted[0]["first_frame"] < 20 and emitted[0]["last_frame"] >= 120
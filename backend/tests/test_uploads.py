@@ -0,0 +1,144 @@
+import asyncio
+import io
+import tarfile
+import zipfile
+
+import pytest
+
+import bulk_images
+from bulk_images import iter_upload_images, take
+from uploads import InvalidUpload, RequestUpload, UploadTooLarge, read_limited
+
+BOUNDARY = "----anprboundary"
+
+
+class StreamedRequest:
+    """A starlette Request as RequestUpload reads it: headers and a body arriving in `chunk_size` pieces."""
+
+    def __init__(self, body, content_type, chunk_size=7):
+        self.headers = {"content-type": content_type}
+        self.body = body
+        self.chunk_size = chunk_size
+        self.chunks_sent = 0
+
+    async def stream(self):
+        for start in range(0, len(self.body), self.chunk_size):
+            self.chunks_sent += 1
+            yield self.body[start:start + self.chunk_size]
+
+
+def multipart(*parts):
+    """A multipart/form-data body of (field, filename, data) parts."""
+    body = b""
+    for field, filename, data in parts:
+        disposition = f'form-data; name="{field}"' + (f'; filename="{filename}"' if filename else "")
+        body += f"--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\n\r\n".encode() + data + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+def read_upload(request, **options):
+    upload = RequestUpload(request, **options)
+
+    async def collect():
+        return b"".join([chunk async for chunk in upload.chunks()])
+
+    return upload, asyncio.run(collect())
+
+
+def zip_archive(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+def tar_archive(members):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    buffer.seek(0)
+    return buffer
+
+
+def test_multipart_file_field_is_read_across_chunk_boundaries():
+    video = bytes(range(256)) * 40
+    body = multipart(("note", None, b"ignored"), ("file", "clip.mp4", video), ("file", "second.mp4", b"late"))
+    request = StreamedRequest(body, f"multipart/form-data; boundary={BOUNDARY}")
+
+    upload, data = read_upload(request)
+
+    assert data == video and upload.filename == "clip.mp4" and upload.received == len(video)
+
+
+def test_raw_body_is_the_upload():
+    upload, data = read_upload(StreamedRequest(b"raw video bytes", "video/mp4"))
+    assert data == b"raw video bytes" and upload.filename is None
+
+
+def test_upload_over_the_limit_stops_reading_the_body():
+    request = StreamedRequest(multipart(("file", "big.mp4", b"x" * 1000)), f"multipart/form-data; boundary={BOUNDARY}")
+    with pytest.raises(UploadTooLarge):
+        read_upload(request, max_bytes=100)
+    assert request.chunks_sent < len(request.body) // request.chunk_size
+
+
+def test_multipart_body_without_the_file_field_is_invalid():
+    request = StreamedRequest(multipart(("video", "clip.mp4", b"data")), f"multipart/form-data; boundary={BOUNDARY}")
+    with pytest.raises(InvalidUpload):
+        read_upload(request)
+    with pytest.raises(InvalidUpload):
+        read_upload(StreamedRequest(b"", "multipart/form-data"))
+
+
+def test_read_limited():
+    assert read_limited(io.BytesIO(b"12345"), 5) == b"12345"
+    with pytest.raises(UploadTooLarge):
+        read_limited(io.BytesIO(b"123456"), 5)
+
+
+def test_archives_are_expanded_and_non_images_skipped():
+    uploads = [
+        ("single.jpg", io.BytesIO(b"jpeg")),
+        ("batch.zip", zip_archive({"a.png": b"png", "notes.txt": b"no", "__MACOSX/._a.png": b"meta", "dir/b.JPG": b"jpg"})),
+        ("more.tar.gz", tar_archive({"c.webp": b"webp", ".hidden.jpg": b"no"})),
+    ]
+
+    assert list(iter_upload_images(uploads)) == [
+        ("single.jpg", b"jpeg", None),
+        ("batch.zip/a.png", b"png", None),
+        ("batch.zip/dir/b.JPG", b"jpg", None),
+        ("more.tar.gz/c.webp", b"webp", None),
+    ]
+
+
+def test_oversized_broken_and_surplus_images_are_reported(monkeypatch):
+    monkeypatch.setattr(bulk_images, "BULK_MAX_IMAGE_BYTES", 4)
+    uploads = [
+        ("big.zip", zip_archive({"big.jpg": b"too large", "ok.jpg": b"ok"})),
+        ("broken.zip", io.BytesIO(b"not a zip")),
+        ("big.tar", tar_archive({"big.png": b"too large"})),
+        ("one.jpg", io.BytesIO(b"1")),
+        ("two.jpg", io.BytesIO(b"2")),
+    ]
+
+    results = list(iter_upload_images(uploads, max_images=2))
+
+    assert [(name, contents) for name, contents, _ in results] == [
+        ("big.zip/big.jpg", None), ("big.zip/ok.jpg", b"ok"), ("broken.zip", None),
+        ("big.tar/big.png", None), ("one.jpg", b"1"), ("two.jpg", None),
+    ]
+    assert results[0][2] == results[3][2] == "Image exceeds the size limit."
+    assert results[2][2].startswith("Could not read archive")
+    assert results[-1][2].startswith("Too many images")
+
+
+def test_take_reads_batches_lazily():
+    images = iter_upload_images([(f"{n}.jpg", io.BytesIO(b"x")) for n in range(5)])
+    assert [name for name, _, _ in take(images, 2)] == ["0.jpg", "1.jpg"]
+    assert [name for name, _, _ in take(images, 4)] == ["2.jpg", "3.jpg", "4.jpg"]
+    assert take(images, 4) == []
@@ -0,0 +1,165 @@
+import threading
+
+import numpy as np
+import pytest
+
+import video_ocr
+from fakes import Boxes, CharacterDetector, FakeCapture, PlateInVehicleDetector, Result, ScriptedTracker
+from frame_sampler import FrameSampler
+
+CAR = (20.0, 20.0, 100.0, 90.0)
+
+
+def run(frames, script, sampler=None, delay=0.0):
+    cap = FakeCapture(frames)
+    emitted = []
+
+    def on_vehicle(vehicle_info, vehicle):
+        emitted.append((vehicle_info, vehicle, cap.position))
+
+    stats = video_ocr.run_video_pipeline(
+        cap, PlateInVehicleDetector(script), CharacterDetector("AB123"), ScriptedTracker(script, delay),
+        on_vehicle, ocr_mode="local", sampler=sampler or FrameSampler("full"), total_frames=frames,
+    )
+    return emitted, stats
+
+
+def test_vehicle_is_finalized_during_a_long_empty_stretch():
+    def script(frame_nmr):
+        return [(1, CAR)] if frame_nmr < 10 else []
+
+    emitted, stats = run(210, script, delay=0.001)
+
+    assert len(emitted) == 1
+    vehicle_info, vehicle, position = emitted[0]
+    assert vehicle_info["plate"] == "AB123"
+    assert vehicle["last_frame"] == 9
+    # Finalized TRACK_FINALIZE_FRAMES after it was last seen, not at the end of the video
+    assert position < 9 + video_ocr.TRACK_FINALIZE_FRAMES + 2 * video_ocr.VIDEO_QUEUE_SIZE + 10
+    assert stats["frames_analyzed"] == 210
+
+
+def test_shots_consensus_skipped_are_reported_as_not_read():
+    def script(frame_nmr):
+        return [(1, CAR)] if frame_nmr < 10 else []
+
+    emitted, _ = run(20, script)
+
+    # The first two readings agree, so the other three stored shots are never OCR'd
+    results = [frame["ocr_result"] for frame in emitted[0][0]["best_frames"]]
+    assert results == ["AB123", "AB123", video_ocr.NOT_READ, video_ocr.NOT_READ, video_ocr.NOT_READ]
+
+
+def test_vehicles_still_in_view_are_finalized_at_the_end():
+    def script(frame_nmr):
+        return [(1, CAR), (2, (110.0, 20.0, 150.0, 90.0))] if frame_nmr >= 5 else []
+
+    emitted, _ = run(40, script)
+
+    assert sorted(info["vehicle_id"] for info, _, _ in emitted) == [1, 2]
+    assert all(vehicle["last_frame"] == 39 for _, vehicle, _ in emitted)
+
+
+def test_adaptive_sampling_finalizes_on_a_still_scene():
+    def script(frame_nmr):
+        return [(1, CAR)] if frame_nmr < 10 else []
+
+    # A still scene is analyzed every 30 frames, and finalizing waits for TRACK_FINALIZE_FRAMES of those
+    frames = 10 + 30 * (video_ocr.TRACK_FINALIZE_FRAMES + 20)
+    emitted, stats = run(frames, script, sampler=FrameSampler("adaptive", base_stride=5, max_gap=30))
+
+    assert len(emitted) == 1
+    assert emitted[0][2] < frames
+    assert stats["frames_analyzed"] < stats["frames_read"]
+
+
+def test_vehicle_lost_for_fewer_tracker_calls_than_the_finalize_limit_is_emitted_once():
+    seen = []
+
+    def script(frame_nmr):
+        seen.append(frame_nmr)
+        return [(1, CAR)] if frame_nmr < 20 or 120 <= frame_nmr < 140 else []
+
+    # 100 frames without the vehicle, but only a handful of them are analyzed, so the tracker
+    # would still hold id 1 when it comes back
+    emitted, _ = run(200, script, sampler=FrameSampler("adaptive", base_stride=5, max_gap=10))
+
+    assert len({n for n in seen if 20 <= n < 120}) < video_ocr.TRACK_FINALIZE_FRAMES
+    assert len(emitted) == 1
+    assert emitted[0][1]["first_frame"] < 20 and emitted[0][1]["last_frame"] >= 120
+
+
+def test_adaptive_sampling_follows_a_vehicle_from_the_frame_it_is_found():
+    seen = []
+
+    def script(frame_nmr):
+        seen.append(frame_nmr)
+        return [(1, CAR)] if 50 <= frame_nmr < 80 else []
+
+    run(120, script, sampler=FrameSampler("adaptive", base_stride=5, max_gap=30))
+
+    first = next(n for n in seen if n >= 50)
+    # No read-ahead at the base stride: every frame after the first sighting is analyzed
+    assert sorted({n for n in seen if first <= n < 80}) == list(range(first, 80))
+
+
+def test_cancel_stops_the_pipeline():
+    cancel = threading.Event()
+    cancel.set()
+    with pytest.raises(video_ocr.VideoProcessingCancelled):
+        video_ocr.run_video_pipeline(
+            FakeCapture(50), None, None, ScriptedTracker(lambda n: []), lambda *a: None, cancel_event=cancel,
+        )
+
+
+def test_top_k_shots_keeps_the_best_and_copies_their_crops():
+    top = video_ocr.TopKShots(k=2)
+    frame = np.zeros((10, 10, 3), np.uint8)
+    for frame_number, confidence in enumerate([0.5, 0.9, 0.7, 0.9, 0.1]):
+        top.push(confidence, frame_number, (0, 0, 5, 5), frame[:5, :5])
+    frame[:] = 255
+
+    shots = top.shots()
+    # Of two equal confidences the earlier shot ranks first
+    assert [(s["frame_number"], s["confidence"]) for s in shots] == [(1, 0.9), (3, 0.9)]
+    assert len(top) == 2 and all(s["image"].max() == 0 for s in shots)
+
+
+class WhitePlateDetector:
+    """Finds the white rectangle of each crop it is given, in crop coordinates."""
+
+    def __init__(self):
+        self.crops = []
+
+    def __call__(self, crops, **kwargs):
+        self.crops.extend(crop.shape[:2] for crop in crops)
+        results = []
+        for crop in crops:
+            ys, xs = np.nonzero(crop[:, :, 0] == 255)
+            boxes = [(xs.min(), ys.min(), xs.max() + 1, ys.max() + 1)] if len(xs) else []
+            results.append(Result(Boxes(boxes, [0.8] * len(boxes))))
+        return results
+
+
+def test_plates_found_in_vehicle_crops_are_mapped_back_to_the_frame():
+    frame = np.zeros((200, 300, 3), np.uint8)
+    frame[70:80, 40:70] = 255
+    # Two overlapping vehicles both see the plate; a third has none; a fourth lies off the frame
+    vehicles = [(20, 20, 100, 90), (30, 30, 110, 100), (200, 100, 280, 180), (400, 0, 500, 50)]
+    detector = WhitePlateDetector()
+
+    boxes, confs = video_ocr.detect_plates_in_rois(detector, frame, vehicles, margin=0.1)
+
+    assert detector.crops == [(84, 96), (84, 96), (96, 96)]
+    assert boxes.tolist() == [[40, 70, 70, 80]] and confs.tolist() == pytest.approx([0.8])
+    assert sorted(video_ocr.associate_plates(vehicles, boxes, "roi")) == [(0, 0), (1, 0)]
+
+
+def test_plates_are_associated_by_containment_in_roi_mode_and_by_iou_in_full_mode():
+    vehicles = [(0, 0, 100, 100), (200, 0, 300, 100)]
+    plates = [(60, 80, 130, 90), (80, 80, 130, 90), (210, 80, 240, 90)]
+
+    # Most of the first plate lies inside vehicle 0, but less than half of the second
+    assert video_ocr.associate_plates(vehicles, plates, "roi") == [(0, 0), (1, 2)]
+    assert video_ocr.associate_plates(vehicles, plates, "full") == [(0, 0), (0, 1), (1, 2)]
+    assert video_ocr.associate_plates(vehicles, [], "roi") == []
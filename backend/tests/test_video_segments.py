@@ -0,0 +1,79 @@
+import glob
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+import pytest
+
+import video_segments
+from fakes import endless_segment
+from video_ocr import VideoProcessingCancelled
+
+
+@pytest.fixture
+def segment_pool(monkeypatch):
+    pool = ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context("spawn"))
+    monkeypatch.setattr(video_segments, "_get_segment_pool", lambda workers: pool)
+    monkeypatch.setattr(video_segments, "process_segment", endless_segment)
+    monkeypatch.setattr(video_segments, "plan_segments", lambda total, workers, overlap: [(0, 10), (10, None)])
+    yield pool
+    pool.shutdown(cancel_futures=True)
+
+
+def write_video(path, frames=20):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 10, (32, 24))
+    for _ in range(frames):
+        writer.write(np.zeros((24, 32, 3), np.uint8))
+    writer.release()
+    return path
+
+
+def cancel_files():
+    return set(glob.glob(os.path.join(tempfile.gettempdir(), "anpr-segments-*.cancel")))
+
+
+def wait_for(predicate, timeout=60):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+
+def test_cancelling_a_segmented_job_stops_its_running_segments(segment_pool, tmp_path):
+    video = write_video(str(tmp_path / "video.avi"))
+    markers = tmp_path / "markers"
+    markers.mkdir()
+    before = cancel_files()
+    cancel_event, raised = threading.Event(), []
+
+    def run():
+        try:
+            video_segments.process_video_segmented(video, cancel_event=cancel_event, workers=2,
+                                                   marker_dir=str(markers))
+        except VideoProcessingCancelled as e:
+            raised.append(e)
+
+    job = threading.Thread(target=run)
+    job.start()
+    wait_for(lambda: len(os.listdir(markers)) == 2)
+    cancel_event.set()
+    job.join(timeout=30)
+
+    assert raised and not job.is_alive()
+    assert sorted(os.listdir(markers)) == ["0.started", "0.stopped", "10.started", "10.stopped"]
+    assert cancel_files() == before
+
+
+def test_a_failing_segment_stops_the_others(segment_pool, tmp_path):
+    video = write_video(str(tmp_path / "video.avi"))
+    markers = tmp_path / "markers"
+    markers.mkdir()
+
+    with pytest.raises(ValueError):
+        video_segments.process_video_segmented(video, workers=2, marker_dir=str(markers), fail_segment=0)
+    assert "10.stopped" in os.listdir(markers)
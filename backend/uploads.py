@@ -0,0 +1,139 @@
+"""
+uploads.py
+
+Reads an upload straight from the request body as it arrives, instead of letting the
+framework spool the whole multipart body to a temporary file before the endpoint runs.
+Accepts a multipart/form-data body (the `file` field, as sent by the frontend) or a raw
+body (e.g. Content-Type: video/mp4). Size limits are enforced while reading, so an
+oversized upload is rejected as soon as it crosses the limit.
+"""
+import os
+
+from python_multipart.multipart import MultipartParser, parse_options_header
+from starlette.concurrency import run_in_threadpool
+
+# --- Upload Configuration (from environment variables) ---
+MAX_IMAGE_UPLOAD_BYTES = int(os.environ.get("MAX_IMAGE_UPLOAD_BYTES", str(25 * 1024 * 1024)))
+MAX_VIDEO_UPLOAD_BYTES = int(os.environ.get("MAX_VIDEO_UPLOAD_BYTES", str(8 * 1024 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    """Raised once an upload exceeds its size limit."""
+
+    def __init__(self, limit):
+        super().__init__(f"Upload exceeds the limit of {limit} bytes.")
+        self.limit = limit
+
+
+class InvalidUpload(Exception):
+    """Raised for a multipart body without the expected file field."""
+
+
+class RequestUpload:
+    """
+    The file of one request, read incrementally:
+
+        upload = RequestUpload(request, max_bytes=MAX_VIDEO_UPLOAD_BYTES)
+        async for chunk in upload.chunks():
+            ...
+
+    `filename` is known once the first chunk has been yielded.
+    """
+
+    def __init__(self, request, field="file", max_bytes=MAX_VIDEO_UPLOAD_BYTES):
+        self.request = request
+        self.field = field.encode()
+        self.max_bytes = max_bytes
+        self.filename = None
+        self.received = 0
+
+    def _count(self, size):
+        self.received += size
+        if self.received > self.max_bytes:
+            raise UploadTooLarge(self.max_bytes)
+
+    async def chunks(self):
+        content_type, params = parse_options_header(self.request.headers.get("content-type", ""))
+        if content_type != b"multipart/form-data":
+            async for chunk in self.request.stream():
+                if chunk:
+                    self._count(len(chunk))
+                    yield chunk
+            return
+        async for chunk in self._multipart_chunks(params.get(b"boundary")):
+            yield chunk
+
+    async def _multipart_chunks(self, boundary):
+        if not boundary:
+            raise InvalidUpload("Multipart body without a boundary.")
+        state = {"field": b"", "value": b"", "is_file": False, "done": False}
+        data = []
+
+        def on_part_begin():
+            state.update(field=b"", value=b"", is_file=False)
+
+        def on_header_field(buf, start, end):
+            state["field"] += buf[start:end]
+
+        def on_header_value(buf, start, end):
+            state["value"] += buf[start:end]
+
+        def on_header_end():
+            if state["field"].lower() == b"content-disposition":
+                _, options = parse_options_header(state["value"])
+                if options.get(b"name") == self.field and not state["done"]:
+                    state["is_file"] = True
+                    self.filename = options.get(b"filename", b"").decode(errors="replace") or None
+            state.update(field=b"", value=b"")
+
+        def on_part_data(buf, start, end):
+            if state["is_file"]:
+                data.append(bytes(buf[start:end]))
+
+        def on_part_end():
+            if state["is_file"]:
+                state.update(is_file=False, done=True)
+
+        parser = MultipartParser(boundary, {
+            "on_part_begin": on_part_begin, "on_header_field": on_header_field,
+            "on_header_value": on_header_value, "on_header_end": on_header_end,
+            "on_part_data": on_part_data, "on_part_end": on_part_end,
+        })
+        found = False
+        async for body_chunk in self.request.stream():
+            if state["done"]:
+                continue  # drain the rest of the body
+            parser.write(body_chunk)
+            if data:
+                found = True
+                chunk = b"".join(data)
+                data.clear()
+                self._count(len(chunk))
+                yield chunk
+        if not state["done"]:
+            parser.finalize()
+        if not found and not state["done"]:
+            raise InvalidUpload(f"No '{self.field.decode()}' field in the multipart body.")
+
+
+async def save_upload(chunks, path):
+    """
+    Writes upload chunks (an async iterator) to `path` as they arrive, off the event loop.
+    The caller owns (and removes) `path`, also when this raises.
+    """
+    with open(path, "wb") as f:
+        async for chunk in chunks:
+            await run_in_threadpool(f.write, chunk)
+
+def read_limited(fileobj, max_bytes):
+    """Reads a whole file object, raising UploadTooLarge as soon as it passes `max_bytes`."""
+    parts, size = [], 0
+    while True:
+        chunk = fileobj.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            return b"".join(parts)
+        size += len(chunk)
+        if size > max_bytes:
+            raise UploadTooLarge(max_bytes)
+        parts.append(chunk)
@@ -1,23 +1,48 @@
 import cv2
 import numpy as np
-from ultralytics import YOLO
 import os
 import uuid
-from collections import defaultdict
+import heapq
+import time
+import queue
+import threading
+from collections import defaultdict, deque
 
 # This function will be imported into app.py
-from image_ocr import get_yolo_ocr_text
-from pymongo import MongoClient
+from image_ocr import run_ocr_batch
 from datetime import datetime
-from roboflow_ocr import roboflow_ocr_text
+from model_registry import VEHICLE_TRACKER_PATH
+from frame_sampler import FrameSampler, VIDEO_SAMPLING_MODE, VIDEO_FRAME_STRIDE
+from ocr_consensus import consensus_ocr
+from detection_store import detection_writer
+from artifacts import save_video_shot
+from metrics import timed, STAGE_SECONDS, REQUEST_SECONDS, MODEL_CALLS, FRAMES
 
 # Toggle for OCR method
 USE_ROBOFLOW_OCR = os.environ.get("USE_ROBOFLOW_OCR", "0") == "1"
+# --- Plate Detection Configuration (from environment variables) ---
+# "full" runs the plate detector on the whole frame; "roi" runs it only on the tracked
+# vehicle regions, batched, at the smaller ROI_IMGSZ input size.
+PLATE_DETECTION_MODE = os.environ.get("PLATE_DETECTION_MODE", "full")
+ROI_IMGSZ = int(os.environ.get("ROI_IMGSZ", "320"))
+ROI_MARGIN = float(os.environ.get("ROI_MARGIN", "0.1"))
+PLATE_ASSOCIATION_IOU = 0.01
+PLATE_CONTAINMENT = 0.5
+ROI_DUPLICATE_IOU = 0.5
+
+# --- Pipeline Configuration (from environment variables) ---
+VIDEO_QUEUE_SIZE = int(os.environ.get("VIDEO_QUEUE_SIZE", "8"))
+# A vehicle unseen for this many analyzed frames (tracker calls, not source frames: sampling
+# skips frames and live streams drop them) is finalized and OCR'd. This must exceed the
+# tracker's own lost-track buffer (30 calls for ByteTrack), or a vehicle the tracker still
+# remembers would be emitted again when it reappears under the same id.
+TRACK_FINALIZE_FRAMES = int(os.environ.get("TRACK_FINALIZE_FRAMES", "60"))
+TOP_K_SHOTS = 5
+# best_frames[].ocr_result of a shot that consensus OCR stopped before reading
+NOT_READ = "NOT_READ"
+OCR_VEHICLE_BATCH = 8
+_END = object()
 
-mongo_uri = os.environ.get("MONGODB_URI", "mongodb://mongodb:27017/")
-mongo_client = MongoClient(mongo_uri)
-db = mongo_client["anpr_db"]
-detections_collection = db["detections"]
 def calculate_iou(boxA, boxB):
     """
     Calculates the Intersection over Union (IoU) of two bounding boxes.
@@ -36,128 +61,458 @@ def calculate_iou(boxA, boxB):
     
     return iou
 
-def process_video_file(plate_detector, character_detector, video_path, ocr_mode=None):
-    print(f"[DEBUG] OCR mode in backend: {ocr_mode}")
+def overlap_matrices(boxes_a, boxes_b):
     """
-    Processes a video file to track vehicles, find the top 5 best license plate shots for each,
-    and perform OCR on each shot.
+    Computes pairwise overlaps between two (N, 4) and (M, 4) arrays of xyxy boxes in one pass.
+    Returns (iou, containment), both (N, M), where containment[i, j] is the fraction of
+    boxes_b[j] that lies inside boxes_a[i].
+    """
+    a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    inter_w = np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0])
+    inter_h = np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1])
+    inter = np.clip(inter_w, 0, None) * np.clip(inter_h, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    iou = inter / (area_a[:, None] + area_b[None, :] - inter + 1e-6)
+    containment = inter / (area_b[None, :] + 1e-6)
+    return iou, containment
+
+def associate_plates(vehicle_boxes, plate_boxes, plate_detection_mode="full"):
+    """
+    Returns (vehicle_index, plate_index) pairs. In "full" mode a plate belongs to every vehicle
+    it overlaps with IoU > PLATE_ASSOCIATION_IOU; in "roi" mode the plates were found inside the
+    vehicle crops, so a plate belongs to the vehicles that contain most of it.
+    """
+    if len(vehicle_boxes) == 0 or len(plate_boxes) == 0:
+        return []
+    iou, containment = overlap_matrices(vehicle_boxes, plate_boxes)
+    if plate_detection_mode == "roi":
+        matches = containment >= PLATE_CONTAINMENT
+    else:
+        matches = iou > PLATE_ASSOCIATION_IOU
+    return list(zip(*np.nonzero(matches)))
+
+def _suppress_duplicates(boxes, confs, iou_threshold=ROI_DUPLICATE_IOU):
+    """Greedy NMS, used to drop the same plate found in two overlapping vehicle crops."""
+    if len(boxes) < 2:
+        return boxes, confs
+    order = np.argsort(-confs)
+    iou, _ = overlap_matrices(boxes, boxes)
+    keep, suppressed = [], np.zeros(len(boxes), dtype=bool)
+    for i in order:
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        suppressed |= iou[i] > iou_threshold
+    return boxes[keep], confs[keep]
+
+def detect_plates_full(plate_detector, frame):
+    """Runs the plate detector on the whole frame. Returns (boxes (P, 4), confidences (P,))."""
+    MODEL_CALLS.inc(model="plate_detector")
+    boxes = plate_detector(frame, verbose=False)[0].boxes
+    return boxes.xyxy.cpu().numpy(), boxes.conf.cpu().numpy()
+
+def detect_plates_in_rois(plate_detector, frame, vehicle_boxes, imgsz=ROI_IMGSZ, margin=ROI_MARGIN):
+    """
+    Runs the plate detector once on a batch of (slightly enlarged) vehicle crops at `imgsz`
+    and maps the plate boxes back to frame coordinates.
+    """
+    frame_h, frame_w = frame.shape[:2]
+    crops, offsets = [], []
+    for x1, y1, x2, y2 in vehicle_boxes:
+        mx, my = (x2 - x1) * margin, (y2 - y1) * margin
+        cx1, cy1 = int(max(0, x1 - mx)), int(max(0, y1 - my))
+        cx2, cy2 = int(min(frame_w, x2 + mx)), int(min(frame_h, y2 + my))
+        if cx2 <= cx1 or cy2 <= cy1:
+            continue
+        crops.append(frame[cy1:cy2, cx1:cx2])
+        offsets.append((cx1, cy1, cx1, cy1))
+    if not crops:
+        return np.zeros((0, 4), np.float32), np.zeros((0,), np.float32)
+
+    all_boxes, all_confs = [], []
+    MODEL_CALLS.inc(model="plate_detector")
+    for result, offset in zip(plate_detector(crops, imgsz=imgsz, verbose=False), offsets):
+        if len(result.boxes) == 0:
+            continue
+        all_boxes.append(result.boxes.xyxy.cpu().numpy() + np.array(offset, dtype=np.float32))
+        all_confs.append(result.boxes.conf.cpu().numpy())
+    if not all_boxes:
+        return np.zeros((0, 4), np.float32), np.zeros((0,), np.float32)
+    return _suppress_duplicates(np.concatenate(all_boxes), np.concatenate(all_confs))
+
+class VideoProcessingCancelled(Exception):
+    """Raised by process_video_file when its cancel_event is set mid-video."""
+
+
+class TopKShots:
+    """
+    The best `k` plate shots of one vehicle, kept in a fixed-size min-heap keyed by confidence.
+    Crops are copied when they enter the heap, so a stored shot never keeps a whole frame alive.
+    """
+
+    def __init__(self, k=TOP_K_SHOTS):
+        self.k = k
+        self._heap = []
+        self._seq = 0
+
+    def push(self, confidence, frame_number, plate_box, crop):
+        # Among equal confidences the earliest shot wins, as with the old stable sort
+        key = (confidence, -self._seq)
+        self._seq += 1
+        if len(self._heap) >= self.k and key <= self._heap[0][0]:
+            return
+        shot = {
+            'image': crop.copy(),
+            'confidence': confidence,
+            'frame_number': frame_number,
+            'plate_box': plate_box
+        }
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, (key, shot))
+        else:
+            heapq.heapreplace(self._heap, (key, shot))
+
+    def shots(self):
+        """Stored shots, best first."""
+        return [shot for _, shot in sorted(self._heap, key=lambda item: item[0], reverse=True)]
+
+    def __len__(self):
+        return len(self._heap)
+
+
+def _put(q, item, stop_event):
+    """Blocking put on a bounded queue that gives up once the pipeline is stopping."""
+    while not stop_event.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _build_vehicle_info(vehicle, consensus):
+    """
+    Formats a finalized vehicle and its consensus OCR for the API response. ocr_result stays a
+    string: the shot's reading, "OCR_FAILED", or NOT_READ for shots consensus did not need.
+    """
+    vehicle_info = {
+        "vehicle_id": vehicle['vehicle_id'],
+        "vehicle_type": vehicle['vehicle_type'],
+        "plate": consensus["plate"],
+        "plate_confidence": consensus["plate_confidence"],
+        "best_frames": []
+    }
+    print(f"[DEBUG] Consensus OCR for Vehicle ID {vehicle['vehicle_id']}: {consensus['plate']} "
+          f"({consensus['plate_confidence']}) from {sum(r is not None for r in consensus['ocr_results'])} reads")
+    for shot, ocr_result in zip(vehicle['shots'], consensus["ocr_results"]):
+        plate_text = NOT_READ
+        if ocr_result is not None:
+            plate_text = "OCR_FAILED"
+            if "error" not in ocr_result and ocr_result['text']:
+                plate_text = ocr_result['text']
+        px1, py1, px2, py2 = shot['plate_box']
+        vehicle_info["best_frames"].append({
+            "frame_info": shot['frame_number'],
+            "licence_plate_details": {
+                "confidence": shot['confidence'],
+                "bounding_box": {"x1": px1, "y1": py1, "x2": px2, "y2": py2}
+            },
+            "ocr_result": plate_text
+        })
+    return vehicle_info
+
+
+def persist_vehicle(result_id, vehicle_info, best_shot, detection_type="video"):
+    """Saves the best cropped plate image for a vehicle (unless ARTIFACT_LEVEL=none) and logs its consensus plate."""
+    vehicle_id = vehicle_info["vehicle_id"]
+    plate_text = vehicle_info["plate"]
+    # Encoded and written on the artifact I/O pool, off the OCR thread
+    save_video_shot(result_id, f"vehicle_{vehicle_id}_best.jpg", best_shot['image'])
+    detection_writer.write({
+        "type": detection_type,
+        "plate": plate_text,
+        "confidence": best_shot.get("confidence", 0),
+        "plate_confidence": vehicle_info["plate_confidence"],
+        "status": "Success" if plate_text != "OCR_FAILED" else "Failed",
+        "timestamp": datetime.utcnow(),
+        "result_id": result_id
+    })
+
+
+def add_processing_time(frame_stats, seconds):
+    """Records a finished video's processing time in its frame_stats, the request histogram and the stats rollups."""
+    REQUEST_SECONDS.observe(seconds, kind="video")
+    detection_writer.record_request(round(seconds * 1000, 1))
+    frame_stats["processing_seconds"] = round(seconds, 3)
+    frame_stats["fps"] = round(frame_stats.get("frames_analyzed", 0) / seconds, 2) if seconds > 0 else 0
+
+
+def run_video_pipeline(cap, plate_detector, character_detector, vehicle_tracker, on_vehicle,
+                       ocr_mode=None, progress_callback=None, cancel_event=None,
+                       sampler=None, plate_detection_mode=PLATE_DETECTION_MODE, total_frames=0,
+                       end_frame=None, trajectory_window=0, frame_queue_size=VIDEO_QUEUE_SIZE):
     """
-    import shutil
-    RESULTS_DIR = "results"
-    os.makedirs(RESULTS_DIR, exist_ok=True)
-    result_id = str(uuid.uuid4())
-    result_folder = os.path.join(RESULTS_DIR, result_id)
-    os.makedirs(result_folder, exist_ok=True)
+    Runs the video engine as four threads linked by bounded queues:
 
+        decode -> track/detect plates -> top-K shot selection -> OCR
+
+    A vehicle that has not been seen for TRACK_FINALIZE_FRAMES analyzed frames is finalized and sent
+    to OCR while decoding continues, so OCR overlaps with decoding and memory stays flat
+    regardless of video length. Each vehicle's shots are read with consensus OCR
+    (ocr_consensus.py), which stops early once the readings agree. `on_vehicle(vehicle_info, vehicle)` is called from the OCR
+    thread once per finalized vehicle that has at least one plate shot, where `vehicle` holds
+    the stored shots (best first), its first/last frame numbers and boxes.
+
+    Decoding stops before `end_frame` if given. With `trajectory_window > 0` each vehicle
+    also keeps its first and last `trajectory_window` (frame_number, box) pairs as
+    'head_boxes' / 'tail_boxes', which is what segment stitching matches on.
+
+    `cap` is anything `sampler.read()` understands; live streams pass a frame ring buffer and
+    a small `frame_queue_size` so frames wait (and are dropped) there rather than in the pipeline.
+
+    With adaptive sampling, decode runs in lockstep with detection: the sampler picks its
+    stride from the tracks found on the previous analyzed frame, so reading ahead would keep
+    skipping frames after a vehicle has entered.
+    """
     # Map YOLO class index to vehicle type
     class_map = {2: "car", 3: "motorcycle", 5: "bus", 7: "truck"}
+    sampler = sampler or FrameSampler()
+    stop_event = threading.Event()
+    frame_queue = queue.Queue(maxsize=max(1, frame_queue_size))
+    detection_queue = queue.Queue(maxsize=VIDEO_QUEUE_SIZE)
+    vehicle_queue = queue.Queue(maxsize=VIDEO_QUEUE_SIZE)
+    errors = []
+    lockstep = sampler.mode == "adaptive"
+    analyzed = threading.Semaphore(0)  # released by the detect stage once per frame, in lockstep
+
+    def cancelled():
+        return cancel_event is not None and cancel_event.is_set()
+
+    def decode_stage():
+        while not stop_event.is_set():
+            if cancelled():
+                stop_event.set()
+                break
+            frame_nmr, frame = sampler.read(cap)
+            if frame is None or (end_frame is not None and frame_nmr >= end_frame):
+                break
+            if not _put(frame_queue, (frame_nmr, frame), stop_event):
+                break
+            while lockstep and not analyzed.acquire(timeout=0.1):
+                if stop_event.is_set():
+                    return
+
+    def detect_stage():
+        while True:
+            item = frame_queue.get()
+            if item is _END or stop_event.is_set():
+                break
+            frame_nmr, frame = item
+            if progress_callback is not None:
+                progress_callback(frame_nmr + 1, total_frames)
+
+            FRAMES.inc()
+            with timed(STAGE_SECONDS, stage="video_frame"):
+                # Stage 1: Track Vehicles
+                MODEL_CALLS.inc(model="vehicle_tracker")
+                vehicle_results = vehicle_tracker.track(frame, persist=True, classes=[2, 3, 5, 7], verbose=False)
+                # Pull all boxes off the tensor once per frame; untracked detections have no id
+                vehicle_boxes = vehicle_results[0].boxes
+                if vehicle_boxes.id is None:
+                    # Empty frames still go downstream: the select stage finalizes vehicles
+                    # that have left on every frame, not only on frames with vehicles
+                    sampler.update(0)
+                    vehicles, candidates = [], []
+                else:
+                    vehicle_xyxy = vehicle_boxes.xyxy.cpu().numpy()
+                    vehicle_ids = vehicle_boxes.id.cpu().numpy().astype(int)
+                    vehicle_classes = vehicle_boxes.cls.cpu().numpy().astype(int)
+                    sampler.update(len(vehicle_ids))
+
+                    # Stage 2: Detect Plates, on the whole frame or only inside the tracked vehicles
+                    if plate_detection_mode == "roi":
+                        plate_xyxy, plate_confs = detect_plates_in_rois(plate_detector, frame, vehicle_xyxy)
+                    else:
+                        plate_xyxy, plate_confs = detect_plates_full(plate_detector, frame)
+
+                    candidates = []
+                    for v_idx, p_idx in associate_plates(vehicle_xyxy, plate_xyxy, plate_detection_mode):
+                        px1, py1, px2, py2 = map(int, plate_xyxy[p_idx])
+                        cropped_plate = frame[py1:py2, px1:px2]
+                        if cropped_plate.size == 0:
+                            continue
+                        candidates.append((int(vehicle_ids[v_idx]), float(plate_confs[p_idx]),
+                                           (px1, py1, px2, py2), cropped_plate))
+                    vehicles = [
+                        (int(vehicle_id), class_map.get(int(class_idx), "unknown"), tuple(float(c) for c in box))
+                        for vehicle_id, class_idx, box in zip(vehicle_ids, vehicle_classes, vehicle_xyxy)
+                    ]
+            if lockstep:
+                analyzed.release()
+            if not _put(detection_queue, (frame_nmr, vehicles, candidates), stop_event):
+                break
+
+    def select_stage():
+        active = {}  # vehicle_id -> state of a vehicle that is still (recently) in view
+        last_seen = {}  # vehicle_id -> tracker call (analyzed frame) it was last seen on
+        tracker_calls = 0
+
+        def finalize(vehicle_id):
+            state = active.pop(vehicle_id)
+            del last_seen[vehicle_id]
+            if not len(state['top_k']):
+                return True
+            vehicle = {k: v for k, v in state.items() if k != 'top_k'}
+            vehicle['shots'] = state['top_k'].shots()
+            vehicle['tail_boxes'] = list(state['tail_boxes'])
+            return _put(vehicle_queue, vehicle, stop_event)
+
+        while True:
+            item = detection_queue.get()
+            if item is _END or stop_event.is_set():
+                break
+            frame_nmr, vehicles, candidates = item
+            tracker_calls += 1
+            for vehicle_id, vehicle_type, box in vehicles:
+                if vehicle_id not in active:
+                    active[vehicle_id] = {
+                        'vehicle_id': vehicle_id, 'vehicle_type': vehicle_type,
+                        'first_frame': frame_nmr, 'first_box': box, 'top_k': TopKShots(),
+                        'head_boxes': [], 'tail_boxes': deque(maxlen=trajectory_window),
+                    }
+                state = active[vehicle_id]
+                state.update({'vehicle_type': vehicle_type, 'last_frame': frame_nmr, 'last_box': box})
+                last_seen[vehicle_id] = tracker_calls
+                if trajectory_window:
+                    if len(state['head_boxes']) < trajectory_window:
+                        state['head_boxes'].append((frame_nmr, box))
+                    state['tail_boxes'].append((frame_nmr, box))
+            for vehicle_id, confidence, plate_box, crop in candidates:
+                active[vehicle_id]['top_k'].push(confidence, frame_nmr, plate_box, crop)
+            # Vehicles that have left the scene are OCR'd now rather than after the video ends
+            for vehicle_id in [v for v, seen in last_seen.items() if tracker_calls - seen > TRACK_FINALIZE_FRAMES]:
+                finalize(vehicle_id)
+        if not stop_event.is_set():
+            for vehicle_id in list(active):
+                finalize(vehicle_id)
+
+    def ocr_stage():
+        done = False
+        while not done:
+            # Batch every vehicle that is already waiting into one OCR call
+            batch = [vehicle_queue.get()]
+            while len(batch) < OCR_VEHICLE_BATCH and batch[-1] is not _END:
+                try:
+                    batch.append(vehicle_queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is _END:
+                batch.pop()
+                done = True
+            if not batch or stop_event.is_set():
+                continue
+            fused = consensus_ocr(
+                [vehicle['shots'] for vehicle in batch],
+                lambda images: run_ocr_batch(images, ocr_mode, character_detector),
+            )
+            for vehicle, consensus in zip(batch, fused):
+                on_vehicle(_build_vehicle_info(vehicle, consensus), vehicle)
+
+    def run_stage(target, downstream):
+        try:
+            target()
+        except Exception as e:
+            print(f"❌ ERROR: Video pipeline stage {target.__name__} failed: {e}")
+            errors.append(e)
+            stop_event.set()
+        finally:
+            if downstream is not None:
+                # Always unblock the next stage. Once the pipeline is stopping nothing
+                # downstream will be used, so pending items may be dropped to make room.
+                while True:
+                    try:
+                        downstream.put(_END, timeout=0.1)
+                        break
+                    except queue.Full:
+                        if stop_event.is_set():
+                            try:
+                                downstream.get_nowait()
+                            except queue.Empty:
+                                pass
+
+    stages = [
+        threading.Thread(target=run_stage, args=(decode_stage, frame_queue), name="video-decode", daemon=True),
+        threading.Thread(target=run_stage, args=(detect_stage, detection_queue), name="video-detect", daemon=True),
+        threading.Thread(target=run_stage, args=(select_stage, vehicle_queue), name="video-select", daemon=True),
+        threading.Thread(target=run_stage, args=(ocr_stage, None), name="video-ocr", daemon=True),
+    ]
+    for stage in stages:
+        stage.start()
+    for stage in stages:
+        stage.join()
 
-    vehicle_tracker = YOLO('yolov8n.pt') 
-    cap = cv2.VideoCapture(video_path)
+    if errors:
+        raise errors[0]
+    if cancelled():
+        raise VideoProcessingCancelled("Video processing was cancelled.")
+    return sampler.stats()
+
+
+def process_video_file(plate_detector, character_detector, video_path, ocr_mode=None,
+                       result_id=None, progress_callback=None, cancel_event=None,
+                       vehicle_tracker=None, sampling_mode=VIDEO_SAMPLING_MODE,
+                       frame_stride=VIDEO_FRAME_STRIDE, plate_detection_mode=PLATE_DETECTION_MODE,
+                       capture=None):
+    """
+    Processes a video file to track vehicles, find the top 5 best license plate shots for each,
+    and perform OCR on each shot.
+
+    `progress_callback(frames_processed, total_frames)` is called after every analyzed frame,
+    and setting `cancel_event` (a threading.Event) stops processing with VideoProcessingCancelled.
+
+    `vehicle_tracker` should be a fresh tracker from ModelRegistry.new_tracker(); without one
+    the tracker weights are loaded from disk for this call.
+
+    With `sampling_mode="adaptive"` only every `frame_stride`-th frame is decoded while no
+    vehicle is tracked, and frames without motion are skipped (see frame_sampler.py).
+    With `plate_detection_mode="roi"` plates are only searched for inside tracked vehicles.
+
+    `capture` is an already opened cv2.VideoCapture-like source (e.g. an FFmpegVideoReader
+    fed by an upload still in progress) to read instead of `video_path`. The caller owns
+    `video_path` and removes it afterwards; this function never deletes its input.
+    """
+    print(f"[DEBUG] OCR mode in backend: {ocr_mode}")
+    request_start = time.perf_counter()
+    result_id = result_id or str(uuid.uuid4())
+
+    if vehicle_tracker is None:
+        from ultralytics import YOLO  # imported here: loading torch is slow and only needed without a tracker
+        vehicle_tracker = YOLO(VEHICLE_TRACKER_PATH)
+    cap = capture if capture is not None else cv2.VideoCapture(video_path)
     if not cap.isOpened():
+        cap.release()
         return {"error": "Could not open video file."}
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
 
-    tracked_vehicles = {}
-    vehicle_types = {}  # vehicle_id -> type
-    frame_nmr = -1
-
-    while True:
-        frame_nmr += 1
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        # Stage 1: Track Vehicles
-        vehicle_results = vehicle_tracker.track(frame, persist=True, classes=[2, 3, 5, 7])
-        # Get class index for each vehicle
-        if hasattr(vehicle_results[0].boxes, 'cls'):
-            for box in vehicle_results[0].boxes:
-                if box.id is not None:
-                    vehicle_id = int(box.id[0])
-                    class_idx = int(box.cls[0])
-                    vehicle_types[vehicle_id] = class_map.get(class_idx, "unknown")
-
-        # Stage 2: Detect Plates in the Same Frame
-        plate_results = plate_detector(frame)
-
-        num_vehicles = len(vehicle_results[0].boxes) if hasattr(vehicle_results[0].boxes, 'id') and vehicle_results[0].boxes.id is not None else 0
-        num_plates = len(plate_results[0].boxes)
-
-        if num_vehicles > 0 and num_plates > 0:
-            for vehicle_box in vehicle_results[0].boxes:
-                if vehicle_box.id is None:
-                    continue
-                vx1, vy1, vx2, vy2 = map(int, vehicle_box.xyxy[0])
-                vehicle_id = int(vehicle_box.id[0])
-                if vehicle_id not in tracked_vehicles:
-                    tracked_vehicles[vehicle_id] = {'shots': []}
-                for plate_box in plate_results[0].boxes:
-                    px1, py1, px2, py2 = map(int, plate_box.xyxy[0])
-                    iou = calculate_iou((vx1, vy1, vx2, vy2), (px1, py1, px2, py2))
-                    if iou > 0.01:
-                        confidence = float(plate_box.conf[0])
-                        cropped_plate = frame[py1:py2, px1:px2]
-                        current_shot = {
-                            'image': cropped_plate,
-                            'confidence': confidence,
-                            'frame_number': frame_nmr,
-                            'plate_box': (px1, py1, px2, py2)
-                        }
-                        tracked_vehicles[vehicle_id]['shots'].append(current_shot)
-                        tracked_vehicles[vehicle_id]['shots'].sort(key=lambda x: x['confidence'], reverse=True)
-                        tracked_vehicles[vehicle_id]['shots'] = tracked_vehicles[vehicle_id]['shots'][:5]
-    cap.release()
-
-    print("\n--- OCR Stage ---")
     final_results = []
-    now = datetime.utcnow()
-    for vehicle_id, data in tracked_vehicles.items():
-        if not data['shots']:
-            continue
-        vehicle_info = {
-            "vehicle_id": vehicle_id,
-            "vehicle_type": vehicle_types.get(vehicle_id, "unknown"),
-            "best_frames": []
-        }
-        print(f"  - Processing top {len(data['shots'])} shots for Vehicle ID {vehicle_id}")
-        for idx, shot in enumerate(data['shots']):
-            if shot['image'] is not None and shot['image'].size > 0:
-                if ocr_mode == "roboflow":
-                    print("[DEBUG] Using Roboflow OCR branch.")
-                    print("[INFO] Using Roboflow OCR for plate text recognition.")
-                    ocr_result = roboflow_ocr_text(shot['image'])
-                    print(f"[DEBUG] Roboflow OCR result: {ocr_result}")
-                else:
-                    print("[DEBUG] Using local OCR branch.")
-                    print("[INFO] Using local YOLO OCR for plate text recognition.")
-                    ocr_result = get_yolo_ocr_text(shot['image'], character_detector)
-                    print(f"[DEBUG] Local OCR result: {ocr_result}")
-                plate_text = "OCR_FAILED"
-                if "error" not in ocr_result and ocr_result['text']:
-                    plate_text = ocr_result['text']
-                px1, py1, px2, py2 = shot['plate_box']
-                frame_details = {
-                    "frame_info": shot['frame_number'],
-                    "licence_plate_details": {
-                        "confidence": shot['confidence'],
-                        "bounding_box": {"x1": px1, "y1": py1, "x2": px2, "y2": py2}
-                    },
-                    "ocr_result": plate_text
-                }
-                vehicle_info["best_frames"].append(frame_details)
-                # Save the best cropped plate image for this vehicle (only for the first shot)
-                if idx == 0:
-                    cropped_path = os.path.join(result_folder, f"vehicle_{vehicle_id}_best.jpg")
-                    cv2.imwrite(cropped_path, shot['image'])
-                    # Log only the best frame for each vehicle
-                    detections_collection.insert_one({
-                        "type": "video",
-                        "plate": plate_text,
-                        "confidence": shot.get("confidence", 0),
-                        "status": "Success" if plate_text != "OCR_FAILED" else "Failed",
-                        "timestamp": now
-                    })
-        if vehicle_info["best_frames"]:
-            final_results.append(vehicle_info)
-    os.remove(video_path)
-    return {"tracked_vehicles": final_results, "result_id": result_id}
\ No newline at end of file
+
+    def on_vehicle(vehicle_info, vehicle):
+        persist_vehicle(result_id, vehicle_info, vehicle['shots'][0])
+        final_results.append(vehicle_info)
+
+    sampler = FrameSampler(mode=sampling_mode, base_stride=frame_stride)
+    try:
+        frame_stats = run_video_pipeline(
+            cap, plate_detector, character_detector, vehicle_tracker, on_vehicle,
+            ocr_mode=ocr_mode, progress_callback=progress_callback, cancel_event=cancel_event,
+            sampler=sampler, plate_detection_mode=plate_detection_mode, total_frames=total_frames,
+        )
+    finally:
+        cap.release()
+
+    # Vehicles are finalized in the order they left the scene; report them by track id
+    final_results.sort(key=lambda v: v["vehicle_id"])
+    add_processing_time(frame_stats, time.perf_counter() - request_start)
+    return {"tracked_vehicles": final_results, "result_id": result_id, "frame_stats": frame_stats}
@@ -0,0 +1,312 @@
+"""
+video_segments.py
+
+Processes one long video on several CPU cores at once.
+
+The video is split into time segments that overlap by VIDEO_SEGMENT_OVERLAP frames. Each
+segment is processed by the regular pipeline (run_video_pipeline) in a worker process with
+its own models, seeking to its first frame with CAP_PROP_POS_FRAMES. Track ids are local to a
+segment, so afterwards vehicles are stitched across each boundary: two tracks are the same
+vehicle if their boxes line up on the frames both segments analyzed, or failing that, if they
+read the same plate text and meet at the boundary. The merged result has the same format as
+process_video_file's. Cancelling the job (or a failing segment) stops the segments that are
+already running too, through a CancelFile the segment pipelines poll like a threading.Event.
+"""
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import cv2
+
+from frame_sampler import FrameSampler, VIDEO_SAMPLING_MODE, VIDEO_FRAME_STRIDE
+from inference_pool import init_process_worker, current_worker, worker_threads
+from video_ocr import (
+    run_video_pipeline, persist_vehicle, overlap_matrices, add_processing_time, VideoProcessingCancelled,
+    PLATE_DETECTION_MODE, TOP_K_SHOTS,
+)
+
+# --- Segment Configuration (from environment variables) ---
+VIDEO_SEGMENT_WORKERS = int(os.environ.get("VIDEO_SEGMENT_WORKERS", str(os.cpu_count() or 1)))
+VIDEO_SEGMENT_OVERLAP = int(os.environ.get("VIDEO_SEGMENT_OVERLAP", "30"))
+MIN_SEGMENT_FRAMES = int(os.environ.get("MIN_SEGMENT_FRAMES", "300"))
+# Seconds a cancelled job waits for its running segments to stop
+SEGMENT_CANCEL_TIMEOUT = float(os.environ.get("SEGMENT_CANCEL_TIMEOUT", "10"))
+STITCH_IOU = 0.5
+
+_segment_pool = None
+_segment_pool_lock = threading.Lock()
+
+
+def _get_segment_pool(workers):
+    """The segment worker processes are started (and load their models) once, on first use."""
+    global _segment_pool
+    with _segment_pool_lock:
+        if _segment_pool is None:
+            _segment_pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_process_worker,
+                initargs=(worker_threads(workers),),
+            )
+        return _segment_pool
+
+class CancelFile:
+    """
+    A cancel flag that works across processes: set() creates the file and is_set() checks for
+    it, so it can stand in for the cancel_event of a pipeline running in a segment worker.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def set(self):
+        open(self.path, "a").close()
+
+    def is_set(self):
+        return os.path.exists(self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def shutdown_segment_pool():
+    global _segment_pool
+    with _segment_pool_lock:
+        if _segment_pool is not None:
+            _segment_pool.shutdown(wait=False, cancel_futures=True)
+            _segment_pool = None
+
+
+def plan_segments(total_frames, workers, overlap=VIDEO_SEGMENT_OVERLAP, min_frames=MIN_SEGMENT_FRAMES):
+    """
+    Splits [0, total_frames) into at most `workers` segments of at least `min_frames` frames.
+    Returns (start, end) pairs; each segment except the last runs `overlap` frames past the next
+    segment's start so tracks crossing a boundary are seen by both sides.
+    """
+    if total_frames <= 0:
+        # Unknown length (some containers do not report a frame count): one segment to the end
+        return [(0, None)]
+    count = max(1, min(workers, total_frames // max(1, min_frames)))
+    size = -(-total_frames // count)
+    return [
+        (start, min(total_frames, start + size + overlap))
+        for start in range(0, total_frames, size)
+    ]
+
+
+def process_segment(video_path, start_frame, end_frame, ocr_mode=None, sampling_mode=VIDEO_SAMPLING_MODE,
+                    frame_stride=VIDEO_FRAME_STRIDE, plate_detection_mode=PLATE_DETECTION_MODE,
+                    trajectory_window=VIDEO_SEGMENT_OVERLAP, cancel_event=None):
+    """
+    Worker-process task: runs the pipeline over [start_frame, end_frame) with this worker's
+    models. `end_frame=None` runs to the end of the video. `cancel_event` is a CancelFile.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise RuntimeError(f"Could not open video file {video_path}.")
+    if start_frame:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+
+    worker = current_worker()
+    vehicles = []
+    sampler = FrameSampler(mode=sampling_mode, base_stride=frame_stride, start_frame=start_frame)
+    try:
+        frame_stats = run_video_pipeline(
+            cap, worker.plate_detector, worker.character_detector, worker.registry.new_tracker(),
+            lambda vehicle_info, vehicle: vehicles.append((vehicle_info, vehicle)),
+            ocr_mode=ocr_mode, sampler=sampler, plate_detection_mode=plate_detection_mode,
+            end_frame=end_frame, trajectory_window=trajectory_window, cancel_event=cancel_event,
+        )
+    finally:
+        cap.release()
+    return {"start_frame": start_frame, "end_frame": end_frame, "vehicles": vehicles, "frame_stats": frame_stats}
+
+
+def _plate_text(vehicle_info):
+    """The vehicle's consensus plate, or None if OCR failed."""
+    return vehicle_info["plate"] if vehicle_info["plate"] != "OCR_FAILED" else None
+
+def _continuity_score(earlier, later):
+    """Mean IoU of the two tracks' boxes on the frames both segments analyzed (0 if none)."""
+    tail = dict(earlier["tail_boxes"])
+    common = [(tail[frame], box) for frame, box in later["head_boxes"] if frame in tail]
+    if not common:
+        return 0.0
+    ious = [overlap_matrices([a], [b])[0][0, 0] for a, b in common]
+    return float(sum(ious) / len(ious))
+
+def _match_boundary(earlier_vehicles, later_vehicles, overlap):
+    """One-to-one matches (earlier index, later index) between two adjacent segments' vehicles."""
+    scored = []
+    for i, (info_a, a) in enumerate(earlier_vehicles):
+        for j, (info_b, b) in enumerate(later_vehicles):
+            if b["first_frame"] > a["last_frame"] + overlap:
+                continue
+            score = _continuity_score(a, b)
+            if score < STITCH_IOU:
+                text = _plate_text(info_a)
+                score = 0.5 if text is not None and text == _plate_text(info_b) else 0.0
+            if score > 0:
+                scored.append((score, i, j))
+    matches, used_a, used_b = [], set(), set()
+    for score, i, j in sorted(scored, reverse=True):
+        if i not in used_a and j not in used_b:
+            matches.append((i, j))
+            used_a.add(i)
+            used_b.add(j)
+    return matches
+
+def stitch_segments(segment_results, overlap=VIDEO_SEGMENT_OVERLAP):
+    """
+    Merges the per-segment vehicles into global vehicles. Returns a list of
+    (vehicle_info, best_shot) with fresh vehicle ids, ordered by first appearance.
+    """
+    # Union-find over (segment index, vehicle index)
+    parent = {}
+
+    def find(key):
+        while parent.setdefault(key, key) != key:
+            parent[key] = parent[parent[key]]
+            key = parent[key]
+        return key
+
+    for s, segment in enumerate(segment_results):
+        for v in range(len(segment["vehicles"])):
+            find((s, v))
+        if s > 0:
+            for i, j in _match_boundary(segment_results[s - 1]["vehicles"], segment["vehicles"], overlap):
+                parent[find((s, j))] = find((s - 1, i))
+
+    groups = {}
+    for s, segment in enumerate(segment_results):
+        for v, item in enumerate(segment["vehicles"]):
+            groups.setdefault(find((s, v)), []).append(item)
+
+    merged = []
+    for items in groups.values():
+        # Pool every stored shot; frames in an overlap were analyzed by both segments
+        shots, seen_frames = [], set()
+        for info, vehicle in items:
+            for frame_details, shot in zip(info["best_frames"], vehicle["shots"]):
+                if shot["frame_number"] not in seen_frames:
+                    seen_frames.add(shot["frame_number"])
+                    shots.append((frame_details, shot))
+        shots.sort(key=lambda pair: pair[1]["confidence"], reverse=True)
+        shots = shots[:TOP_K_SHOTS]
+        longest = max(items, key=lambda item: item[1]["last_frame"] - item[1]["first_frame"])
+        surest = max(items, key=lambda item: item[0]["plate_confidence"])
+        first_frame = min(vehicle["first_frame"] for _, vehicle in items)
+        merged.append((first_frame, {
+            "vehicle_type": longest[1]["vehicle_type"],
+            "plate": surest[0]["plate"],
+            "plate_confidence": surest[0]["plate_confidence"],
+            "best_frames": [frame_details for frame_details, _ in shots],
+        }, shots[0][1]))
+
+    merged.sort(key=lambda item: item[0])
+    results = []
+    for vehicle_id, (_, info, best_shot) in enumerate(merged, start=1):
+        results.append(({"vehicle_id": vehicle_id, **info}, best_shot))
+    return results
+
+
+def _stop_segments(pending, segments_cancel, video_path):
+    """
+    Drops the segments that have not started and signals the running ones to stop. The cancel
+    file is removed once they have all finished, even if that takes longer than the wait here.
+    """
+    if not pending:
+        segments_cancel.clear()
+        return
+    segments_cancel.set()
+    for future in pending:
+        future.cancel()
+    _, still_running = wait(pending, timeout=SEGMENT_CANCEL_TIMEOUT)
+    if not still_running:
+        segments_cancel.clear()
+        return
+    print(f"[WARN] {len(still_running)} segment(s) of {video_path} did not stop within {SEGMENT_CANCEL_TIMEOUT} s.")
+    remaining = set(still_running)
+    lock = threading.Lock()
+
+    def on_done(future):
+        with lock:
+            remaining.discard(future)
+            if not remaining:
+                segments_cancel.clear()
+
+    for future in still_running:
+        future.add_done_callback(on_done)
+
+
+def process_video_segmented(video_path, ocr_mode=None, result_id=None, progress_callback=None,
+                            cancel_event=None, workers=VIDEO_SEGMENT_WORKERS,
+                            overlap=VIDEO_SEGMENT_OVERLAP, **options):
+    """
+    Segment-parallel counterpart of process_video_file, with the same response format.
+    `options` are sampling_mode / frame_stride / plate_detection_mode.
+    Cancellation drops segments that have not started yet and stops the running ones
+    (waiting up to SEGMENT_CANCEL_TIMEOUT seconds for them to notice) before raising
+    VideoProcessingCancelled. The caller owns `video_path` and removes it afterwards.
+    """
+    print(f"[DEBUG] OCR mode in backend: {ocr_mode}")
+    request_start = time.perf_counter()
+    result_id = result_id or str(uuid.uuid4())
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return {"error": "Could not open video file."}
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    cap.release()
+
+    segments = plan_segments(total_frames, workers, overlap)
+    pool = _get_segment_pool(workers)
+    segments_cancel = CancelFile(os.path.join(tempfile.gettempdir(), f"anpr-segments-{uuid.uuid4()}.cancel"))
+    futures = {
+        pool.submit(process_segment, video_path, start, end, ocr_mode,
+                    trajectory_window=overlap, cancel_event=segments_cancel, **options): index
+        for index, (start, end) in enumerate(segments)
+    }
+    print(f"[INFO] Processing {total_frames} frames in {len(segments)} segments.")
+
+    segment_results = [None] * len(segments)
+    pending, frames_done = set(futures), 0
+    try:
+        while pending:
+            if cancel_event is not None and cancel_event.is_set():
+                raise VideoProcessingCancelled(f"Processing of {video_path} was cancelled.")
+            done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = futures[future]
+                segment_results[index] = future.result()
+                start, end = segments[index]
+                frames_done += (end - start) if end is not None else segment_results[index]["frame_stats"]["frames_read"]
+                if progress_callback is not None:
+                    progress_callback(min(frames_done, total_frames), total_frames)
+    except BaseException:
+        # Cancelled, or a segment failed: the other segments' work would be thrown away
+        _stop_segments(pending, segments_cancel, video_path)
+        raise
+    segments_cancel.clear()
+
+    final_results = []
+    for vehicle_info, best_shot in stitch_segments(segment_results, overlap):
+        persist_vehicle(result_id, vehicle_info, best_shot)
+        final_results.append(vehicle_info)
+
+    frame_stats = {"segments": len(segments)}
+    for segment in segment_results:
+        for key, value in segment["frame_stats"].items():
+            if isinstance(value, int):
+                frame_stats[key] = frame_stats.get(key, 0) + value
+            else:
+                frame_stats[key] = value
+    add_processing_time(frame_stats, time.perf_counter() - request_start)
+    return {"tracked_vehicles": final_results, "result_id": result_id, "frame_stats": frame_stats}